@@ -27,6 +27,9 @@ class Action(object):
         Please use :func:`from_string` to create a new Action. This will make
         sure it exists, it is imported and it is callable.
     """
+
+    __slots__ = ('mod_name', 'func_name', 'func', 'args')
+
     def __init__(self, module, func, args=None):
         """
         Initializes a newly created Action with the given module name,
@@ -90,7 +93,7 @@ class Action(object):
         """
         return callable(self.func)
 
-    def _prepare(self, kwargs=None):
+    def _prepare(self, kwargs=None, executor=None):
         """
         Updates the function arguments and creates a :class:`asyncio.Task`
         from the Action.
@@ -98,6 +101,9 @@ class Action(object):
         *kwargs* is an optional dictionnary of additional arguments to pass to
         the Action function.
 
+        *executor* is the `Executor`_ a blocking Action func runs in.
+        Defaults to the loop's default executor.
+
         .. warning::
             *kwargs* will overwrite existing keys in *self.args*.
 
@@ -117,21 +123,24 @@ class Action(object):
         else:
             # FIXME: is that clean enough ?
             task = asyncio.get_event_loop() \
-                   .run_in_executor(None,
+                   .run_in_executor(executor,
                                     functools.partial(self.func,
                                                       **self.args))
 
         return task
 
-    async def run(self, kwargs=None):
+    async def run(self, kwargs=None, executor=None):
         """
         Wraps the action in a :class:`asyncio.Task` and schedules its
         execution.
 
         *kwargs* is an (optional) dictionnary of additional arguments to pass
         to the Action function.
+
+        *executor* is an (optional) `Executor`_ to run a blocking Action func
+        in (see :func:`_prepare`).
         """
-        task = self._prepare(kwargs)
+        task = self._prepare(kwargs, executor)
 
         try:
             await task
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import concurrent.futures
+import os
+import time
+import warnings
+
+try:
+    from systemd import journal
+except ImportError:
+    journal = None
+
+from .journald import add_matches, read_entries
+from .router import Router
+
+
+# State of the current worker process (see `_initialize`):
+_router = None
+_scopes = []
+_fields = ()
+_raw_messages = False
+
+
+def _initialize(rules, scopes, fields, raw_messages, cache):
+    """
+    Initializes a worker process: builds a :class:`router.Router` from the
+    given Rules and remembers the journald settings.
+
+    .. note:: This function runs in the worker process.
+    """
+    global _router, _scopes, _fields, _raw_messages
+
+    _router = Router(rules, cache)
+    _scopes = list(scopes)
+    _fields = tuple(fields)
+    _raw_messages = raw_messages
+
+
+def _scan_slice(since, until, batch_size):
+    """
+    Scans the journald entries whose realtime timestamp is in
+    [*since*, *until*[ (in microseconds) with the worker's Router.
+
+    .. note:: This function runs in the worker process.
+
+    Returns a (number of scanned entries, hits) tuple, where *hits* is a list
+    of (timestamp, rule_index, groupdict) tuples sorted by timestamp.
+    """
+    reader = journal.Reader()
+    scanned = 0
+    hits = []
+
+    try:
+        add_matches(reader, _scopes, journal.LOG_INFO)
+
+        reader.seek_realtime(since)
+
+        while True:
+            entries = read_entries(reader, batch_size, _fields,
+                                   _raw_messages, until)
+            scanned += len(entries)
+
+            for entry in entries:
+                timestamp = entry['__REALTIME_TIMESTAMP']
+
+                for rule_index, regex_index, groupdict \
+                        in _router.scan(entry):
+                    hits.append((timestamp, rule_index, groupdict))
+
+            if len(entries) < batch_size:
+                break
+    finally:
+        reader.close()
+
+    # Journal files are interleaved, make sure hits are in order:
+    hits.sort(key=lambda hit: hit[0])
+
+    return (scanned, hits)
+
+
+class Backfill(object):
+    """
+    A Backfill runs the :class:`rule.Rule`s over a historical range of the
+    journal, as fast as possible, instead of following its tail.
+
+    The range is split into time slices that are scanned in parallel by a
+    pool of worker processes, each of them reading the journal on its own.
+    Workers only send back the hits. Slices are then merged **in timestamp
+    order** into the :class:`matches.Matches`, so that counters reach their
+    limits in the same order as they would have if Ellis had been running.
+
+    A slice that can't be scanned (e.g. unreadable journal files) is
+    counted in :attr:`failed_slices` and skipped: the other slices are still
+    merged, and :func:`report` tells that the results are partial.
+
+    By default, a Backfill is a dry run: counters are updated but no Action
+    is executed, and :func:`report` tells which Rules would have been
+    triggered and for what. With *execute*, Actions are executed just like
+    they are when following the journal (which is handy to rebuild a ban list
+    after an incident).
+    """
+    def __init__(self, rules, since, until=None, scopes=(), workers=None,
+                 slices=None, batch_size=256, fields=None, raw_messages=False,
+                 cache=None, execute=False):
+        """
+        Initializes a newly created Backfill.
+
+        *rules* is the list of :class:`rule.Rule`s.
+
+        *since* and *until* are the bounds of the range, as timestamps in
+        seconds since the epoch. *until* defaults to now.
+
+        *scopes* is the list of the scopes the journal is filtered on (see
+        :func:`journald.add_matches`).
+
+        *workers* is the number of worker processes. Defaults to the number
+        of CPUs.
+
+        *slices* is the number of time slices the range is split into.
+        Defaults to 4 slices per worker, so that a slice holding a flood of
+        entries doesn't keep the other workers waiting.
+
+        *batch_size* is the number of entries a worker reads at once.
+
+        *fields*, *raw_messages* and *cache*: see :class:`ellis.Ellis`.
+
+        *execute* tells if the Actions have to be executed.
+
+        Raises :class:`exceptions.ValueError` if the range is empty, or if
+        the number of workers or slices is not > 0.
+
+        Raises :class:`exceptions.RuntimeError` if python-systemd is not
+        available.
+        """
+        if journal is None:
+            raise RuntimeError("Reading systemd-journald requires the "
+                               "systemd-python package.")
+
+        if until is None:
+            until = time.time()
+
+        if until <= since:
+            raise ValueError("Empty range: {0} is not before {1}"
+                             .format(since, until))
+
+        if workers is not None and workers <= 0 \
+                or slices is not None and slices <= 0:
+            raise ValueError("The numbers of workers and slices must be > 0")
+
+        self.rules = list(rules)
+        self.since = since
+        self.until = until
+        self.scopes = list(scopes)
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.slices = slices if slices is not None else 4 * self.workers
+        self.batch_size = batch_size
+        self.fields = tuple(fields) if fields is not None \
+            else ('MESSAGE',) + tuple(Router.fields)
+        self.raw_messages = raw_messages
+        self.cache = cache
+        self.execute = execute
+
+        self.scanned = 0
+        self.hits = 0
+        self.failures = 0
+        self.failed_slices = 0
+        self.elapsed = 0
+        self.reached = {}
+
+    def __repr__(self):
+        """
+        """
+        return '<Backfill - since: {0}, until: {1}, slices: {2}, ' \
+               'scanned: {3}, hits: {4}>' \
+               .format(self.since, self.until, self.slices, self.scanned,
+                       self.hits)
+
+    def split(self):
+        """
+        Returns the list of (since, until) time slices, in microseconds.
+        """
+        since = int(self.since * 1000000)
+        until = int(self.until * 1000000)
+        step = max((until - since) // self.slices, 1)
+
+        bounds = list(range(since, until, step)) + [until]
+
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    async def run(self, matches):
+        """
+        Scans the range and merges the hits into the given
+        :class:`matches.Matches`, executing the Actions if needed.
+        """
+        loop = asyncio.get_event_loop()
+        start = time.monotonic()
+        tasks = []
+        futures = []
+
+        # Highest count of each index its Rule fired for:
+        self.reached = {rule.name: {} for rule in self.rules}
+
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_initialize,
+            initargs=(self.rules, self.scopes, self.fields,
+                      self.raw_messages, self.cache))
+
+        try:
+            futures = [loop.run_in_executor(executor, _scan_slice,
+                                            since, until, self.batch_size)
+                       for since, until in self.split()]
+
+            # Slices don't overlap, so merging them one after the other keeps
+            # the hits in timestamp order:
+            for (since, until), future in zip(self.split(), futures):
+                try:
+                    scanned, hits = await future
+                except Exception as e:
+                    warnings.warn("Unable to scan the slice [{0}, {1}[: {2}."
+                                  .format(since / 1000000, until / 1000000,
+                                          e))
+                    self.failed_slices += 1
+                    continue
+
+                self.scanned += scanned
+                self.hits += len(hits)
+
+                for timestamp, rule_index, groupdict in hits:
+                    rule = self.rules[rule_index]
+                    index, count, fire = matches.hit(rule, groupdict,
+                                                     timestamp / 1000000)
+
+                    if not fire:
+                        continue
+
+                    if self.execute:
+                        tasks.append(matches.run(rule, groupdict))
+
+                    reached = self.reached[rule.name]
+
+                    if count > reached.get(index, 0):
+                        reached[index] = count
+        finally:
+            # Don't block the loop until the remaining slices are scanned
+            # (e.g. when cancelled): pending slices are cancelled, running
+            # ones end in the background.
+            for future in futures:
+                future.cancel()
+
+            executor.shutdown(wait=False)
+
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, BaseException):
+                self.failures += 1
+
+        self.elapsed = time.monotonic() - start
+
+        return self
+
+    def report(self):
+        """
+        Returns a human readable report of the Backfill: for each Rule, the
+        captured values the Rule fired for and the highest count they had
+        when it fired (within the Rule's `findtime`, if any).
+
+        .. note::
+            The Rules' re-arm policies apply: a key that keeps matching
+            after the Rule fired is not counted until the Rule is re-armed.
+        """
+        lines = ["Scanned {0} entries in {1:.1f}s ({2:.0f} entries/s), "
+                 "{3} hits."
+                 .format(self.scanned, self.elapsed,
+                         self.scanned / self.elapsed if self.elapsed else 0,
+                         self.hits)]
+
+        for rule in self.rules:
+            reached = sorted(((count, index) for index, count
+                              in self.reached.get(rule.name, {}).items()),
+                             key=lambda item: item[0], reverse=True)
+
+            lines.append("{0}: {1} reached the limit ({2}){3}"
+                         .format(rule.name, len(reached), rule.limit,
+                                 '' if self.execute else ' [dry run]'))
+
+            for count, index in reached:
+                if index is not None:
+                    captures = ', '.join(
+                        '{0}={1}'.format(name, value) for name, value
+                        in rule.filter.unpack(index).items())
+                    lines.append('  |-- {0} times for {1}'
+                                 .format(count, captures))
+                else:
+                    lines.append('  |-- {0} times'.format(count))
+
+        if self.failed_slices:
+            lines.append("{0} slice(s) couldn't be scanned, results are "
+                         "partial.".format(self.failed_slices))
+
+        if self.failures:
+            lines.append("{0} Action(s) failed.".format(self.failures))
+
+        return '\n'.join(lines)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import collections
+import re
+import threading
+
+
+class MatchCache(object):
+    """
+    A MatchCache remembers the result of the last scans, so that the
+    identical journald messages produced by an attack only cost a dict
+    lookup instead of a full regular expressions sweep.
+
+    The cache has two parts:
+
+        * an *exact* cache, keyed on the message itself, that stores the
+          result of the scan (an empty result meaning that no Rule matched) ;
+        * an optional *negative* cache, keyed on a *template signature* of
+          the message (digits and addresses masked, see :func:`signature`),
+          that remembers the templates of the messages that were rejected by
+          the :class:`ruleset.RuleSet` prefilter (i.e. that don't contain
+          any of the literals required by the patterns).
+
+    Both parts are bounded and evict their least recently used entries.
+
+    A MatchCache can be shared by several threads (e.g. with the `executor`
+    matching mode): lookups and updates are made under a lock, scans are
+    not.
+
+    .. warning::
+        The negative cache assumes that two messages sharing the same
+        template contain the same required literals. This is wrong when a
+        literal contains digits or overlaps a masked token (for example
+        `port 22`), which is why the negative cache is disabled by default.
+    """
+
+    _signature_re = re.compile(r'[0-9a-f:.]*[0-9][0-9a-f:.]*', re.IGNORECASE)
+    _raw_signature_re = re.compile(_signature_re.pattern.encode('ascii'),
+                                   re.IGNORECASE)
+
+    def __init__(self, size=10000, templates_size=0):
+        """
+        Initializes a newly created MatchCache.
+
+        *size* is the maximum number of messages kept in the exact cache.
+
+        *templates_size* is the maximum number of templates kept in the
+        negative cache. 0 disables the negative cache.
+        """
+        self.size = size
+        self.templates_size = templates_size
+
+        self.entries = collections.OrderedDict()
+        self.templates = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.template_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """
+        Returns the number of messages in the exact cache.
+        """
+        return len(self.entries)
+
+    def __repr__(self):
+        """
+        """
+        return '<MatchCache - entries: {0}, templates: {1}, hits: {2}, ' \
+               'template hits: {3}, misses: {4}>' \
+               .format(len(self.entries), len(self.templates), self.hits,
+                       self.template_hits, self.misses)
+
+    def __getstate__(self):
+        """
+        Returns the state of the cache, without its lock, so that it can be
+        sent to a worker process.
+        """
+        state = dict(self.__dict__)
+        del state['lock']
+
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores the state of the cache, with a new lock.
+        """
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def signature(cls, message):
+        """
+        Returns the template signature of the given message: the message in
+        which every token containing a digit (numbers, IP addresses, ...)
+        has been replaced by `#`.
+
+        *message* can either be a `str` or raw `bytes`.
+        """
+        if isinstance(message, bytes):
+            return cls._raw_signature_re.sub(b'#', message)
+
+        return cls._signature_re.sub('#', message)
+
+    def fetch(self, ruleset, message, scan):
+        """
+        Returns the scan result for the given *message* and *ruleset*,
+        either from the cache or by calling *scan*.
+
+        *ruleset* is the :class:`ruleset.RuleSet` the message is scanned
+        with. It is part of the keys since the same message can be scanned
+        with different RuleSets.
+
+        *scan* is a callable that takes the message and returns a
+        (results, rejected) tuple, where *rejected* tells if the message was
+        rejected by the prefilter alone. Only these messages are recorded in
+        the negative cache.
+        """
+        key = (ruleset, message)
+        template_key = None
+
+        if self.templates_size:
+            template_key = (ruleset, self.signature(message))
+
+        with self.lock:
+            results = self.entries.get(key)
+
+            if results is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+
+                return results
+
+            if template_key in self.templates:
+                self.templates.move_to_end(template_key)
+                self.template_hits += 1
+
+                return ()
+
+            self.misses += 1
+
+        # Scans run outside of the lock:
+        results, rejected = scan(message)
+        results = tuple(results)
+
+        with self.lock:
+            if self.size:
+                self.entries[key] = results
+                self.entries.move_to_end(key)
+
+                if len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+
+            if template_key is not None and rejected:
+                self.templates[template_key] = True
+                self.templates.move_to_end(template_key)
+
+                if len(self.templates) > self.templates_size:
+                    self.templates.popitem(last=False)
+
+        return results
+
+    def clear(self):
+        """
+        Empties the cache. Counters are kept.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.templates.clear()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import os
+import threading
+import warnings
+
+
+class Checkpoint(object):
+    """
+    A Checkpoint keeps track of the journald cursor of the last fully
+    processed entry and saves it to a state file, so that Ellis can resume
+    where it stopped instead of losing the entries written while it was
+    down.
+
+    The cursor is only updated in memory for each processed batch. It is
+    written to the state file (and fsynced) every *interval* seconds, off the
+    event loop, and only if it changed.
+
+    The state file holds two lines: the cursor and the realtime timestamp
+    (in seconds since the epoch) of the corresponding entry.
+    """
+    def __init__(self, path, interval=5, loop=None):
+        """
+        Initializes a newly created Checkpoint.
+
+        *path* is the path to the state file.
+
+        *interval* is the time (in seconds) between two writes.
+        """
+        self.path = path
+        self.interval = interval
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+
+        self.cursor = None
+        self.timestamp = None
+        self.dirty = False
+
+        self._handle = None
+        self._saving = False
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        """
+        """
+        return '<Checkpoint - path: {0}, cursor: {1}>' \
+               .format(self.path, self.cursor)
+
+    def load(self):
+        """
+        Reads the cursor and its timestamp from the state file.
+
+        Returns a (cursor, timestamp) tuple. Both are None if the state file
+        doesn't exist or is invalid.
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                cursor, timestamp = f.read().splitlines()[:2]
+                timestamp = float(timestamp)
+        except FileNotFoundError:
+            return (None, None)
+        except (OSError, ValueError) as e:
+            warnings.warn("Unable to read the state file ({0}): {1}. "
+                          "Ignoring it.".format(self.path, e))
+            return (None, None)
+
+        self.cursor = cursor
+        self.timestamp = timestamp
+
+        return (cursor, timestamp)
+
+    def update(self, entry):
+        """
+        Records the given journald *entry* as the last fully processed one.
+        """
+        cursor = entry.get('__CURSOR')
+
+        if cursor is None:
+            return
+
+        self.cursor = cursor
+        self.timestamp = entry.get('__REALTIME_TIMESTAMP')
+
+        if hasattr(self.timestamp, 'timestamp'):
+            # `datetime` objects, as returned by systemd's converters:
+            self.timestamp = self.timestamp.timestamp()
+        elif self.timestamp is not None:
+            # Raw journald timestamps are in microseconds:
+            self.timestamp = self.timestamp / 1000000
+
+        self.dirty = True
+
+    def start(self):
+        """
+        Starts saving the state file periodically.
+        """
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+        return self
+
+    def stop(self):
+        """
+        Stops saving the state file periodically, and saves it one last
+        time, once the save in progress (if any) is done.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        with self._lock:
+            if self.dirty:
+                try:
+                    self.save()
+                except OSError as e:
+                    warnings.warn("Unable to write the state file ({0}): {1}."
+                                  .format(self.path, e))
+
+    def _tick(self):
+        """
+        Saves the state file in an executor, if needed, and schedules the
+        next save.
+        """
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+        if self.dirty and not self._saving:
+            self._saving = True
+            future = self.loop.run_in_executor(None, self.save)
+            future.add_done_callback(self._saved)
+
+    def _saved(self, future):
+        """
+        Called once the state file has been written by the executor.
+        """
+        self._saving = False
+
+        exception = future.exception()
+
+        if exception is not None:
+            warnings.warn("Unable to write the state file ({0}): {1}."
+                          .format(self.path, exception))
+
+    def save(self):
+        """
+        Writes the state file (atomically, and fsynced). If the write fails,
+        the cursor is saved again on the next round.
+
+        .. note:: This method **is** blocking.
+        """
+        with self._lock:
+            # Reset the flag first, so that an update happening while we are
+            # writing is saved on the next round:
+            self.dirty = False
+
+            cursor = self.cursor
+            timestamp = self.timestamp if self.timestamp is not None else 0
+
+            try:
+                directory = os.path.dirname(self.path)
+
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+
+                tmp_path = '{0}.tmp'.format(self.path)
+
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write('{0}\n{1}\n'.format(cursor, timestamp))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                self.dirty = True
+                raise
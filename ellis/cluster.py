@@ -0,0 +1,729 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+import secrets
+import socket
+import stat
+import types
+import warnings
+
+from .matches import Matches
+
+
+max_line = 1 << 24
+"""Maximum length of a line of the protocol, in bytes."""
+
+default_address = '/run/ellis/aggregator.sock'
+"""Address the Aggregator listens on by default."""
+
+
+def parse_address(value):
+    """
+    Converts the given string to a stream socket address: either the path of
+    a Unix socket (if it starts with `/`) or a (host, port) tuple, from
+    `host:port` (`[host]:port` for IPv6 addresses).
+
+    Raises :class:`exceptions.ValueError` if the address is invalid.
+    """
+    if value.startswith('/'):
+        return value
+
+    host, sep, port = value.rpartition(':')
+
+    if not sep or not host or not port.isdigit():
+        raise ValueError("Invalid address: {0}".format(value))
+
+    return (host.strip('[]'), int(port))
+
+
+def as_index(value):
+    """
+    Converts the given JSON value back to a Counter index (see
+    :func:`filter.Filter.pack`): arrays become tuples.
+    """
+    return tuple(value) if isinstance(value, list) else value
+
+
+def read_secret(path):
+    """
+    Reads the secret shared by the nodes and the Aggregator from the file at
+    the given *path*. Leading and trailing whitespace is ignored.
+
+    Raises :class:`exceptions.ValueError` if the file can't be read or is
+    empty.
+    """
+    try:
+        with open(path, 'rb') as f:
+            secret = f.read().strip()
+    except OSError as e:
+        raise ValueError("Unable to read {0}: {1}".format(path, e))
+
+    if not secret:
+        raise ValueError("{0} is empty".format(path))
+
+    return secret
+
+
+def sign(secret, challenge):
+    """
+    Returns the answer to the given *challenge* (see :class:`Aggregator`):
+    the hex HMAC-SHA256 of the challenge, keyed with *secret*.
+    """
+    return hmac.new(secret, challenge.encode('utf-8'), 'sha256').hexdigest()
+
+
+def is_loopback(address):
+    """
+    Tells if the given (host, port) address can only be reached from the
+    local host.
+    """
+    if address[0] == 'localhost':
+        return True
+
+    try:
+        return ipaddress.ip_address(address[0]).is_loopback
+    except ValueError:
+        return False
+
+
+async def open_connection(address):
+    """
+    Opens a stream connection to the given *address* (see
+    :func:`parse_address`).
+
+    Returns a (reader, writer) tuple.
+    """
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address, limit=max_line)
+
+    return await asyncio.open_connection(*address, limit=max_line)
+
+
+class ClusterClient(object):
+    """
+    A ClusterClient shares the counts of an Ellis instance (a node) with the
+    other nodes of a cluster, through an :class:`Aggregator`, so that an
+    offender spreading its attempts over several hosts still reaches the
+    Rules' limits.
+
+    The matches counted by the node are accumulated in
+    :attr:`matches.Matches.deltas` and sent to the Aggregator every
+    *interval* seconds, in a single line. When the sum of the counts of
+    every node reaches a Rule's limit, the Aggregator tells every node to
+    fire the Rule, which the ClusterClient does (see
+    :func:`matches.Matches.trigger`).
+
+    The protocol is made of JSON lines:
+
+        * `{"challenge": nonce}` is sent by the Aggregator when a node
+          connects ;
+        * `{"node": name, "rules": {rule name: settings}, "auth": answer}`
+          is sent by the node in return, to declare its Rules (limit,
+          findtime, re-arm policy and captures). *answer* proves that the
+          node knows the secret shared with the Aggregator (see
+          :func:`sign`), it is null when there is no secret ;
+        * `{"deltas": {rule name: [[key, count], ...]}}` is sent by a node
+          with the counts of the last interval ;
+        * `{"fire": {rule name: [key, ...]}}` is sent by the Aggregator when
+          Rules have to be fired.
+
+    Keys are the compact keys of the Counters (see
+    :func:`filter.Filter.pack`), which is why every node must use the same
+    Rules.
+
+    Counts are local while the Aggregator can't be reached: the connection
+    is retried every *retry* seconds, and the matches counted meanwhile are
+    not sent.
+    """
+
+    max_batch = 4096
+    """Maximum number of keys sent in a single line."""
+
+    def __init__(self, address, matches, rules, fired, node=None, interval=1,
+                 retry=5, secret=None, loop=None):
+        """
+        Initializes a newly created ClusterClient.
+
+        *address* is the address of the Aggregator (see
+        :func:`parse_address`).
+
+        *matches* is the :class:`matches.Matches` of the node and *rules* its
+        list of :class:`rule.Rule`s.
+
+        *fired* is called with the :class:`asyncio.Task` of each Action
+        fired on behalf of the Aggregator.
+
+        *node* is the name of the node. Defaults to the host name.
+
+        *interval* is the time (in seconds) between two batches of counts.
+
+        *secret* is the secret shared with the Aggregator (see
+        :func:`read_secret`), if any.
+        """
+        self.address = address
+        self.matches = matches
+        self.rules = {rule.name: rule for rule in rules}
+        self.fired = fired
+        self.node = node if node is not None else socket.gethostname()
+        self.interval = interval
+        self.retry = retry
+        self.secret = secret
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+
+        self.sent = 0
+        self.received = 0
+        self.connected = False
+
+        self._task = None
+
+    def __repr__(self):
+        """
+        """
+        return '<ClusterClient - address: {0}, connected: {1}, ' \
+               'sent: {2}, received: {3}>' \
+               .format(self.address, self.connected, self.sent,
+                       self.received)
+
+    def hello(self, challenge):
+        """
+        Returns the line sent to the Aggregator in return to the given
+        *challenge*, declaring the Rules.
+        """
+        rules = {name: {
+            'limit': rule.limit,
+            'findtime': rule.findtime,
+            'rearm': rule.rearm,
+            'rearm_ttl': rule.rearm_ttl,
+            'reset_on_fire': rule.reset_on_fire,
+            'counting': rule.counting,
+            'sketch_error': rule.sketch_error,
+            'sketch_confidence': rule.sketch_confidence,
+            'layout': rule.filter.layout,
+        } for name, rule in self.rules.items()}
+
+        auth = sign(self.secret, challenge) if self.secret else None
+
+        return json.dumps({'node': self.node, 'rules': rules,
+                           'auth': auth}) + '\n'
+
+    def batches(self, deltas):
+        """
+        Yields the lines holding the given *deltas* (see
+        :attr:`matches.Matches.deltas`), :attr:`max_batch` keys at most per
+        line. A batch that can't be encoded is dropped, with a warning.
+        """
+        batch = {}
+        size = 0
+
+        for name, counts in deltas.items():
+            for index, count in counts.items():
+                batch.setdefault(name, []).append((index, count))
+                size += 1
+
+                if size >= self.max_batch:
+                    yield from self.encode(batch)
+                    batch = {}
+                    size = 0
+
+        if batch:
+            yield from self.encode(batch)
+
+    @staticmethod
+    def encode(batch):
+        """
+        Yields the line holding the given *batch* of deltas, if it can be
+        encoded.
+        """
+        try:
+            line = json.dumps({'deltas': batch}) + '\n'
+        except (TypeError, ValueError) as e:
+            warnings.warn("Unable to send counts to the aggregator: {0}."
+                          .format(e))
+        else:
+            yield line
+
+    def start(self):
+        """
+        Connects to the Aggregator and starts sharing the counts.
+        """
+        self._task = asyncio.ensure_future(self.run())
+
+        return self
+
+    def stop(self):
+        """
+        Stops sharing the counts.
+        """
+        self.matches.deltas = None
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        """
+        Keeps a connection to the Aggregator open.
+        """
+        warned = False
+
+        while True:
+            try:
+                reader, writer = await open_connection(self.address)
+            except OSError as e:
+                if not warned:
+                    warnings.warn("Unable to reach the aggregator ({0}): {1}. "
+                                  "Counts are local until it is back."
+                                  .format(self.address, e))
+                    warned = True
+
+                await asyncio.sleep(self.retry)
+                continue
+
+            warned = False
+            self.connected = True
+
+            try:
+                await self.session(reader, writer)
+            except Exception as e:
+                # Whatever goes wrong, keep on reconnecting:
+                warnings.warn("Lost the aggregator ({0}): {1}."
+                              .format(self.address, e))
+            finally:
+                self.connected = False
+                self.matches.deltas = None
+                writer.close()
+
+            await asyncio.sleep(self.retry)
+
+    async def session(self, reader, writer):
+        """
+        Sends the counts every *interval* seconds and fires the Rules as
+        told by the Aggregator, until the connection is lost.
+        """
+        line = await asyncio.wait_for(reader.readline(), self.retry)
+        message = json.loads(line.decode('utf-8')) if line else None
+
+        if not isinstance(message, dict) \
+                or not isinstance(message.get('challenge'), str):
+            raise ConnectionError("no challenge received")
+
+        writer.write(self.hello(message['challenge']).encode('utf-8'))
+        self.matches.deltas = {}
+
+        receiving = asyncio.ensure_future(self.receive(reader))
+
+        try:
+            while not receiving.done():
+                await asyncio.wait([receiving], timeout=self.interval)
+
+                deltas, self.matches.deltas = self.matches.deltas, {}
+
+                for line in self.batches(deltas):
+                    writer.write(line.encode('utf-8'))
+                    self.sent += 1
+
+                await writer.drain()
+        finally:
+            receiving.cancel()
+
+        # Raises the error that ended the connection, if any:
+        receiving.result()
+
+    async def receive(self, reader):
+        """
+        Reads the lines sent by the Aggregator and fires the Rules.
+
+        Raises :class:`exceptions.ConnectionError` once the connection is
+        closed.
+        """
+        while True:
+            line = await reader.readline()
+
+            if not line:
+                raise ConnectionError("connection closed")
+
+            self.received += 1
+            message = json.loads(line.decode('utf-8'))
+
+            if not isinstance(message, dict):
+                raise ValueError("invalid message")
+
+            for name, keys in message.get('fire', {}).items():
+                rule = self.rules.get(name)
+
+                if rule is None:
+                    continue
+
+                for key in keys:
+                    task = self.matches.trigger(rule, as_index(key))
+
+                    if task is not None:
+                        self.fired(task)
+
+
+class Aggregator(object):
+    """
+    An Aggregator sums the counts of every node of a cluster (see
+    :class:`ClusterClient`), and tells every node to fire a Rule when the
+    total count of a key reaches the Rule's limit.
+
+    When a *secret* is given, nodes must prove they know it when they
+    connect (see :class:`ClusterClient`), otherwise they are disconnected.
+    The Aggregator tells every node to ban whatever the counts it receives
+    say, so a TCP address must not be reachable by untrusted peers without
+    a secret: this is why :func:`main` only accepts a loopback TCP address
+    (or a Unix socket) without a secret. The secret doesn't encrypt the
+    traffic: use a private network or a tunnel between hosts.
+
+    The Rules are declared by the nodes when they connect. Counts are kept
+    in a :class:`matches.Matches`, in which time is given by the clock of
+    the Aggregator: a Rule's `findtime` window and re-arm policy apply to
+    the time the counts were received.
+
+    When nodes declare a Rule with different settings (e.g. during a
+    rolling upgrade), the counts of the nodes that don't use the current
+    definition are ignored. Once no connected node declares the current
+    definition anymore, it is replaced, and the counts of the Rule are
+    reset (see :func:`rule`).
+    """
+
+    max_buffer = 1 << 22
+    """A node whose unsent data exceeds this size (in bytes) is
+    disconnected."""
+
+    hello_timeout = 10
+    """A node that doesn't declare its Rules within this time (in seconds)
+    after connecting is disconnected."""
+
+    def __init__(self, address, max_keys=None, policy='lru', secret=None,
+                 loop=None):
+        """
+        Initializes a newly created Aggregator.
+
+        *address* is the address to listen on (see :func:`parse_address`).
+
+        *max_keys* and *policy*: see :class:`matches.Matches`.
+
+        *secret* is the secret shared with the nodes (see
+        :func:`read_secret`), if any.
+        """
+        self.address = address
+        self.secret = secret
+        self.matches = Matches(max_keys, policy)
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+
+        self.rules = {}
+        self.nodes = {}
+        self.writers = set()
+        self.ignored = set()
+        self.server = None
+        self.received = 0
+        self.fires = 0
+
+    def __repr__(self):
+        """
+        """
+        return '<Aggregator - address: {0}, nodes: {1}, rules: {2}, ' \
+               'received: {3}, fires: {4}>' \
+               .format(self.address, len(self.writers), len(self.rules),
+                       self.received, self.fires)
+
+    async def start(self):
+        """
+        Starts listening.
+
+        A Unix socket left behind by a previous Aggregator that didn't stop
+        cleanly is removed first.
+        """
+        if isinstance(self.address, str):
+            self.unlink()
+            self.server = await asyncio.start_unix_server(
+                self.handle, self.address, limit=max_line)
+        else:
+            self.server = await asyncio.start_server(
+                self.handle, *self.address, limit=max_line)
+
+        return self
+
+    def stop(self):
+        """
+        Stops listening and disconnects the nodes.
+        """
+        if self.server is not None:
+            self.server.close()
+
+        for writer in self.writers:
+            writer.close()
+
+        if isinstance(self.address, str):
+            self.unlink()
+
+    def unlink(self):
+        """
+        Removes the Unix socket the Aggregator listens on, if it exists.
+        Anything else than a socket is left untouched.
+        """
+        try:
+            if stat.S_ISSOCK(os.stat(self.address).st_mode):
+                os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    def authenticate(self, challenge, answer):
+        """
+        Tells if the given *answer* to the given *challenge* proves that the
+        node knows the secret. Any answer is accepted when there is no
+        secret.
+        """
+        if self.secret is None:
+            return True
+
+        return isinstance(answer, str) \
+            and hmac.compare_digest(sign(self.secret, challenge), answer)
+
+    def declare(self, writer, node, rules):
+        """
+        Registers the Rules declared by the given *node*, connected through
+        the given *writer*.
+
+        Raises :class:`exceptions.ValueError` if the declaration is invalid.
+        """
+        if not isinstance(rules, dict) \
+                or not all(isinstance(s, dict) for s in rules.values()):
+            raise ValueError("Invalid Rules declaration")
+
+        self.nodes[writer] = (node, {
+            name: types.SimpleNamespace(name=name, max_keys=None, **settings)
+            for name, settings in rules.items()
+        })
+
+    def rule(self, writer, name):
+        """
+        Returns the Rule the counts of the given Rule *name* received
+        through the given *writer* are added to, or None if they are
+        ignored.
+
+        The counts are ignored if the node didn't declare the Rule, or
+        declared it with other settings than the current definition while
+        another connected node still declares the current one. Otherwise, the
+        node's definition becomes the current one, and the counts of the
+        Rule are reset if its settings changed.
+        """
+        node, declared = self.nodes.get(writer, (None, {}))
+        rule = declared.get(name)
+
+        if rule is None:
+            return None
+
+        known = self.rules.get(name)
+
+        if known is not None and vars(known) != vars(rule):
+            if any(vars(other.get(name, rule)) == vars(known)
+                   for _, other in self.nodes.values()):
+                if (writer, name) not in self.ignored:
+                    warnings.warn("Node {0} declares Rule '{1}' with other "
+                                  "settings, its counts are ignored."
+                                  .format(node, name))
+                    self.ignored.add((writer, name))
+
+                return None
+
+            warnings.warn("Rule '{0}' redefined by node {1}, its counts are "
+                          "reset.".format(name, node))
+            self.matches.pop(name, None)
+            known = None
+
+        if known is None:
+            self.rules[name] = known = rule
+
+        return known
+
+    def add(self, writer, deltas):
+        """
+        Adds the given *deltas* (see :class:`ClusterClient`), received
+        through the given *writer*, to the counts.
+
+        Returns a dict of {rule name: [key, ...]} holding the keys the Rules
+        fire for.
+
+        Raises :class:`exceptions.ValueError` if the deltas are invalid.
+        """
+        fire = {}
+
+        if not isinstance(deltas, dict):
+            raise ValueError("Invalid deltas")
+
+        for name, counts in deltas.items():
+            rule = self.rule(writer, name)
+
+            if rule is None:
+                continue
+
+            for key, count in counts:
+                if type(count) is not int or count <= 0:
+                    raise ValueError("Invalid count for Rule '{0}': "
+                                     "{1}".format(name, [key, count]))
+
+                count, fired = self.matches.update(rule, as_index(key),
+                                                   amount=count)
+
+                if fired:
+                    fire.setdefault(name, []).append(key)
+                    self.fires += 1
+
+        return fire
+
+    def broadcast(self, fire):
+        """
+        Tells every node to fire the Rules for the given keys.
+        """
+        line = (json.dumps({'fire': fire}) + '\n').encode('utf-8')
+
+        for writer in list(self.writers):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                warnings.warn("A node doesn't keep up, disconnecting it.")
+                writer.close()
+                self.writers.discard(writer)
+                continue
+
+            writer.write(line)
+
+    async def hello(self, reader, writer):
+        """
+        Challenges a node that just connected, and reads its answer.
+
+        Returns the name of the node.
+
+        Raises :class:`exceptions.PermissionError` if the node doesn't know
+        the secret, or :class:`exceptions.ValueError` if its answer is
+        invalid.
+        """
+        challenge = secrets.token_hex(16)
+        writer.write((json.dumps({'challenge': challenge}) + '\n')
+                     .encode('utf-8'))
+
+        line = await asyncio.wait_for(reader.readline(), self.hello_timeout)
+        message = json.loads(line.decode('utf-8')) if line else None
+
+        if not isinstance(message, dict) or 'node' not in message:
+            raise ValueError("no Rules declared")
+
+        if not self.authenticate(challenge, message.get('auth')):
+            raise PermissionError("authentication failed")
+
+        self.declare(writer, message['node'], message.get('rules', {}))
+
+        return message['node']
+
+    async def handle(self, reader, writer):
+        """
+        Handles the connection of a node.
+        """
+        node = None
+
+        try:
+            node = await self.hello(reader, writer)
+            self.writers.add(writer)
+            print("Node {0} connected.".format(node))
+
+            while True:
+                line = await reader.readline()
+
+                if not line:
+                    break
+
+                self.received += 1
+                message = json.loads(line.decode('utf-8'))
+
+                if not isinstance(message, dict):
+                    raise ValueError("Invalid message")
+
+                fire = self.add(writer, message.get('deltas', {}))
+
+                if fire:
+                    self.broadcast(fire)
+        except (OSError, ValueError, TypeError, asyncio.TimeoutError) as e:
+            warnings.warn("Node {0}: {1}.".format(
+                node if node is not None
+                else writer.get_extra_info('peername'), e))
+        finally:
+            self.writers.discard(writer)
+            self.nodes.pop(writer, None)
+            self.ignored = {i for i in self.ignored if i[0] is not writer}
+            writer.close()
+
+            if node is not None:
+                print("Node {0} disconnected.".format(node))
+
+
+def main():
+    """
+    Entry point for the Ellis aggregator.
+    """
+    argp = argparse.ArgumentParser(
+        prog='ellis-aggregator',
+        description="Sums the counts of several Ellis instances.")
+
+    argp.add_argument("-l", "--listen",
+                      metavar='ADDRESS',
+                      help="listen on ADDRESS: host:port, or the path of a "
+                           "Unix socket (defaults to {0}). A TCP address "
+                           "that isn't a loopback one requires a secret"
+                           .format(default_address),
+                      default=default_address,
+                      type=parse_address)
+
+    argp.add_argument("--secret-file",
+                      metavar='PATH',
+                      help="only accept the nodes knowing the secret held "
+                           "in PATH (their `cluster_secret_file`)",
+                      dest='secret',
+                      type=read_secret)
+
+    argp.add_argument("--max-keys",
+                      metavar='N',
+                      help="maximum number of tracked keys (defaults to "
+                           "1000000, 0 means no limit)",
+                      default=1000000,
+                      type=int)
+
+    argp.add_argument("--eviction-policy",
+                      help="which keys are evicted when there are too many "
+                           "of them",
+                      choices=Matches.policies,
+                      default='lru')
+
+    args = argp.parse_args()
+
+    if not isinstance(args.listen, str) and args.secret is None \
+            and not is_loopback(args.listen):
+        argp.error("listening on {0} lets anyone reaching it ban any address "
+                   "on every node: use a Unix socket, a loopback address or "
+                   "--secret-file".format(':'.join(map(str, args.listen))))
+
+    loop = asyncio.get_event_loop()
+    aggregator = Aggregator(args.listen, args.max_keys or None,
+                            args.eviction_policy, args.secret, loop)
+
+    loop.run_until_complete(aggregator.start())
+
+    print("Aggregating on {0}.".format(args.listen))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.stop()
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
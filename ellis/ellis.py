@@ -8,41 +8,291 @@ import os
 import signal
 import warnings
 
-from systemd import journal
-
+from .backfill import Backfill
+from .cache import MatchCache
+from .checkpoint import Checkpoint
+from .cluster import ClusterClient, parse_address, read_secret
 from .exceptions import NoRuleError
 from .matches import Matches
+from .pipeline import Pipeline
+from .pool import MatchingPool
+from .router import Router
 from .rule import Rule
-from .search_matches import SearchMatches
+from .scheduler import ActionScheduler
+from .snapshot import Snapshot
+from .sources import FileSource, JournalSource, SyslogSource
+
+
+def positive_int(value):
+    """
+    Converts the given string to an integer that must be strictly > 0.
+
+    Raises :class:`exceptions.ValueError` if it's not the case.
+    """
+    value = int(value)
+
+    if value <= 0:
+        raise ValueError("{0} is not > 0".format(value))
+
+    return value
+
+
+def non_negative_int(value):
+    """
+    Converts the given string to an integer that must be >= 0.
+
+    Raises :class:`exceptions.ValueError` if it's not the case.
+    """
+    value = int(value)
+
+    if value < 0:
+        raise ValueError("{0} is not >= 0".format(value))
+
+    return value
+
+
+def boolean(value):
+    """
+    Converts the given string to a boolean, the same way
+    :func:`configparser.ConfigParser.getboolean` does.
+
+    Raises :class:`exceptions.ValueError` if the string is not a boolean.
+    """
+    try:
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError("{0} is not a boolean".format(value))
+
+
+def tailed_files(value):
+    """
+    Converts the given string to a list of (path, unit) tuples. Each line of
+    the string is a path, optionally followed by a systemd unit name (to
+    which `.service` is appended if needed).
+
+    Raises :class:`exceptions.ValueError` if a line is invalid.
+    """
+    files = []
+
+    for line in value.splitlines():
+        words = line.split()
+
+        if not words:
+            continue
+
+        if len(words) > 2:
+            raise ValueError("Invalid file: {0}".format(line))
+
+        path = words[0]
+        unit = words[1] if len(words) > 1 else None
+
+        if unit is not None and not unit.endswith('.service'):
+            unit += '.service'
+
+        files.append((path, unit))
+
+    return files
+
+
+def syslog_address(value):
+    """
+    Converts the given string to a syslog socket address: either the path of
+    a Unix socket (if it starts with `/`) or a (host, port) tuple, from
+    `host:port` (`[host]:port` for IPv6 addresses).
+
+    Raises :class:`exceptions.ValueError` if the address is invalid.
+    """
+    if value.startswith('/'):
+        return value
+
+    host, sep, port = value.rpartition(':')
+
+    if not sep or not host:
+        raise ValueError("Invalid address: {0}".format(value))
+
+    return (host.strip('[]'), positive_int(port))
+
+
+def priorities(value):
+    """
+    Converts the given syslog priority (a number from 0 to 7 or its name) to
+    the tuple of the journald `PRIORITY` values that are at least as high.
+
+    Raises :class:`exceptions.ValueError` if the priority is invalid.
+    """
+    names = ('emerg', 'alert', 'crit', 'err', 'warning', 'notice', 'info',
+             'debug')
+
+    value = value.strip().lower()
+
+    if value in names:
+        level = names.index(value)
+    else:
+        level = int(value)
+
+        if not 0 <= level < len(names):
+            raise ValueError("{0} is not a priority".format(value))
+
+    return tuple(str(i) for i in range(level + 1))
+
+
+def positive_float(value):
+    """
+    Converts the given string to a float that must be strictly > 0.
+
+    Raises :class:`exceptions.ValueError` if it's not the case.
+    """
+    value = float(value)
+
+    if value <= 0:
+        raise ValueError("{0} is not > 0".format(value))
+
+    return value
+
+
+def non_negative_float(value):
+    """
+    Converts the given string to a float that must be >= 0.
+
+    Raises :class:`exceptions.ValueError` if it's not the case.
+    """
+    value = float(value)
+
+    if value < 0:
+        raise ValueError("{0} is not >= 0".format(value))
+
+    return value
+
+
+def probability(value):
+    """
+    Converts the given string to a float that must be in ]0, 1[.
+
+    Raises :class:`exceptions.ValueError` if it's not the case.
+    """
+    value = float(value)
+
+    if not 0 < value < 1:
+        raise ValueError("{0} is not in ]0, 1[".format(value))
+
+    return value
+
+
+def per_module(convert):
+    """
+    Returns a function converting a string to a dict of
+    {action module: value}. Each line of the string is the name of an
+    action module followed by its value, which is converted with *convert*.
+
+    The returned function raises :class:`exceptions.ValueError` if a line is
+    invalid.
+    """
+    def converter(value):
+        values = {}
+
+        for line in value.splitlines():
+            words = line.split()
+
+            if not words:
+                continue
+
+            if len(words) != 2:
+                raise ValueError("Invalid line: {0}".format(line))
+
+            values[words[0]] = convert(words[1])
+
+        return values
+
+    return converter
 
 
 class Ellis(object):
     """
     """
-    def __init__(self, config_file=None):
+
+    settings_section = 'ellis'
+    """Name of the config file section holding Ellis' own settings. This
+    section is not considered as a Rule."""
+
+    matching_modes = ('inline', 'executor', 'process')
+
+    def __init__(self, config_file=None, sources=None):
         """
         Initializes a newly created Ellis object.
 
         The initialization process takes care of reading the configuration
         file and build the necessary parts (rules, systemd units to watch,...)
         according to it.
+
+        *sources* is a list of :class:`sources.Source`s providing the
+        entries. By default, the sources are built from the settings (see
+        :func:`load_settings`).
         """
+        self.sources = sources
         self.rules = []
-        self.units = set()
+        self.router = None
+        self.scopes = []
+        self.matching = 'inline'
+        self.workers = None
+        self.batch_size = 256
+        self.pool = None
+        self.cache = None
+        self.cache_size = 10000
+        self.negative_cache_size = 0
+        self.pipeline = None
+        self.actions = set()
+        self.started = None
+        self.batch_wait = 0.05
+        self.queue_size = 64
+        self.queue_policy = 'block'
+        self.queue_workers = 2
+        self.checkpoint = None
+        self.cursor_file = '/var/lib/ellis/cursor'
+        self.checkpoint_interval = 5
+        self.max_catchup = 86400
+        self.snapshot = None
+        self.state_file = '/var/lib/ellis/state.db'
+        self.snapshot_interval = 30
+        self.cluster = None
+        self.aggregator = None
+        self.cluster_interval = 1
+        self.cluster_secret = None
+        self.node_name = None
+        self.scheduler = None
+        self.action_workers = 64
+        self.action_concurrency = 8
+        self.action_limits = {}
+        self.action_priorities = {}
+        self.action_queue_size = 10000
+        self.action_queue_policy = 'lowest'
+        self.raw_messages = False
+        self.max_keys = 1000000
+        self.eviction_policy = 'lru'
+        self.journal = True
+        self.files = []
+        self.syslog_socket = None
+        self.fields = ('MESSAGE',) + tuple(Router.fields)
         self.config = configparser.ConfigParser()
 
-        # Load config, rules and units:
+        # Load config, settings, rules and units:
         self.load_config(config_file) \
+            .load_settings() \
             .load_rules() \
             .load_units()
 
         # If we have rules, we can setup the matches object and the loop.
         # If not, an exception should have been raised.
-        self.journal_reader = journal.Reader()
-        self.matches = Matches()
+        self.matches = Matches(self.max_keys or None, self.eviction_policy)
         self.loop = asyncio.get_event_loop()
         self.loop.set_exception_handler(self.exceptions_handler)
 
+        # Actions go through the scheduler:
+        self.scheduler = ActionScheduler(
+            self.action_workers, self.action_concurrency, self.action_limits,
+            self.action_priorities, self.action_queue_size,
+            self.action_queue_policy, self.loop)
+        self.matches.scheduler = self.scheduler
+
     def __enter__(self):
         """
         """
@@ -85,6 +335,210 @@ class Ellis(object):
 
         return self
 
+    def get_setting(self, option, default, convert=str, choices=None):
+        """
+        Reads the given *option* from the settings section of the config file.
+
+        *default* is returned when the option is not set, or when its value is
+        invalid (in which case a warning is issued).
+
+        *convert* is a callable used to convert the raw string value. It must
+        raise :class:`exceptions.ValueError` when the value is invalid.
+
+        *choices* is an optional collection of the allowed values.
+        """
+        try:
+            raw_value = self.config.get(self.settings_section, option)
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            return default
+
+        try:
+            value = convert(raw_value)
+        except ValueError:
+            value = None
+        else:
+            if choices is None or value in choices:
+                return value
+
+        warnings.warn("Setting '{0}': invalid value ('{1}'). "
+                      "Going on with the default value of {2}."
+                      .format(option, raw_value, default))
+
+        return default
+
+    def load_settings(self):
+        """
+        Loads Ellis' own settings from the `[ellis]` section of the config
+        file. All settings are optional:
+
+            * `matching`: how journald entries are checked against the Rules.
+              `inline` (the default) checks them directly on the loop,
+              `executor` checks each batch of entries in an `Executor`_ and
+              `process` spreads the batches over a pool of worker processes
+              (see :class:`pool.MatchingPool`).
+            * `workers`: number of worker processes used by the `process`
+              matching mode. Defaults to the number of CPUs.
+            * `batch_size`: maximum number of entries read from journald at
+              once (and sent to a worker process at once). Defaults to 256.
+            * `batch_wait`: maximum time (in seconds) a partial batch waits
+              before being processed. Defaults to 0.05.
+            * `queue_size`: maximum number of batches waiting to be
+              processed. Defaults to 64.
+            * `queue_policy`: what happens when the queue is full. `block`
+              (the default) stops reading journald until there is room again,
+              `drop` drops the new entries.
+            * `queue_workers`: number of tasks processing the batches.
+              Defaults to 2.
+            * `cache_size`: number of messages whose match results are
+              memoized (see :class:`cache.MatchCache`). Defaults to 10000,
+              0 disables the cache.
+            * `negative_cache_size`: number of message templates known to
+              match nothing that are memoized. Defaults to 0 (disabled).
+            * `cursor_file`: path to the file where the journald cursor of the
+              last processed entry is saved, so that Ellis can resume where
+              it stopped (see :class:`checkpoint.Checkpoint`). Defaults to
+              `/var/lib/ellis/cursor`. An empty value disables it.
+            * `checkpoint_interval`: time (in seconds) between two writes of
+              the cursor file. Defaults to 5.
+            * `max_catchup`: maximum age (in seconds) of the entries Ellis
+              catches up with when it starts. Defaults to 86400, 0 means no
+              limit.
+            * `state_file`: path to the SQLite database where the counts of
+              the tracked keys are saved, so that they survive a restart
+              (see :class:`snapshot.Snapshot`). Defaults to
+              `/var/lib/ellis/state.db`. An empty value disables it.
+            * `snapshot_interval`: time (in seconds) between two saves of the
+              counts. Defaults to 30.
+            * `aggregator`: address of the aggregator the counts are shared
+              with, when several hosts run Ellis (see
+              :class:`cluster.ClusterClient`): `host:port`, or the path of a
+              Unix socket. Disabled by default.
+            * `cluster_interval`: time (in seconds) between two batches of
+              counts sent to the aggregator. Defaults to 1.
+            * `cluster_secret_file`: path to the file holding the secret
+              shared with the aggregator (see :class:`cluster.Aggregator`).
+              Required when the aggregator has one.
+            * `node_name`: name of this host in the cluster. Defaults to the
+              host name.
+            * `action_workers`: maximum number of Actions running at once
+              (see :class:`scheduler.ActionScheduler`). Defaults to 64.
+            * `action_concurrency`: maximum number of Actions of a given
+              action module running at once. Defaults to 8.
+            * `action_limits`: per action module concurrency limits, one
+              module per line, followed by its limit.
+            * `action_priorities`: per action module priorities, one module
+              per line, followed by its priority. The lower, the sooner.
+              Defaults to 0 for `ipset` and `nftables`, 20 for `mail` and
+              `sendmail` and 10 for the other modules.
+            * `action_queue_size`: maximum number of Actions waiting to run.
+              Defaults to 10000.
+            * `action_queue_policy`: what happens when the Actions queue is
+              full. `lowest` (the default) drops the newest Action of the
+              lowest priority, if it's lower than the new Action's one,
+              `drop` drops the new Action.
+            * `raw_messages`: if `yes`, journald messages are matched as raw
+              bytes, without being decoded (see :class:`ruleset.RuleSet`).
+              Note that case-insensitive matching then only folds ASCII
+              letters. Defaults to `no`.
+            * `max_keys`: maximum number of keys (distinct captured values)
+              tracked by all the Rules together. Defaults to 1000000, 0
+              means no limit. A Rule can also have its own `max_keys`
+              option.
+            * `eviction_policy`: which keys are evicted when there are too
+              many of them: `lru` (the default) evicts the least recently
+              seen ones, `lowest` the ones with the lowest counts (see
+              :class:`matches.Counter`).
+            * `journal`: if `no`, systemd-journald is not read. Defaults to
+              `yes`.
+            * `files`: log files to tail (see :class:`sources.FileSource`),
+              one per line. Each path can be followed by the systemd unit the
+              lines of the file are attributed to (`.service` is appended if
+              needed), so that the Rules scoped to this unit apply to them.
+            * `syslog_socket`: address of a datagram socket receiving syslog
+              messages (see :class:`sources.SyslogSource`): either the path
+              of a Unix socket or `host:port` for UDP. Messages are
+              attributed to the unit named after their syslog tag.
+
+        See :class:`pipeline.Pipeline` for further details about batches and
+        the queue.
+
+        .. _Executor: https://docs.python.org/3/library/asyncio-eventloop.html#executor
+        """
+        self.matching = self.get_setting('matching', self.matching,
+                                         choices=self.matching_modes)
+        self.workers = self.get_setting('workers', self.workers,
+                                        positive_int)
+        self.batch_size = self.get_setting('batch_size', self.batch_size,
+                                           positive_int)
+        self.cache_size = self.get_setting('cache_size', self.cache_size,
+                                           non_negative_int)
+        self.negative_cache_size = self.get_setting(
+            'negative_cache_size', self.negative_cache_size, non_negative_int)
+        self.batch_wait = self.get_setting('batch_wait', self.batch_wait,
+                                           non_negative_float)
+        self.queue_size = self.get_setting('queue_size', self.queue_size,
+                                           positive_int)
+        self.queue_policy = self.get_setting('queue_policy',
+                                             self.queue_policy,
+                                             choices=Pipeline.policies)
+        self.queue_workers = self.get_setting('queue_workers',
+                                              self.queue_workers,
+                                              positive_int)
+        self.cursor_file = self.get_setting('cursor_file', self.cursor_file)
+        self.checkpoint_interval = self.get_setting('checkpoint_interval',
+                                                    self.checkpoint_interval,
+                                                    positive_float)
+        self.max_catchup = self.get_setting('max_catchup', self.max_catchup,
+                                            non_negative_float)
+        self.state_file = self.get_setting('state_file', self.state_file)
+        self.snapshot_interval = self.get_setting('snapshot_interval',
+                                                  self.snapshot_interval,
+                                                  positive_float)
+        self.aggregator = self.get_setting('aggregator', self.aggregator,
+                                           parse_address)
+        self.cluster_interval = self.get_setting('cluster_interval',
+                                                 self.cluster_interval,
+                                                 positive_float)
+        self.cluster_secret = self.get_setting('cluster_secret_file',
+                                               self.cluster_secret,
+                                               read_secret)
+        self.node_name = self.get_setting('node_name', self.node_name)
+        self.action_workers = self.get_setting('action_workers',
+                                               self.action_workers,
+                                               positive_int)
+        self.action_concurrency = self.get_setting('action_concurrency',
+                                                   self.action_concurrency,
+                                                   positive_int)
+        self.action_limits = self.get_setting('action_limits',
+                                              self.action_limits,
+                                              per_module(positive_int))
+        self.action_priorities = self.get_setting('action_priorities',
+                                                  self.action_priorities,
+                                                  per_module(int))
+        self.action_queue_size = self.get_setting('action_queue_size',
+                                                  self.action_queue_size,
+                                                  positive_int)
+        self.action_queue_policy = self.get_setting(
+            'action_queue_policy', self.action_queue_policy,
+            choices=ActionScheduler.policies)
+        self.raw_messages = self.get_setting('raw_messages',
+                                             self.raw_messages, boolean)
+        self.max_keys = self.get_setting('max_keys', self.max_keys,
+                                         non_negative_int)
+        self.eviction_policy = self.get_setting('eviction_policy',
+                                                self.eviction_policy,
+                                                choices=Matches.policies)
+        self.journal = self.get_setting('journal', self.journal, boolean)
+        self.files = self.get_setting('files', self.files, tailed_files)
+        self.syslog_socket = self.get_setting('syslog_socket',
+                                              self.syslog_socket,
+                                              syslog_address)
+
+        if self.cache_size or self.negative_cache_size:
+            self.cache = MatchCache(self.cache_size, self.negative_cache_size)
+
+        return self
+
     def load_rules(self):
         """
         Loads the Rules from the config file.
@@ -94,6 +548,9 @@ class Ellis(object):
         """
         for rule_name in self.config.sections():
 
+            if rule_name == self.settings_section:
+                continue
+
             limit = 1
 
             try:
@@ -108,6 +565,119 @@ class Ellis(object):
                               "option. Going on with the default value of 1."
                               .format(rule_name))
 
+            findtime = None
+
+            try:
+                findtime = positive_float(self.config.get(rule_name,
+                                                          'findtime'))
+            except ValueError:
+                warnings.warn("Rule '{0}': invalid value for 'findtime' "
+                              "option. Findtime must be a number > 0. "
+                              "Matches will be counted forever."
+                              .format(rule_name))
+            except configparser.NoOptionError:
+                pass
+
+            max_keys = None
+
+            try:
+                max_keys = positive_int(self.config.get(rule_name,
+                                                        'max_keys'))
+            except ValueError:
+                warnings.warn("Rule '{0}': invalid value for 'max_keys' "
+                              "option. It must be an integer > 0. "
+                              "Only the global limit applies."
+                              .format(rule_name))
+            except configparser.NoOptionError:
+                pass
+
+            rearm = 'ttl'
+
+            try:
+                rearm = self.config.get(rule_name, 'rearm')
+            except configparser.NoOptionError:
+                pass
+
+            if rearm not in Rule.rearm_policies:
+                warnings.warn("Rule '{0}': invalid value for 'rearm' option. "
+                              "It must be one of {1}. Going on with the "
+                              "default value of 'ttl'."
+                              .format(rule_name,
+                                      ', '.join(Rule.rearm_policies)))
+                rearm = 'ttl'
+
+            rearm_ttl = 600
+
+            try:
+                rearm_ttl = positive_float(self.config.get(rule_name,
+                                                           'rearm_ttl'))
+            except ValueError:
+                warnings.warn("Rule '{0}': invalid value for 'rearm_ttl' "
+                              "option. It must be a number > 0. "
+                              "Going on with the default value of 600."
+                              .format(rule_name))
+            except configparser.NoOptionError:
+                pass
+
+            reset_on_fire = False
+
+            try:
+                reset_on_fire = boolean(self.config.get(rule_name,
+                                                        'reset_on_fire'))
+            except ValueError:
+                warnings.warn("Rule '{0}': invalid value for 'reset_on_fire' "
+                              "option. Going on with the default value of "
+                              "False.".format(rule_name))
+            except configparser.NoOptionError:
+                pass
+
+            counting = 'exact'
+
+            try:
+                counting = self.config.get(rule_name, 'counting')
+            except configparser.NoOptionError:
+                pass
+
+            if counting not in Rule.counting_modes:
+                warnings.warn("Rule '{0}': invalid value for 'counting' "
+                              "option. It must be one of {1}. Going on with "
+                              "the default value of 'exact'."
+                              .format(rule_name,
+                                      ', '.join(Rule.counting_modes)))
+                counting = 'exact'
+
+            if counting == 'approximate' and findtime is None:
+                warnings.warn("Rule '{0}': 'approximate' counting requires "
+                              "a 'findtime'. Going on with the default value "
+                              "of 'exact'.".format(rule_name))
+                counting = 'exact'
+
+            sketch_error = 0.0001
+
+            try:
+                sketch_error = probability(self.config.get(rule_name,
+                                                           'sketch_error'))
+            except ValueError:
+                warnings.warn("Rule '{0}': invalid value for 'sketch_error' "
+                              "option. It must be a number in ]0, 1[. "
+                              "Going on with the default value of 0.0001."
+                              .format(rule_name))
+            except configparser.NoOptionError:
+                pass
+
+            sketch_confidence = 0.99
+
+            try:
+                sketch_confidence = probability(
+                    self.config.get(rule_name, 'sketch_confidence'))
+            except ValueError:
+                warnings.warn("Rule '{0}': invalid value for "
+                              "'sketch_confidence' option. It must be a "
+                              "number in ]0, 1[. Going on with the default "
+                              "value of 0.99.".format(rule_name))
+            except configparser.NoOptionError:
+                pass
+
             try:
                 filter_str = self.config.get(rule_name, 'filter')
                 action_str = self.config.get(rule_name, 'action')
@@ -116,7 +686,12 @@ class Ellis(object):
                               .format(rule_name, e))
             else:
                 try:
-                    rule = Rule(rule_name, filter_str, limit, action_str)
+                    rule = Rule(rule_name, filter_str, limit, action_str,
+                                findtime=findtime, max_keys=max_keys,
+                                rearm=rearm, rearm_ttl=rearm_ttl,
+                                reset_on_fire=reset_on_fire,
+                                counting=counting, sketch_error=sketch_error,
+                                sketch_confidence=sketch_confidence)
                 except ValueError as e:
                     warnings.warn("Ignoring '{0}' rule: {1}."
                                   .format(rule_name, e))
@@ -130,32 +705,46 @@ class Ellis(object):
 
     def load_units(self):
         """
-        Build a set of systemd units that Ellis will watch.
+        Reads the scope of each Rule and builds the list of scopes that
+        journald has to filter the entries on.
+
+        A Rule can be scoped with the following options:
 
-        This set will be used to filter journald entries so that we only
-        process entries that were produced by these units.
-        This should result in better performance.
+            * `systemd_unit`: the systemd unit (`_SYSTEMD_UNIT` field) ;
+            * `syslog_identifier`: the syslog identifier (`SYSLOG_IDENTIFIER`
+              field) ;
+            * `priority`: the lowest priority (`PRIORITY` field), either a
+              number (0 to 7) or a name (`emerg`, `alert`, `crit`, `err`,
+              `warning`, `notice`, `info`, `debug`). Entries of this priority
+              and of the higher ones apply ;
+            * `transport`: how the entry was received by journald
+              (`_TRANSPORT` field: `journal`, `syslog`, `stdout`, ...).
+
+        Each scope is pushed down to journald (see
+        :func:`journald.add_matches`), so that we only read the entries that
+        at least one Rule applies to. This should result in better
+        performance. Of course, this is not possible as soon as a Rule has
+        no scope at all: journald-side filtering is then turned off for all
+        the Rules, and every entry is read. Only the Python-side routing
+        still keeps the scoped Rules away from the entries they don't apply
+        to.
+
+        The scopes are also used to only check an entry against the Rules
+        that apply to it (see :class:`router.Router`).
         """
+        unscoped = False
+
         # Of course, we only consider valid Rules.
         for rule in self.rules:
+            rule.syslog_identifier = self.config.get(
+                rule.name, 'syslog_identifier', fallback=None)
+            rule.transport = self.config.get(rule.name, 'transport',
+                                             fallback=None)
+
             try:
                 systemd_unit = self.config.get(rule.name, 'systemd_unit')
-
             except configparser.NoOptionError:
-                warnings.warn("Rule '{0}' doesn't have a `systemd_unit` "
-                              "option set.\nThe filters will be checked "
-                              "against all journald entries, which will "
-                              "probably result in poor performance."
-                              .format(rule.name))
-
-                # At this point,  we can clear `self.units` because in any
-                # case, we will need to process every journald entries
-                # for THIS Rule.
-                self.units.clear()
-
-                # And we can also stop looping through rules.
-                break
-
+                pass
             else:
                 # Append ".service" if not present.
                 # Note that we don't check if the service actually exists.
@@ -163,27 +752,91 @@ class Ellis(object):
                 if not systemd_unit.endswith(".service"):
                     systemd_unit += ".service"
 
-                self.units.add(systemd_unit)
+                rule.systemd_unit = systemd_unit
+
+            try:
+                priority = self.config.get(rule.name, 'priority')
+            except configparser.NoOptionError:
+                pass
+            else:
+                try:
+                    rule.priority = priorities(priority)
+                except ValueError:
+                    warnings.warn("Rule '{0}': invalid value for 'priority' "
+                                  "option ('{1}'). It will be ignored."
+                                  .format(rule.name, priority))
+
+            scope = Router.scope(rule)
+
+            if not scope:
+                warnings.warn("Rule '{0}' doesn't have any scope option "
+                              "set (`systemd_unit`, `syslog_identifier`, "
+                              "`priority` or `transport`).\nIts filters will "
+                              "be checked against all journald entries, and "
+                              "journald will no longer filter the entries of "
+                              "the other Rules, which will probably result "
+                              "in poor performance.".format(rule.name))
+
+                # In any case, we will need to process every journald entries
+                # for THIS Rule.
+                unscoped = True
+
+            elif scope not in self.scopes:
+                self.scopes.append(scope)
+
+        if unscoped:
+            self.scopes.clear()
+
+        # Only fetch the fields that are needed for routing:
+        self.fields = ('MESSAGE',) + tuple(
+            field for field in Router.fields
+            if any(field in Router.scope(rule) for rule in self.rules))
+
+        self.router = Router(self.rules, self.cache)
 
         return self
 
-    def reader(self):
+    async def process_entries(self, entries):
         """
+        Scans the given journald entries against the Rules that apply to
+        them and updates the matches accordingly.
+
+        Depending on the `matching` setting, the whole batch is either
+        checked inline, in a single executor call or in the worker processes.
         """
-        op = self.journal_reader.process()
+        if self.matching == 'process':
+            results = await self.pool.search_batch(entries)
+        elif self.matching == 'executor':
+            results = await self.loop.run_in_executor(
+                None, self.router.search_batch, entries)
+        else:
+            results = self.router.search_batch(entries)
+
+        for entry, hits in zip(entries, results):
+            timestamp = entry.get('__REALTIME_TIMESTAMP')
 
-        if op is journal.APPEND:
-            for entry in self.journal_reader:
-                # print("{__REALTIME_TIMESTAMP} {MESSAGE}".format(**entry))
-                asyncio.ensure_future(self.process_entry(entry["MESSAGE"]))
+            if timestamp is not None:
+                timestamp /= 1000000
 
-    async def process_entry(self, message):
+            for rule, regex, groupdict in hits:
+                task = await self.matches.add(rule, groupdict, timestamp)
+
+                if task is not None:
+                    self.track_action(task)
+
+    def track_action(self, task):
         """
+        Keeps track of the given Action task until it's done.
         """
-        for rule in self.rules:
-            async for match in SearchMatches(rule, message):
-                if match:
-                    await self.matches.add(rule, match.groupdict())
+        self.actions.add(task)
+        task.add_done_callback(self.actions.discard)
+
+    async def process_entry(self, entry):
+        """
+        Scans the given journald entry against the Rules that apply to it and
+        updates the matches accordingly.
+        """
+        await self.process_entries([entry])
 
     def start(self):
         """
@@ -191,32 +844,233 @@ class Ellis(object):
         print("Starting Ellis with {0} rule{1}."
               .format(len(self.rules), 's' if len(self.rules) > 1 else ''))
 
-        # Configure our journal:
-        self.journal_reader.log_level(journal.LOG_INFO)
-
-        # And seek to the end so we can get new messages:
-        self.journal_reader.seek_tail()
-        self.journal_reader.get_previous()
+        self.started = self.loop.time()
 
         # DEBUG MODE:
         # self.loop.set_debug(True)
 
-        # Configure our journald reader to watch only some units:
-        for unit in self.units:
-            self.journal_reader.add_match(_SYSTEMD_UNIT=unit)
+        if self.sources is None:
+            self.sources = self.build_sources()
+
+            # Restore the counts of the previous run:
+            if self.state_file:
+                self.snapshot = Snapshot(self.state_file,
+                                         self.snapshot_interval, self.loop) \
+                    .load(self.matches, self.rules)
+
+            # Share the counts with the other hosts:
+            if self.aggregator is not None:
+                self.cluster = ClusterClient(self.aggregator, self.matches,
+                                             self.rules, self.track_action,
+                                             self.node_name,
+                                             self.cluster_interval,
+                                             secret=self.cluster_secret,
+                                             loop=self.loop)
+
+        # Start the worker processes before we start reading:
+        if self.matching == 'process':
+            self.pool = MatchingPool(self.rules, self.workers,
+                                     self.batch_size, self.cache).start()
+
+        self.pipeline = Pipeline(
+            self.read_entries, self.process_entries,
+            batch_size=self.batch_size, batch_wait=self.batch_wait,
+            queue_size=self.queue_size, policy=self.queue_policy,
+            workers=self.queue_workers,
+            done=self.checkpoint_batch if self.checkpoint else None,
+            loop=self.loop).start()
 
-        # Then add our journald reader to our loop:
-        self.loop.add_reader(self.journal_reader.fileno(), self.reader)
+        if self.checkpoint is not None:
+            self.checkpoint.start()
+
+        if self.snapshot is not None:
+            self.snapshot.start()
+
+        if self.cluster is not None:
+            self.cluster.start()
+
+        self.loop.add_signal_handler(signal.SIGUSR1, self.print_stats)
+
+        # Then let the sources feed the pipeline:
+        for source in self.sources:
+            source.start(self.loop, self.pipeline.drain, self.finished)
 
         return self
 
+    def build_sources(self):
+        """
+        Builds the list of :class:`sources.Source`s from the settings.
+        """
+        sources = []
+
+        if self.journal:
+            # Follow journald, resuming where we stopped:
+            if self.cursor_file:
+                self.checkpoint = Checkpoint(self.cursor_file,
+                                             self.checkpoint_interval,
+                                             self.loop)
+
+            sources.append(JournalSource(self.scopes, self.fields,
+                                         self.raw_messages, self.checkpoint,
+                                         self.max_catchup))
+
+        for path, unit in self.files:
+            sources.append(FileSource(path, unit, self.fields,
+                                      self.raw_messages))
+
+        if self.syslog_socket is not None:
+            sources.append(SyslogSource(self.syslog_socket, self.fields,
+                                        self.raw_messages))
+
+        if not sources:
+            warnings.warn("Neither journald, files nor a syslog socket are "
+                          "read. Ellis will be idle.")
+
+        return sources
+
+    def read_entries(self, max_entries):
+        """
+        Reads at most *max_entries* new entries from the sources.
+
+        The source that is read first changes on each call, so that a busy
+        source can't starve the others.
+
+        Returns a list of entries, which is empty when there is no new entry.
+        """
+        entries = []
+
+        for source in self.sources:
+            entries.extend(source.read(max_entries - len(entries)))
+
+            if len(entries) >= max_entries:
+                break
+
+        if len(self.sources) > 1:
+            self.sources.append(self.sources.pop(0))
+
+        return entries
+
+    def finished(self):
+        """
+        Called once a finite source (see :class:`sources.ReplaySource`) has
+        been fully read: stops Ellis once every entry has been processed.
+        """
+        async def stop():
+            await self.pipeline.join()
+
+            if self.actions:
+                await asyncio.wait(self.actions)
+
+            elapsed = self.loop.time() - self.started
+
+            print("Processed {0} entries in {1:.1f}s ({2:.0f} entries/s)."
+                  .format(self.pipeline.entries, elapsed,
+                          self.pipeline.entries / elapsed if elapsed else 0))
+
+            self.loop.stop()
+
+        asyncio.ensure_future(stop())
+
+    def checkpoint_batch(self, batch):
+        """
+        Records the last entry of the given batch as the last processed
+        entry (see :class:`checkpoint.Checkpoint`).
+        """
+        # Only journald entries have a cursor:
+        for entry in reversed(batch):
+            if '__CURSOR' in entry:
+                self.checkpoint.update(entry)
+                break
+
+    def backfill(self, since, until=None, slices=None, execute=False):
+        """
+        Runs the Rules over the journal entries written between *since* and
+        *until* (timestamps in seconds since the epoch), instead of following
+        the journal, and prints a report (see :class:`backfill.Backfill`).
+
+        *slices* is the number of time slices the range is split into.
+
+        If *execute* is False (the default), no Action is executed.
+
+        .. note:: This method **is** blocking.
+        """
+        print("Backfilling with {0} rule{1}{2}."
+              .format(len(self.rules), 's' if len(self.rules) > 1 else '',
+                      '' if execute else ' (dry run)'))
+
+        backfill = Backfill(self.rules, since, until, scopes=self.scopes,
+                            workers=self.workers, slices=slices,
+                            batch_size=self.batch_size, fields=self.fields,
+                            raw_messages=self.raw_messages, cache=self.cache,
+                            execute=execute)
+
+        try:
+            self.loop.run_until_complete(backfill.run(self.matches))
+        finally:
+            self.loop.close()
+
+        print(backfill.report())
+
+        return backfill
+
+    def print_stats(self):
+        """
+        Prints a few statistics about the pipeline, the cache, the Actions
+        and the tracked keys. Called on `SIGUSR1`.
+        """
+        print("Pipeline: {0} entries read, {1}".format(
+            self.pipeline.entries, self.pipeline))
+
+        print("Actions: {0}".format(self.scheduler))
+
+        for name, queued, running, limit, done, dropped, wait, max_wait \
+                in self.scheduler.stats():
+            print("  |-- {0}: {1} queued, {2}/{3} running, {4} done, "
+                  "{5} dropped, waited {6:.1f} ms on average ({7:.1f} ms max)"
+                  .format(name, queued, running, limit, done, dropped,
+                          wait * 1000, max_wait * 1000))
+
+        if self.cache is not None:
+            print("Cache: {0}".format(self.cache))
+
+        if self.cluster is not None:
+            print("Cluster: {0}".format(self.cluster))
+
+        stats = self.matches.stats()
+
+        print("Tracked keys: {0}{1}, about {2} KiB".format(
+            sum(keys for name, keys, size, evicted in stats),
+            ' (max: {0})'.format(self.matches.max_keys)
+            if self.matches.max_keys else '',
+            sum(size for name, keys, size, evicted in stats) // 1024))
+
+        for name, keys, size, evicted in stats:
+            print("  |-- {0}: {1} keys, about {2} KiB, {3} evicted"
+                  .format(name, keys, size // 1024, evicted))
+
     def exit(self):
         """
         """
-        self.loop.remove_reader(self.journal_reader.fileno())
+        self.loop.remove_signal_handler(signal.SIGUSR1)
+
+        for source in self.sources:
+            source.stop()
+
+        if self.cluster is not None:
+            self.cluster.stop()
+
+        self.loop.run_until_complete(self.pipeline.stop())
+
+        self.scheduler.stop()
+
+        if self.checkpoint is not None:
+            self.checkpoint.stop()
+
+        if self.snapshot is not None:
+            self.snapshot.stop()
 
-        self.journal_reader.flush_matches()
-        self.journal_reader.close()
+        if self.pool is not None:
+            self.pool.shutdown()
 
         self.loop.stop()
         self.loop.close()
@@ -229,7 +1083,7 @@ class Ellis(object):
     def exceptions_handler(self, loop, context):
         """
         """
-        exception = context['exception']
+        exception = context.get('exception')
 
         print("CAUGHT EXCEPTION:\n")
         print("  Message: {0}\n".format(context['message']))
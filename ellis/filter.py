@@ -2,10 +2,81 @@
 # coding: utf-8
 
 
+import functools
+import ipaddress
 import re
-import sre_constants
+import sys
 import warnings
 
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    # Python < 3.11:
+    import sre_constants
+    import sre_parse
+
+
+_IPV4 = (r'(?:(?:25[0-5]|2[0-4][0-9]|1[0-9]{2}|[1-9]?[0-9])\.){3}'
+         r'(?:25[0-5]|2[0-4][0-9]|1[0-9]{2}|[1-9]?[0-9])(?![0-9])')
+
+_IPV6 = (r'(?:[0-9a-f]{0,4}:){2,7}[0-9a-f]{0,4}'  # Hexadecimal groups
+         r'(?:\.[0-9]{1,3}){0,3}')                # Embedded IPv4
+
+_HOST_LABEL = r'[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?'
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_capture(tag, value):
+    """
+    Converts the given captured *value* according to the given *tag*
+    (see :attr:`Filter.tag_types`).
+
+    Results are kept in a LRU cache, so that the same offender doesn't get
+    parsed again and again.
+
+    Returns the converted value, or None if *value* is not valid.
+    """
+    try:
+        return Filter.tag_types[tag](value)
+    except ValueError:
+        return None
+
+
+_IPV6_FLAG = 1 << 128
+
+
+def _encode_ip(value):
+    """
+    Packs the given :class:`ipaddress.IPv4Address` or
+    :class:`ipaddress.IPv6Address` into an int. IPv6 addresses are flagged
+    with bit 128 so that they never collide with IPv4 addresses.
+    """
+    if value.version == 6:
+        return int(value) | _IPV6_FLAG
+
+    return int(value)
+
+
+def _decode_ip(value):
+    """
+    Unpacks an address packed by :func:`_encode_ip`.
+    """
+    if value & _IPV6_FLAG:
+        return ipaddress.IPv6Address(value ^ _IPV6_FLAG)
+
+    return ipaddress.IPv4Address(value)
+
+
+def _encode_value(value):
+    """
+    Packs an untyped captured value: strings are interned, so that an
+    offender showing up in several keys (or Rules) is stored once.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+
+    return value
+
 
 class Filter(list):
     """
@@ -30,35 +101,103 @@ class Filter(list):
         pre-built regular expressions. They are available in
         `Filter.known_tags`.
 
-        Currently, :class:`Filter` supports 2 tags :
+        Currently, :class:`Filter` supports these tags :
 
-            * <IP> : matches both IPv4 and IPv6 addresses (and more).
+            * <IPv4> : matches an IPv4 address.
+            * <IPv6> : matches an IPv6 address.
+            * <IP> : matches both IPv4 and IPv6 addresses.
             * <PORT> : matches a valid port number (1..65534).
+            * <USER> : matches a user name.
+            * <HOST> : matches a host name.
+
+        Tags are also *typed*: when a named group only holds a tag (for
+        example `(?P<ip><IP>)`), the captured value is validated and
+        converted when a match is found (see :func:`convert`). An IP address
+        is thus converted to an :class:`ipaddress.IPv4Address` or
+        :class:`ipaddress.IPv6Address`, a port to an :class:`int`. A match
+        whose captures are not valid is rejected.
+
+    .. note::
+        For each pattern, the Filter also keeps the longest literal string the
+        pattern requires to match (see :func:`extract_literal`). These
+        literals are used by :class:`ruleset.RuleSet` to reject messages that
+        can't match any pattern without running a single regular expression.
+
+    .. note::
+        The named groups of all the patterns make up the *layout* of the
+        Filter, declared once when the Filter is built (see :func:`pack`).
+        Matches are counted under a compact key following this layout,
+        instead of a copy of their captures. A group that is typed in one
+        pattern but not in another one is validated, but not converted, so
+        that an offender gets the same key whatever the pattern it matched.
 
     .. note::
         Please use :func:`from_string` to create a new Filter. This will make
         sure the given regular expression(s) is (are) valid.
     """
 
+    __slots__ = ('literals', 'types', 'layout', 'encoders', 'untyped')
+
+    min_literal_length = 3
+    """Required literals shorter than this are not worth prefiltering."""
+
     known_tags = {
-        '<IP>': ('\S+'),
+        '<IPv4>': _IPV4,
 
-        '<PORT>': (r'([1-9]'            # 1..9
-                   r'|[1-9][0-9]{1,3}'  # 10..9999
-                   r'|[1-5][0-9]{4}'    # 10000..59999
-                   r'|6[0-4][0-9]{3}'   # 60000..64999
-                   r'|65[0-4][0-9]{2}'  # 65000..65499
+        '<IPv6>': _IPV6,
+
+        '<IP>': '(?:{0}|{1})'.format(_IPV4, _IPV6),
+
+        '<USER>': r'[\w.@+$-]{1,256}',
+
+        '<HOST>': r'{0}(?:\.{0})*\.?'.format(_HOST_LABEL),
+
+        # Longest alternatives first, so that "22" isn't captured as "2":
+        '<PORT>': (r'(6553[0-4]'        # 65530..65534
                    r'|655[0-2][0-9]'    # 65500..65529
-                   r'|6553[0-4])'),     # 65530..65534
+                   r'|65[0-4][0-9]{2}'  # 65000..65499
+                   r'|6[0-4][0-9]{3}'   # 60000..64999
+                   r'|[1-5][0-9]{4}'    # 10000..59999
+                   r'|[1-9][0-9]{1,3}'  # 10..9999
+                   r'|[1-9])(?![0-9])'),  # 1..9
+    }
+
+    tag_types = {
+        '<IPv4>': ipaddress.IPv4Address,
+        '<IPv6>': ipaddress.IPv6Address,
+        '<IP>': ipaddress.ip_address,
+        '<PORT>': int,
+        '<USER>': str,
+        '<HOST>': str,
+    }
+    """Converters used for the values captured by typed tags. A converter
+    must raise :class:`exceptions.ValueError` for invalid values."""
+
+    tag_encoders = {
+        '<IPv4>': (int, ipaddress.IPv4Address),
+        '<IPv6>': (int, ipaddress.IPv6Address),
+        '<IP>': (_encode_ip, _decode_ip),
+        '<PORT>': (int, int),
     }
+    """(encoder, decoder) of the converted values of typed tags, used to
+    pack them in keys. Other values are interned (see
+    :func:`_encode_value`)."""
 
-    def __init__(self, regexes):
+    def __init__(self, regexes, literals=None, types=None):
         """
         Initializes a newly created Filter with the given list of
         :class:`re.RegexObject`.
 
         *regexes* is a list of :class:`re.RegexObject`s.
 
+        *literals* is an optional list holding, for each regex, the literal
+        string required by the regex (or None). When not given, literals are
+        extracted from the regexes.
+
+        *types* is an optional list holding, for each regex, a dict of
+        {group name: tag} for the typed groups of the regex. When not given,
+        types are extracted from the regexes.
+
         Raises :class:`exceptions.ValueError` if the given list evaluates to
         False (empty list, None, ...)
         """
@@ -68,6 +207,22 @@ class Filter(list):
             raise ValueError("Unable to initialize a Filter without at least "
                              "one valid pattern, please fix your config file")
 
+        if literals is None:
+            literals = [self.extract_literal(regex) for regex in self]
+
+        self.literals = literals
+
+        if types is None:
+            types = [self.extract_types(regex) for regex in self]
+
+        self.types = types
+        self.layout = self.build_layout(self, types)
+        self.encoders = tuple(
+            self.tag_encoders.get(tag, (_encode_value, None))[0]
+            for name, tag in self.layout)
+        self.untyped = frozenset(name for name, tag in self.layout
+                                 if tag is None)
+
     @classmethod
     def replace_tags(cls, raw_filter):
         """
@@ -84,6 +239,190 @@ class Filter(list):
 
         return raw_filter
 
+    @classmethod
+    def _literal_runs(cls, subpattern):
+        """
+        Walks through the given parsed pattern (as returned by
+        :func:`re._parser.parse`) and collects the runs of consecutive
+        literal characters that **must** be present for the pattern to match.
+
+        Alternations and optional parts are skipped since their literals are
+        not required.
+
+        Returns a list of strings.
+        """
+        runs = []
+        current = []
+
+        for op, av in subpattern:
+            if op is sre_constants.LITERAL:
+                current.append(chr(av))
+                continue
+
+            if op is sre_constants.AT:
+                # Anchors don't consume anything, the run goes on.
+                continue
+
+            runs.append(''.join(current))
+            current = []
+
+            if op is sre_constants.SUBPATTERN:
+                runs.extend(cls._literal_runs(av[-1]))
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+                min_repeat, max_repeat, item = av
+
+                if min_repeat > 0:
+                    runs.extend(cls._literal_runs(item))
+
+        runs.append(''.join(current))
+
+        return runs
+
+    @classmethod
+    def extract_literal(cls, regex):
+        """
+        Extracts the longest literal string that the given
+        :class:`re.RegexObject` requires to match.
+
+        Returns the literal, or None if the regex doesn't require a literal
+        of at least :attr:`min_literal_length` characters (in which case
+        every message has to be scanned with the regex).
+        """
+        if not isinstance(regex.pattern, str):
+            return None
+
+        try:
+            parsed = sre_parse.parse(regex.pattern, regex.flags)
+        except re.error:
+            return None
+
+        literal = max(cls._literal_runs(parsed), key=len)
+
+        return literal if len(literal) >= cls.min_literal_length else None
+
+    @classmethod
+    def extract_types(cls, regex):
+        """
+        Finds the named groups of the given :class:`re.RegexObject` that only
+        hold a typed tag.
+
+        Returns a dict of {group name: tag}.
+        """
+        types = {}
+
+        for name in regex.groupindex:
+            for tag in cls.tag_types:
+                group = '(?P<{0}>{1})'.format(name, cls.known_tags[tag])
+
+                if group in regex.pattern:
+                    types[name] = tag
+                    break
+
+        return types
+
+    @classmethod
+    def build_layout(cls, regexes, types):
+        """
+        Builds the layout of the keys of the given :class:`re.RegexObject`s:
+        a tuple of (group name, tag) sorted by group name, covering the named
+        groups of all the regexes.
+
+        *types* holds, for each regex, the dict of its typed groups (see
+        :func:`extract_types`). A group is only considered typed if it has
+        the same tag in every regex it appears in. Its tag is None otherwise.
+        """
+        tags = {}
+
+        for regex, regex_types in zip(regexes, types):
+            for name in regex.groupindex:
+                tag = regex_types.get(name)
+
+                if name in tags and tags[name] != tag:
+                    tag = None
+
+                tags[name] = tag
+
+        return tuple((sys.intern(name), tags[name]) for name in sorted(tags))
+
+    def pack(self, groupdict):
+        """
+        Returns the compact key of the given *groupdict* (the converted
+        captures of one of the patterns, see :func:`convert`), following the
+        layout of the Filter:
+
+            * None if the Filter has no named group (or no *groupdict*) ;
+            * the packed value itself if the Filter has a single named group ;
+            * a tuple of packed values otherwise.
+
+        Addresses are packed as ints, ports are ints and strings are interned.
+        Groups missing from *groupdict* (because they belong to another
+        pattern) or that didn't participate in the match are None.
+        """
+        if not groupdict:
+            return None
+
+        key = tuple(None if value is None else encode(value)
+                    for encode, value
+                    in zip(self.encoders,
+                           (groupdict.get(name) for name, tag in self.layout)))
+
+        return key[0] if len(key) == 1 else key
+
+    def unpack(self, key):
+        """
+        Returns the dict of {group name: value} of the given *key* (as
+        returned by :func:`pack`), without the groups that are None.
+        """
+        if key is None:
+            return {}
+
+        if len(self.layout) == 1:
+            key = (key,)
+
+        captures = {}
+
+        for (name, tag), value in zip(self.layout, key):
+            if value is None:
+                continue
+
+            decode = self.tag_encoders.get(tag, (None, None))[1]
+            captures[name] = decode(value) if decode is not None else value
+
+        return captures
+
+    def convert(self, index, groupdict):
+        """
+        Validates and converts the typed values of *groupdict*, the captures
+        of the regex at the given *index*. Values of groups that are untyped
+        in the layout (see :func:`build_layout`) are only validated.
+
+        Returns a new dict holding the converted values, or None if one of
+        the typed values is not valid (in which case the match has to be
+        rejected).
+        """
+        types = self.types[index]
+
+        if not types:
+            return groupdict
+
+        converted = dict(groupdict)
+
+        for name, tag in types.items():
+            value = groupdict[name]
+
+            if value is None:
+                continue
+
+            value = parse_capture(tag, value)
+
+            if value is None:
+                return None
+
+            if name not in self.untyped:
+                converted[name] = value
+
+        return converted
+
     @classmethod
     def build_regex_list(cls, filter_str, rule_limit):
         """
@@ -111,7 +450,7 @@ class Filter(list):
         for f in filter_str.splitlines():
             try:
                 regex = re.compile(f, flags=re.MULTILINE|re.IGNORECASE)
-            except sre_constants.error:
+            except re.error:
                 warnings.warn("Unable to compile this pattern: \"{0}\". "
                               "It will be ignored"
                               .format(f))
@@ -141,6 +480,9 @@ class Filter(list):
 
         *rule_limit* is the Rule's limit above which the Action is executed.
 
+        The required literals and the typed groups of each pattern are
+        extracted once the tags have been replaced.
+
         Raises :class:`exceptions.ValueError` if the given string could not be
         compiled in at least one suitable :class:`re.RegexObject`.
 
@@ -148,5 +490,7 @@ class Filter(list):
         """
         parsed_filter = cls.replace_tags(raw_filter)
         regexes = cls.build_regex_list(parsed_filter, rule_limit)
+        literals = [cls.extract_literal(regex) for regex in regexes]
+        types = [cls.extract_types(regex) for regex in regexes]
 
-        return cls(regexes)
+        return cls(regexes, literals, types)
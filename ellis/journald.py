@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+def add_matches(reader, scopes, max_priority=None):
+    """
+    Filters the entries of the given journald *reader* (a
+    :class:`systemd.journal.Reader`), so that it only returns the entries
+    that are in at least one of the given *scopes*.
+
+    Each scope is a dict of {field: values}. An entry is in a scope if, for
+    each field, its value is one of the given values (see
+    :func:`router.Router.scope`). An empty list of scopes means that every
+    entry is returned.
+
+    *max_priority* is an optional syslog priority (0 to 7): entries of a
+    lower priority (i.e. of a higher number) are never returned. In each
+    scope, it restricts the scope's own `PRIORITY` values, if any.
+
+    .. note::
+        journald ORs the matches of a same field and ANDs the matches of
+        different fields. Scopes are then ORed with disjunctions, which is
+        why the priority cap has to be repeated in each of them.
+    """
+    capped = tuple(str(i) for i in range(max_priority + 1)) \
+        if max_priority is not None else None
+
+    for scope in scopes or ([{}] if capped is not None else []):
+        scope = dict(scope)
+
+        if capped is not None:
+            scope['PRIORITY'] = tuple(
+                value for value in scope.get('PRIORITY', capped)
+                if value in capped)
+
+        for field, values in scope.items():
+            for value in values:
+                reader.add_match('{0}={1}'.format(field, value))
+
+        reader.add_disjunction()
+
+
+def read_entries(reader, max_entries, fields, raw_messages=False, until=None):
+    """
+    Reads at most *max_entries* entries from the given journald *reader*
+    (a :class:`systemd.journal.Reader`), starting right after its current
+    position.
+
+    Instead of fetching and converting every field of every entry, only the
+    given *fields* are fetched, along with the cursor and the realtime
+    timestamp (in microseconds). Fields are decoded, except `MESSAGE` when
+    *raw_messages* is True.
+
+    *until* is an optional realtime timestamp (in microseconds). Reading
+    stops at the first entry that is not older than *until*. This entry is
+    not returned.
+
+    Returns a list of entries, which is empty when there is no new entry.
+    """
+    entries = []
+
+    while len(entries) < max_entries and reader._next():
+        timestamp = reader._get_realtime()
+
+        if until is not None and timestamp >= until:
+            break
+
+        entry = {
+            '__CURSOR': reader._get_cursor(),
+            '__REALTIME_TIMESTAMP': timestamp,
+        }
+
+        for field in fields:
+            try:
+                value = reader._get(field)
+            except KeyError:
+                continue
+
+            if field != 'MESSAGE' or not raw_messages:
+                value = value.decode('utf-8', 'replace')
+
+            entry[field] = value
+
+        entries.append(entry)
+
+    return entries
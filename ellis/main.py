@@ -3,13 +3,16 @@
 
 
 import argparse
+import datetime
 import sys
+import time
 import warnings
 
 from pid import PidFile
 
-from .ellis import Ellis
+from .ellis import Ellis, positive_int
 from .exceptions import NoRuleError
+from .sources import ReplaySource
 
 
 __version__ = "1.0.dev4"
@@ -35,6 +38,37 @@ def print_err(*objs):
     print(*objs, file=sys.stderr, end='')
 
 
+def parse_time(value):
+    """
+    Converts the given string to a timestamp (in seconds since the epoch).
+
+    Supported formats are `now`, `@<timestamp>`, `YYYY-MM-DD`,
+    `YYYY-MM-DD HH:MM` and `YYYY-MM-DD HH:MM:SS` (local time, a `T` can be
+    used instead of the space).
+
+    Raises :class:`argparse.ArgumentTypeError` if the string can't be
+    converted.
+    """
+    if value == 'now':
+        return time.time()
+
+    if value.startswith('@'):
+        try:
+            return float(value[1:])
+        except ValueError:
+            pass
+
+    for fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S'):
+        try:
+            dt = datetime.datetime.strptime(value.replace('T', ' '), fmt)
+        except ValueError:
+            continue
+
+        return dt.timestamp()
+
+    raise argparse.ArgumentTypeError("invalid time: '{0}'".format(value))
+
+
 def read_cmdline():
     """
     Parses optional command line arguments.
@@ -56,6 +90,54 @@ def read_cmdline():
                       help="read configuration from FILE",
                       type=str)
 
+    # Backfill mode:
+    argp.add_argument("--since",
+                      metavar='TIME',
+                      help="run the rules over the journal entries written "
+                           "since TIME instead of following the journal",
+                      type=parse_time)
+
+    argp.add_argument("--until",
+                      metavar='TIME',
+                      help="with --since, stop at TIME (defaults to now)",
+                      type=parse_time)
+
+    argp.add_argument("--slices",
+                      metavar='N',
+                      help="with --since, split the range into N slices "
+                           "(defaults to 4 per worker)",
+                      type=positive_int)
+
+    argp.add_argument("--execute",
+                      action='store_true',
+                      help="with --since, execute the actions instead of "
+                           "only reporting them")
+
+    # Replay mode:
+    argp.add_argument("--replay",
+                      metavar='FILE',
+                      help="replay the entries of FILE (`-` for stdin) "
+                           "instead of following the journal",
+                      type=str)
+
+    argp.add_argument("--format",
+                      help="with --replay, format of FILE (guessed by "
+                           "default)",
+                      choices=ReplaySource.formats)
+
+    argp.add_argument("--speed",
+                      metavar='N',
+                      help="with --replay, replay N times faster than the "
+                           "original timing (defaults to 0: as fast as "
+                           "possible)",
+                      default=0,
+                      type=float)
+
+    argp.add_argument("--unit",
+                      help="with --replay, systemd unit of the entries of a "
+                           "plain text FILE",
+                      type=str)
+
     # Parse command line:
     args = argp.parse_args()
 
@@ -76,8 +158,31 @@ def main():
     config_file = args['config_file']
 
     try:
-        with Ellis(config_file) as ellis, PidFile("/var/run/ellis.pid") as pid:
-            ellis.run()
+        if args['since'] is not None:
+            ellis = Ellis(config_file)
+
+            try:
+                ellis.backfill(args['since'], args['until'],
+                               args['slices'], args['execute'])
+            except ValueError as e:
+                print_err("{0}\n".format(e))
+        elif args['replay'] is not None:
+            ellis = Ellis(config_file)
+
+            try:
+                ellis.sources = [
+                    ReplaySource(args['replay'], args['format'],
+                                 args['speed'], args['unit'],
+                                 raw_messages=ellis.raw_messages)]
+            except ValueError as e:
+                print_err("{0}\n".format(e))
+            else:
+                with ellis:
+                    ellis.run()
+        else:
+            with Ellis(config_file) as ellis, \
+                    PidFile("/var/run/ellis.pid") as pid:
+                ellis.run()
     except NoRuleError:
         msg = ("There are no valid rules in the config file. "
                "Ellis can not run without rules.")
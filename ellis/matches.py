@@ -2,6 +2,16 @@
 # coding: utf-8
 
 
+import asyncio
+import heapq
+import itertools
+import sys
+import time
+import warnings
+
+from .sketch import CountMinSketch
+
+
 class Matches(dict):
     """
     Matches is a simple dictionnary of :class:`Counter`s that keeps track of
@@ -12,13 +22,77 @@ class Matches(dict):
     counter for this match has to be incremented by one so Ellis can trigger
     the :class:`rule.Rule` :class:`action.Action` when the :class:`rule.Rule`
     limit is reached. Matches allows us to do that.
+
+    Since every distinct set of captured values gets its own counter, the
+    number of tracked keys is capped, both per Rule (the Rule's `max_keys`,
+    see :class:`Counter`) and globally (*max_keys*). The keys a Rule fired
+    for count as tracked keys too. When the global cap is exceeded, keys
+    are evicted from every Counter, in proportion to their size (see
+    :func:`enforce`).
+
+    Once a Rule has fired for a key, further matches of this key are
+    ignored until the Rule is re-armed (see :class:`rule.Rule`): they cost a
+    single lookup and never launch the Action again.
+
+    When *deltas* is a dict, every counted match is also added to it, as
+    {rule name: {index: count}}, so that the counts can be shared with
+    other hosts (see :class:`cluster.ClusterClient`).
+
+    When *scheduler* is set, Actions are queued in this
+    :class:`scheduler.ActionScheduler` instead of being started right away.
     """
-    def __init__(self):
+
+    policies = ('lru', 'lowest')
+
+    def __init__(self, max_keys=None, policy='lru'):
         """
         Initializes a newly created Matches object.
+
+        *max_keys* is the maximum number of keys tracked by all the Counters
+        together. None means no limit.
+
+        *policy* is the eviction policy of the Counters (see
+        :class:`Counter`).
+
+        Raises :class:`exceptions.ValueError` if the policy is unknown.
         """
         super().__init__(self)
 
+        if policy not in self.policies:
+            raise ValueError("Unknown eviction policy: {0}".format(policy))
+
+        self.max_keys = max_keys
+        self.policy = policy
+        self.deltas = None
+        self.scheduler = None
+
+    def counter(self, rule):
+        """
+        Returns the :class:`Counter` of the given *rule*, creating it (with
+        the Rule's `findtime`) if needed. Rules whose `counting` is
+        `approximate` get an :class:`ApproximateCounter`.
+        """
+        # Note: `self[rule.name]` would create a Counter without findtime.
+        counter = self.get(rule.name)
+
+        if counter is None:
+            args = (getattr(rule, 'findtime', None),
+                    getattr(rule, 'max_keys', None), self.policy, rule.name,
+                    getattr(rule, 'rearm', 'always'),
+                    getattr(rule, 'rearm_ttl', None),
+                    getattr(rule, 'reset_on_fire', False))
+
+            if getattr(rule, 'counting', 'exact') == 'approximate':
+                counter = ApproximateCounter(*args, threshold=rule.limit,
+                                             error=rule.sketch_error,
+                                             confidence=rule.sketch_confidence)
+            else:
+                counter = Counter(*args)
+
+            self[rule.name] = counter
+
+        return counter
+
     def __missing__(self, key):
         """
         Sets `self[key]` to a new :class:`Counter`.
@@ -31,7 +105,7 @@ class Matches(dict):
         .. seealso::
             About :func:`__missing__`: https://docs.python.org/3/library/stdtypes.html#mapping-types-dict
         """
-        self[key] = Counter()
+        self[key] = Counter(policy=self.policy, name=key)
 
         return self[key]
 
@@ -45,7 +119,77 @@ class Matches(dict):
 
         return s
 
-    async def add(self, rule, kwargs=None):
+    def hit(self, rule, kwargs=None, timestamp=None):
+        """
+        Counts a match of the given *rule* for the given *kwargs* (see
+        :func:`add`), without executing the Action.
+
+        Returns an (index, count, fire) tuple, where *index* is the key of
+        *kwargs*, *count* the count of this key (None if the match was
+        ignored because the Rule already fired for this key) and *fire* tells
+        if the Rule fires.
+        """
+        index = rule.filter.pack(kwargs)
+        count, fire = self.update(rule, index, timestamp)
+
+        if count is not None and self.deltas is not None:
+            deltas = self.deltas.setdefault(rule.name, {})
+            deltas[index] = deltas.get(index, 0) + 1
+
+        return (index, count, fire)
+
+    def update(self, rule, index, timestamp=None, amount=1):
+        """
+        Adds *amount* matches of the given *rule* to the count of the given
+        *index* (see :func:`hit`).
+
+        *rule* can be any object having the attributes of a
+        :class:`rule.Rule` its Counter is built from (name, limit, findtime,
+        max_keys, rearm, rearm_ttl and reset_on_fire).
+
+        Returns a (count, fire) tuple (see :func:`hit`).
+        """
+        counter = self.counter(rule)
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        if counter.suppressed(index, timestamp):
+            return (None, False)
+
+        size = counter.size()
+        counter.increment(index, timestamp, amount)
+
+        count = counter.get(index, 0)
+        fire = count >= rule.limit
+
+        if fire:
+            counter.fire(index, timestamp)
+
+        if self.max_keys and counter.size() > size:
+            self.enforce(keep=(counter, index), timestamp=timestamp)
+
+        return (count, fire)
+
+    def trigger(self, rule, index):
+        """
+        Fires the given *rule* for the given *index*, whatever its count is
+        (typically because its limit is reached across several hosts), unless
+        the Rule already fired for it and is not re-armed yet.
+
+        Returns the scheduled :class:`asyncio.Task`, or None.
+        """
+        counter = self.counter(rule)
+        timestamp = time.time()
+
+        if counter.suppressed(index, timestamp):
+            return None
+
+        counter.fire(index, timestamp)
+
+        return self.run(rule, rule.filter.unpack(index))
+
+    async def add(self, rule, kwargs=None, timestamp=None):
         """
         Increments the counter for the given *rule* and *kwargs*.
 
@@ -56,24 +200,193 @@ class Matches(dict):
 
         *kwargs* is an optional dict of vars captured by the
         :class:`filter.Filter` that match the log entry.
+
+        *timestamp* is the time of the log entry (in seconds since the
+        epoch). Defaults to now. It is only used by Rules having a
+        `findtime`.
+
+        When the limit is reached, the :class:`action.Action` is scheduled
+        (but not awaited) so that a slow Action doesn't hold up the matching
+        of the next entries.
+
+        Returns the scheduled :class:`asyncio.Task`, or None.
+        """
+        index, count, fire = self.hit(rule, kwargs, timestamp)
+
+        if fire:
+            return self.run(rule, kwargs)
+
+        return None
+
+    def run(self, rule, kwargs=None):
+        """
+        Schedules the :class:`action.Action` of the given *rule* with the
+        given *kwargs*, through the scheduler if any.
+
+        Returns the scheduled :class:`asyncio.Task` (or
+        :class:`asyncio.Future`).
+        """
+        if self.scheduler is not None:
+            return self.scheduler.submit(rule.action, kwargs)
+
+        return asyncio.ensure_future(rule.action.run(kwargs))
+
+    def size(self):
+        """
+        Returns the number of keys tracked by all the Counters (see
+        :func:`Counter.size`).
+        """
+        return sum(counter.size() for counter in self.values())
+
+    def enforce(self, keep=None, timestamp=None):
+        """
+        Evicts keys if there are more than *max_keys* of them: down to the
+        low-water mark (see :attr:`Counter.low_water`), so that eviction
+        doesn't happen on every new key.
+
+        The keys the Rules fired for that are re-armed at *timestamp* are
+        forgotten first. Then each Counter evicts its share of the excess,
+        both from its counts and from the keys its Rule fired for (the ones
+        that fired first).
+
+        *keep* is an optional (counter, index) tuple that must not be
+        evicted.
         """
-        index = self[rule.name].increment(kwargs)
+        total = self.size()
+
+        if total <= self.max_keys:
+            return
+
+        target = int(self.max_keys * Counter.low_water)
+
+        if timestamp is not None:
+            for counter in self.values():
+                counter.purge(timestamp)
+
+            total = self.size()
+
+        excess = total - target
+
+        if excess <= 0:
+            return
+
+        for counter in self.values():
+            size = counter.size()
 
-        if self[rule.name][index] >= rule.limit:
-            await rule.action.run(kwargs)
+            if not size:
+                continue
+
+            share = -(-excess * size // total)
+            fired = min(-(-share * len(counter.actioned) // size),
+                        len(counter.actioned))
+            index = keep[1] if keep and keep[0] is counter else None
+
+            counter.forget(fired)
+            counter.evict(share - fired, keep=index)
+
+    def stats(self):
+        """
+        Returns a list of (rule name, keys, estimated bytes, evicted keys)
+        tuples, one per Counter.
+        """
+        return [(name, counter.size(), counter.memory(), counter.evicted)
+                for name, counter in self.items()]
 
 
 class Counter(dict):
     """
     A Counter is a dict that keeps track of matching counts for **one**
     specific :class:`rule.Rule`.
+
+    By default, matches are counted forever. With a *findtime*, only the
+    matches of the last *findtime* seconds are counted: the window is a ring
+    of :attr:`slots` buckets, each of them holding the matches of
+    *findtime* / :attr:`slots` seconds. When time goes by, the oldest buckets
+    are expired and their counts are subtracted. Each match is thus expired
+    once, without ever scanning all the keys, and keys whose count drops to
+    zero are removed.
+
+    Time is given by the timestamps of the log entries, not by the wall
+    clock, so that replayed or late entries are counted correctly.
+
+    .. note::
+        The window slides by steps of one bucket: a match may be counted up
+        to *findtime* / :attr:`slots` seconds longer than *findtime*.
+
+    The number of keys can be capped (*max_keys*). When the cap is exceeded,
+    keys are evicted down to :attr:`low_water` times the cap, either:
+
+        * the least recently incremented ones (`lru` policy) ;
+        * the ones with the lowest counts (`lowest` policy).
+
+    An evicted key that shows up again starts from zero.
+
+    The Counter also remembers the keys the Rule fired for (see
+    :func:`fire`), until they are re-armed according to *rearm*. This state
+    is purged of expired keys as it grows, and capped to *max_keys* too. It
+    also counts in the global cap of :class:`Matches` (see :func:`size`).
+
+    Once :func:`track` has been called, the Counter records which counts
+    changed, so that they can be saved incrementally (see :func:`collect`
+    and :class:`snapshot.Snapshot`).
+
+    Keys are the compact keys built by the Rule's :class:`filter.Filter`
+    (see :func:`filter.Filter.pack`): a single packed value, a tuple of
+    packed values, or None when nothing is captured.
     """
-    def __init__(self):
+
+    slots = 60
+    """Number of buckets of the window."""
+
+    low_water = 0.9
+    """Proportion of *max_keys* the Counter is brought back to when it's
+    full."""
+
+    def __init__(self, findtime=None, max_keys=None, policy='lru', name=None,
+                 rearm='always', rearm_ttl=None, reset_on_fire=False):
         """
         Initializes a newly created Counter.
+
+        *findtime* is the length of the window, in seconds. None means that
+        matches are counted forever.
+
+        *max_keys* is the maximum number of keys. None means no limit.
+
+        *policy* is the eviction policy (`lru` or `lowest`).
+
+        *name* is the name of the Rule, used in warnings.
+
+        *rearm*, *rearm_ttl* and *reset_on_fire*: see :class:`rule.Rule`.
         """
         super().__init__(self)
 
+        self.findtime = findtime
+        self.resolution = findtime / self.slots if findtime else None
+        self.buckets = [{} for i in range(self.slots)] if findtime else None
+
+        # Current tick (timestamp / resolution):
+        self.tick = None
+
+        self.max_keys = max_keys
+        self.policy = policy
+        self.name = name
+        self.evicted = 0
+        self._evicting = False
+
+        self.rearm = rearm
+        self.rearm_ttl = rearm_ttl
+        self.reset_on_fire = reset_on_fire
+
+        # Keys the Rule fired for, with the time they are re-armed at, in
+        # firing order:
+        self.actioned = {}
+        self._purge_at = 1024
+
+        # Changes since the last `collect` (None when not tracked):
+        self.dirty = None
+        self.dropped = None
+        self.dirty_actioned = None
+
     def __missing__(self, key):
         """
         Sets `self[key]` to zero.
@@ -101,26 +414,461 @@ class Counter(dict):
 
         return s
 
-    def increment(self, kwargs):
+    def advance(self, tick):
         """
-        Increments the counter for the given *kwargs*.
+        Moves the window forward to the given *tick*, expiring the buckets
+        that fall out of it.
+        """
+        if self.tick is None:
+            self.tick = tick
+            return
 
-        The counter index is computed from *kwargs*.
+        elapsed = tick - self.tick
 
-        *kwargs* is an optional dict of vars captured by the
-        :class:`filter.Filter` that match the log entry. An immutable version
-        of *kwargs* is used as an index to keep track of several counters for
-        the same :class:`rule.Rule`. It can be `None`.
+        if elapsed <= 0:
+            return
+
+        if elapsed >= self.slots:
+            # The whole window expired:
+            self.clear()
+
+            for bucket in self.buckets:
+                bucket.clear()
+        else:
+            for t in range(self.tick + 1, tick + 1):
+                bucket = self.buckets[t % self.slots]
+
+                for index, count in bucket.items():
+                    remaining = self.get(index, 0) - count
+
+                    if remaining > 0:
+                        self[index] = remaining
+                    else:
+                        self.pop(index, None)
+
+                bucket.clear()
+
+        if self._evicting and self.max_keys \
+                and len(self) < self.max_keys // 2:
+            self._evicting = False
+
+        self.tick = tick
+
+    def increment(self, index, timestamp=None, amount=1):
+        """
+        Increments the counter for the given *index* by *amount*.
+
+        *index* is the key of the captured values (see
+        :func:`filter.Filter.pack`), used to keep track of several counters
+        for the same :class:`rule.Rule`. It can be `None`.
+
+        *timestamp* is the time of the log entry (in seconds since the
+        epoch), used when the Counter has a *findtime*. Defaults to now.
+        Entries that are already out of the window are not counted.
 
         Returns the index of the updated counter.
         """
-        index = None
+        if self.findtime:
+            if timestamp is None:
+                timestamp = time.time()
+
+            tick = int(timestamp // self.resolution)
+            self.advance(tick)
 
-        if kwargs:
-            # index = hash(tuple(sorted(kwargs.items())))
-            # Better keep something readable so we can output it.
-            index = tuple(sorted(kwargs.items()))
+            if tick <= self.tick - self.slots:
+                # Too old:
+                return index
 
-        self[index] += 1
+            bucket = self.buckets[tick % self.slots]
+            bucket[index] = bucket.get(index, 0) + amount
+        else:
+            tick = 0
+
+        if self.policy == 'lru':
+            # Move the key to the end, the least recent keys come first:
+            self[index] = self.pop(index, 0) + amount
+        else:
+            self[index] = self.get(index, 0) + amount
+
+        if self.dirty is not None:
+            self.dirty.add((tick, index))
+
+        if self.max_keys and len(self) > self.max_keys:
+            self.evict(len(self) - int(self.max_keys * self.low_water),
+                       keep=index)
 
         return index
+
+    def suppressed(self, index, timestamp):
+        """
+        Tells if the Rule already fired for the given *index* and is not
+        re-armed yet at the given *timestamp*.
+        """
+        rearmed_at = self.actioned.get(index)
+
+        if rearmed_at is None:
+            return False
+
+        if timestamp < rearmed_at:
+            return True
+
+        del self.actioned[index]
+
+        if self.dirty_actioned is not None:
+            self.dirty_actioned.add(index)
+
+        return False
+
+    def fire(self, index, timestamp):
+        """
+        Records that the Rule fired for the given *index* at the given
+        *timestamp*, and resets its count if needed.
+        """
+        if self.reset_on_fire:
+            self.reset(index)
+
+        if self.rearm == 'always':
+            return
+
+        if self.rearm == 'never':
+            rearmed_at = float('inf')
+        else:
+            rearmed_at = timestamp + self.rearm_ttl
+
+        self.actioned.pop(index, None)
+        self.actioned[index] = rearmed_at
+
+        if self.dirty_actioned is not None:
+            self.dirty_actioned.add(index)
+
+        if len(self.actioned) >= self._purge_at \
+                or self.max_keys and len(self.actioned) > self.max_keys:
+            self.purge(timestamp)
+
+            if self.max_keys and len(self.actioned) > self.max_keys:
+                self.forget(len(self.actioned)
+                            - int(self.max_keys * self.low_water))
+
+    def purge(self, timestamp):
+        """
+        Forgets the keys the Rule fired for that are re-armed at the given
+        *timestamp*.
+
+        Returns the number of forgotten keys.
+        """
+        actioned = self.actioned
+        self.actioned = {key: value for key, value in actioned.items()
+                         if value > timestamp}
+
+        if self.dirty_actioned is not None \
+                and len(self.actioned) < len(actioned):
+            self.dirty_actioned.update(key for key in actioned
+                                       if key not in self.actioned)
+
+        self._purge_at = max(2 * len(self.actioned), 1024)
+
+        return len(actioned) - len(self.actioned)
+
+    def forget(self, count):
+        """
+        Forgets the *count* keys the Rule fired for first, whether they are
+        re-armed or not: the Rule may fire again for them.
+
+        Returns the number of forgotten keys.
+        """
+        forgotten = list(itertools.islice(self.actioned, max(count, 0)))
+
+        for key in forgotten:
+            del self.actioned[key]
+
+        if self.dirty_actioned is not None:
+            self.dirty_actioned.update(forgotten)
+
+        return len(forgotten)
+
+    def size(self):
+        """
+        Returns the number of keys held by the Counter: the keys it counts
+        and the keys the Rule fired for.
+        """
+        return len(self) + len(self.actioned)
+
+    def reset(self, index):
+        """
+        Forgets the count of the given *index*.
+        """
+        self.pop(index, None)
+
+        if self.buckets is not None:
+            for bucket in self.buckets:
+                bucket.pop(index, None)
+
+        if self.dropped is not None:
+            self.dropped.add(index)
+
+    def track(self):
+        """
+        Starts recording the changes of the Counter (see :func:`collect`).
+        """
+        self.dirty = set()
+        self.dropped = set()
+        self.dirty_actioned = set()
+
+        return self
+
+    def collect(self):
+        """
+        Returns the changes of the Counter since the last call (or since
+        :func:`track` was called), and forgets them.
+
+        Returns a (dropped, counts, actioned, expired) tuple:
+
+            * *dropped* is the list of the indexes whose counts were all
+              dropped (evicted or reset) ;
+            * *counts* is a list of (index, tick, count) tuples, holding the
+              count of an index for a tick of the window (0 when no longer
+              counted). The tick is always 0 without *findtime* ;
+            * *actioned* is a list of (index, re-arm time) tuples, the re-arm
+              time being None once the index is re-armed ;
+            * *expired* is the last tick that is out of the window (None
+              without *findtime*).
+
+        .. note::
+            Counts that are out of the window are not listed, they have to
+            be dropped using *expired*.
+        """
+        if self.findtime:
+            expired = self.tick - self.slots if self.tick is not None else None
+            counts = [(index, tick,
+                       self.buckets[tick % self.slots].get(index, 0))
+                      for tick, index in self.dirty
+                      if expired is None or tick > expired]
+        else:
+            expired = None
+            counts = [(index, tick, self.get(index, 0))
+                      for tick, index in self.dirty]
+
+        dropped = list(self.dropped)
+        actioned = [(index, self.actioned.get(index))
+                    for index in self.dirty_actioned]
+
+        self.track()
+
+        return (dropped, counts, actioned, expired)
+
+    def restore(self, counts, actioned, tick=None):
+        """
+        Restores the counts and the keys the Rule fired for, as saved from
+        :func:`collect`.
+
+        *counts* is an iterable of (index, tick, count) tuples, each
+        (index, tick) pair appearing once, *actioned* an iterable of
+        (index, re-arm time) tuples and *tick* the tick the window was at.
+        """
+        # Note: this runs once per saved count when Ellis starts, hence the
+        #       local names.
+        get = self.get
+
+        if self.findtime:
+            self.tick = tick
+            buckets = self.buckets
+            slots = self.slots
+            expired = tick - slots if tick is not None else None
+
+            for index, tick, count in counts:
+                if expired is None or tick > expired:
+                    buckets[tick % slots][index] = count
+                    self[index] = get(index, 0) + count
+        else:
+            for index, tick, count in counts:
+                self[index] = get(index, 0) + count
+
+        if self.rearm != 'always':
+            self.actioned.update(actioned)
+
+        if self.max_keys and len(self) > self.max_keys:
+            self.evict(len(self) - int(self.max_keys * self.low_water))
+
+        return self
+
+    def evict(self, count, keep=None):
+        """
+        Evicts *count* keys, according to the eviction policy.
+
+        *keep* is an optional index that must not be evicted (typically the
+        one that has just been incremented).
+
+        Returns the number of evicted keys.
+        """
+        count = min(count, len(self) - (keep in self))
+
+        if count <= 0:
+            return 0
+
+        if not self._evicting:
+            warnings.warn("Rule '{0}': too many tracked keys ({1}), evicting "
+                          "the {2} ones."
+                          .format(self.name, len(self),
+                                  'least recently used'
+                                  if self.policy == 'lru' else 'lowest'))
+            self._evicting = True
+
+        candidates = (index for index in self if index != keep)
+
+        if self.policy == 'lru':
+            evicted = list(itertools.islice(candidates, count))
+        else:
+            evicted = heapq.nsmallest(count, candidates, key=self.get)
+
+        for index in evicted:
+            self.reset(index)
+
+        self.evicted += len(evicted)
+
+        return len(evicted)
+
+    def memory(self, sample=100):
+        """
+        Returns an estimation of the memory used by the Counter, in bytes.
+
+        The size of the keys is estimated from the first *sample* keys.
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self.actioned)
+
+        if self.buckets is not None:
+            size += sum(sys.getsizeof(bucket) for bucket in self.buckets)
+
+        keys = list(itertools.islice(self, sample))
+
+        if keys:
+            key_size = sum(self.key_size(key) for key in keys) / len(keys)
+            size += int(key_size * len(self))
+
+        return size
+
+    @staticmethod
+    def key_size(index):
+        """
+        Returns the size of the given index, in bytes. Interned strings may
+        be shared by several keys, they are counted anyway.
+        """
+        if index is None:
+            return 0
+
+        if isinstance(index, tuple):
+            return sys.getsizeof(index) + sum(sys.getsizeof(item)
+                                              for item in index
+                                              if item is not None)
+
+        return sys.getsizeof(index)
+
+
+class ApproximateCounter(Counter):
+    """
+    An ApproximateCounter is a :class:`Counter` for the Rules that may see
+    millions of distinct keys (typically during a distributed attack), in
+    which case tracking each of them would be too expensive.
+
+    Matches are first counted in a :class:`sketch.CountMinSketch` over the
+    Rule's *findtime*, whose size is fixed whatever the number of distinct
+    keys is. Estimates are never lower than the real counts, but, with a
+    probability of at least *confidence*, they are higher by at most the
+    error bound: *error* times the number of matches of the Rule within its
+    *findtime* (see :func:`sketch.CountMinSketch.error_bound`).
+
+    A key only gets an exact count once its estimate reaches *threshold*
+    (the Rule's limit) **and** exceeds the error bound, i.e. once the key
+    has surely been seen. Its exact count then starts from what it has
+    surely been seen: the estimate minus the error bound. The Rule only
+    fires on exact counts, so that a flood of distinct keys, which inflates
+    the estimates, doesn't make every key reach the limit.
+
+    The exact counts make up a small heavy hitters table of *max_keys* keys
+    (:attr:`heavy_hitters` by default): when it's full, the keys with the
+    lowest counts are evicted.
+
+    .. note::
+        When the error bound reaches *threshold*, a key has to match about
+        *threshold* plus the error bound times before it fires (a warning is
+        issued). Choose *error* according to the expected number of matches
+        within *findtime*: *error* times this number should stay well below
+        the limit.
+    """
+
+    heavy_hitters = 1024
+    """Default number of keys with an exact count."""
+
+    def __init__(self, findtime=None, max_keys=None, policy='lowest',
+                 name=None, rearm='always', rearm_ttl=None,
+                 reset_on_fire=False, threshold=1, error=0.0001,
+                 confidence=0.99):
+        """
+        Initializes a newly created ApproximateCounter.
+
+        *threshold* is the estimate from which a key gets an exact count.
+
+        *error* and *confidence*: see :class:`sketch.CountMinSketch`.
+
+        The other arguments are the ones of :class:`Counter`, except
+        *policy* which is always `lowest`, and *findtime* which is required
+        (estimates would grow forever otherwise).
+
+        Raises :class:`exceptions.ValueError` if there is no *findtime*.
+        """
+        if not findtime:
+            raise ValueError("Approximate counting requires a findtime")
+
+        super().__init__(findtime, max_keys or self.heavy_hitters, 'lowest',
+                         name, rearm, rearm_ttl, reset_on_fire)
+
+        self.threshold = threshold
+        self.sketch = CountMinSketch(error, confidence, findtime)
+        self.promoted = 0
+        self._saturated = False
+
+    def increment(self, index, timestamp=None, amount=1):
+        """
+        Increments the exact count of the given *index* if it has one, its
+        estimate otherwise (see :func:`Counter.increment`).
+
+        Returns the index of the updated counter.
+        """
+        if index in self:
+            return super().increment(index, timestamp, amount)
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        estimate = self.sketch.add(index, timestamp, amount)
+
+        if estimate < self.threshold:
+            return index
+
+        # What the key has surely been seen:
+        bound = self.sketch.error_bound()
+        surely = estimate - bound
+
+        if bound >= self.threshold and not self._saturated:
+            warnings.warn("Rule '{0}': {1} matches within findtime, the "
+                          "count estimates may be {2} too high, which "
+                          "reaches the limit ({3}). Keys will fire late, "
+                          "lower 'sketch_error'."
+                          .format(self.name, self.sketch.count, bound,
+                                  self.threshold))
+            self._saturated = True
+        elif bound < self.threshold:
+            self._saturated = False
+
+        if surely <= 0:
+            return index
+
+        self.promoted += 1
+
+        return super().increment(index, timestamp, surely)
+
+    def memory(self, sample=100):
+        """
+        Returns an estimation of the memory used by the Counter and its
+        sketch, in bytes.
+        """
+        return super().memory(sample) + self.sketch.memory()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import warnings
+
+
+class Pipeline(object):
+    """
+    A Pipeline moves journald entries from a source to the matching stage
+    with bounded memory.
+
+    Entries are read from the source in batches of at most *batch_size*
+    entries. A batch that isn't full is sent anyway once it has waited for
+    *batch_wait* seconds. Batches go through a bounded queue and are consumed
+    by a fixed number of workers, each of them processing one batch at a
+    time.
+
+    When the queue is full, the Pipeline either:
+
+        * stops reading the source (`block` policy) until a worker takes a
+          batch from the queue. Since journald keeps the entries, nothing is
+          lost, entries are just processed later ;
+        * drops the new batches (`drop` policy) and counts the dropped
+          entries.
+
+    Either way, memory usage and latency stay bounded during floods, instead
+    of growing with the number of pending tasks.
+
+    Batches are numbered in the order they are read, so that the Pipeline
+    can tell which is the last batch that has been processed *along with all
+    the batches before it*, even though several workers run concurrently.
+    """
+
+    policies = ('block', 'drop')
+
+    def __init__(self, read, process, batch_size=256, batch_wait=0.05,
+                 queue_size=64, policy='block', workers=2, done=None,
+                 loop=None):
+        """
+        Initializes a newly created Pipeline.
+
+        *read* is a callable that takes a maximum number of entries and
+        returns a list of at most this number of entries (an empty list
+        meaning that no entry is available for now).
+
+        *process* is a coroutine function that takes a list of entries.
+
+        *batch_size* is the maximum number of entries per batch.
+
+        *batch_wait* is the maximum time (in seconds) a partial batch waits
+        before being sent.
+
+        *queue_size* is the maximum number of batches waiting in the queue.
+
+        *policy* is what happens when the queue is full (`block` or `drop`).
+
+        *workers* is the number of workers consuming the queue.
+
+        *done* is an optional callable, called with the last batch that has
+        been fully processed, once all the previous batches have been
+        processed too. Dropped batches are considered as processed.
+        """
+        if policy not in self.policies:
+            raise ValueError("Unknown queue policy: {0}".format(policy))
+
+        self.read = read
+        self.process = process
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.policy = policy
+        self.workers = workers
+        self.done = done
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.pending = []
+        self.blocked = False
+        self.dropped = 0
+        self.entries = 0
+        self.tasks = []
+
+        # Sequence number of the next batch, and of the next batch that has
+        # to be completed. Completed batches that are not next yet wait in
+        # `_completed`:
+        self._sequence = 0
+        self._next_completed = 0
+        self._completed = {}
+
+        self._drain_handle = None
+        self._flush_handle = None
+        self._dropping = False
+
+    def __repr__(self):
+        """
+        """
+        return '<Pipeline - queued: {0}/{1}, pending: {2}, blocked: {3}, ' \
+               'dropped: {4}>'.format(self.queue.qsize(), self.queue.maxsize,
+                                      len(self.pending), self.blocked,
+                                      self.dropped)
+
+    def start(self):
+        """
+        Starts the workers.
+        """
+        for i in range(self.workers):
+            self.tasks.append(self.loop.create_task(self.consume()))
+
+        return self
+
+    def stop(self):
+        """
+        Stops the workers. Entries that are still queued are discarded.
+
+        Returns a future that is done once the workers are stopped.
+        """
+        for handle in (self._drain_handle, self._flush_handle):
+            if handle is not None:
+                handle.cancel()
+
+        for task in self.tasks:
+            task.cancel()
+
+        tasks, self.tasks = self.tasks, []
+
+        return asyncio.gather(*tasks, return_exceptions=True)
+
+    def drain(self):
+        """
+        Reads entries from the source, until the source is exhausted or
+        (with the `block` policy) the queue is full.
+
+        This has to be called whenever the source has new entries.
+
+        .. note::
+            Only one batch is read at a time. If more entries may be
+            available, the next batch is read on the next iteration of the
+            loop so that the workers get a chance to run.
+        """
+        self._drain_handle = None
+
+        if self.policy == 'block' and self.queue.full():
+            self.blocked = True
+            return
+
+        entries = self.read(self.batch_size - len(self.pending))
+        self.entries += len(entries)
+        self.pending.extend(entries)
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+            if self._drain_handle is None:
+                self._drain_handle = self.loop.call_soon(self.drain)
+
+        elif self.pending and self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.batch_wait,
+                                                      self.flush)
+
+    def flush(self):
+        """
+        Sends the pending entries to the queue.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self.pending:
+            return
+
+        batch = self.pending
+        self.pending = []
+
+        try:
+            self.queue.put_nowait((self._sequence, batch))
+        except asyncio.QueueFull:
+            if self.policy == 'block':
+                # Keep the batch for later, a worker will unblock us:
+                self.pending = batch
+                self.blocked = True
+                return
+            else:
+                self.drop(self._sequence, batch)
+        else:
+            self._dropping = False
+
+        self._sequence += 1
+
+    async def join(self):
+        """
+        Waits until every entry read so far has been processed (or dropped).
+        """
+        while True:
+            self.flush()
+            await self.queue.join()
+
+            if not self.pending:
+                break
+
+    def drop(self, sequence, batch):
+        """
+        Drops the given batch.
+        """
+        if not self._dropping:
+            warnings.warn("The queue is full, entries are being dropped "
+                          "({0} dropped so far).".format(self.dropped))
+            self._dropping = True
+
+        self.dropped += len(batch)
+        self.complete(sequence, batch)
+
+    def complete(self, sequence, batch):
+        """
+        Records that the given batch has been processed, and calls *done*
+        with the last batch processed in order, if any.
+        """
+        self._completed[sequence] = batch
+        last = None
+
+        while self._next_completed in self._completed:
+            last = self._completed.pop(self._next_completed)
+            self._next_completed += 1
+
+        if last is not None and self.done is not None:
+            self.done(last)
+
+    async def consume(self):
+        """
+        Worker: processes the batches from the queue, one at a time.
+        """
+        while True:
+            sequence, batch = await self.queue.get()
+
+            if self.blocked:
+                # There is room in the queue again:
+                self.blocked = False
+                self.flush()
+
+                if not self.blocked and self._drain_handle is None:
+                    self._drain_handle = self.loop.call_soon(self.drain)
+
+            try:
+                await self.process(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.loop.call_exception_handler({
+                    'message': "Unable to process a batch of entries",
+                    'exception': e,
+                })
+            finally:
+                self.complete(sequence, batch)
+                self.queue.task_done()
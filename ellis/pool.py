@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import concurrent.futures
+
+from .router import Router
+
+
+# Router of the current worker process (see `_initialize`):
+_router = None
+
+
+def _initialize(rules, cache):
+    """
+    Initializes a worker process: builds a :class:`router.Router` (and thus
+    the precompiled :class:`ruleset.RuleSet`s) from the given Rules.
+
+    *cache* is the worker's own copy of the (empty)
+    :class:`cache.MatchCache`, or None.
+
+    .. note:: This function runs in the worker process.
+    """
+    global _router
+    _router = Router(rules, cache)
+
+
+def _scan_batch(entries):
+    """
+    Scans the given entries with the worker's Router.
+
+    .. note:: This function runs in the worker process.
+
+    Returns a list holding, for each entry, a list of
+    (rule_index, regex_index, groupdict) tuples.
+    """
+    return [_router.scan(entry) for entry in entries]
+
+
+class MatchingPool(object):
+    """
+    A MatchingPool checks journald entries against the :class:`rule.Rule`s
+    in a pool of worker processes, so that regular expressions are evaluated
+    on several cores instead of under a single GIL.
+
+    Each worker holds its own :class:`router.Router`, built once when the
+    worker starts. Entries are shipped to the workers in batches (stripped
+    down to the fields needed for matching) and the workers only send back
+    compact (rule_index, regex_index, groupdict) tuples. The main process
+    keeps the ownership of the :class:`matches.Matches` and of the Actions.
+    """
+    def __init__(self, rules, workers=None, batch_size=256, cache=None):
+        """
+        Initializes a newly created MatchingPool.
+
+        *rules* is the list of :class:`rule.Rule`s.
+
+        *workers* is the number of worker processes. Defaults to the number
+        of CPUs.
+
+        *batch_size* is the maximum number of entries sent to a worker at
+        once. Bigger batches are split so that they can be handled by several
+        workers in parallel.
+
+        *cache* is an optional (empty) :class:`cache.MatchCache`. Each worker
+        gets its own copy of it.
+        """
+        self.rules = list(rules)
+        self.cache = cache
+        self.workers = workers
+        self.batch_size = batch_size
+        self.executor = None
+
+    def __repr__(self):
+        """
+        """
+        return '<MatchingPool - workers: {0}, batch_size: {1}>' \
+               .format(self.workers, self.batch_size)
+
+    def start(self):
+        """
+        Starts the worker processes.
+        """
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_initialize,
+            initargs=(self.rules, self.cache))
+
+        return self
+
+    def shutdown(self):
+        """
+        Stops the worker processes.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    @staticmethod
+    def project(entry):
+        """
+        Returns a copy of the given *entry* holding only the fields needed
+        for matching, so that we don't pay for sending the others to the
+        workers.
+        """
+        fields = ('MESSAGE',) + tuple(Router.fields)
+
+        return {field: entry[field] for field in fields if field in entry}
+
+    async def search_batch(self, entries):
+        """
+        Searches each of the given journald entries for matches, in the
+        worker processes.
+
+        Returns a list holding, for each entry, the list of (rule, regex,
+        groupdict) tuples (see :func:`router.Router.search_batch`).
+        """
+        loop = asyncio.get_event_loop()
+        futures = []
+
+        for i in range(0, len(entries), self.batch_size):
+            batch = [self.project(entry)
+                     for entry in entries[i:i + self.batch_size]]
+            futures.append(loop.run_in_executor(self.executor,
+                                                _scan_batch, batch))
+
+        results = []
+
+        for scanned in await asyncio.gather(*futures):
+            for hits in scanned:
+                results.append([(self.rules[rule_index],
+                                 self.rules[rule_index].filter[regex_index],
+                                 groupdict)
+                                for rule_index, regex_index, groupdict
+                                in hits])
+
+        return results
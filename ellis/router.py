@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+from .ruleset import RuleSet
+
+
+class Router(object):
+    """
+    A Router sends each journald entry to the :class:`ruleset.RuleSet` made
+    of the :class:`rule.Rule`s that apply to it.
+
+    A Rule can be scoped to a systemd unit (`systemd_unit` option), a syslog
+    identifier (`syslog_identifier` option), a set of priorities (`priority`
+    option) and/or a transport (`transport` option). A scoped Rule only
+    applies to the entries whose `_SYSTEMD_UNIT` (resp. `SYSLOG_IDENTIFIER`,
+    `PRIORITY`, `_TRANSPORT`) field has one of the given values. Unscoped
+    Rules apply to every entry.
+
+    The Rules are indexed by scope when the Router is built. Then, for each
+    entry, the applicable Rules are found with a couple of dict lookups and
+    the corresponding :class:`ruleset.RuleSet` is built once and cached.
+    This means that, for example, nginx entries never go through the sshd
+    Filters. The caches are only updated with single dict operations, so
+    that several threads can route entries at once.
+    """
+
+    fields = {
+        '_SYSTEMD_UNIT': 'systemd_unit',
+        'SYSLOG_IDENTIFIER': 'syslog_identifier',
+        'PRIORITY': 'priority',
+        '_TRANSPORT': 'transport',
+    }
+    """Journald fields used for routing, and the matching Rule attributes."""
+
+    max_routes = 4096
+    """Maximum number of cached routes. The cache is cleared when reached."""
+
+    def __init__(self, rules, cache=None):
+        """
+        Initializes a newly created Router with the given list of
+        :class:`rule.Rule`s.
+
+        *cache* is an optional :class:`cache.MatchCache` shared by all the
+        RuleSets of the Router.
+        """
+        self.rules = list(rules)
+        self.cache = cache
+
+        # Rules that apply to every entry:
+        self.unscoped = []
+
+        # For each field, index of the Rules by expected value:
+        self.index = {field: {} for field in self.fields}
+
+        # Cache of (field values) -> (rule indexes, RuleSet), and of
+        # (rule indexes) -> RuleSet, so that routes sharing the same Rules
+        # also share the same RuleSet:
+        self.routes = {}
+        self.rulesets = {}
+
+        self.build()
+
+    def __repr__(self):
+        """
+        """
+        return '<Router - rules: {0}, unscoped: {1}, routes: {2}>' \
+               .format(len(self.rules), len(self.unscoped), len(self.routes))
+
+    @classmethod
+    def scope(cls, rule):
+        """
+        Returns the scope of the given Rule as a dict of
+        {journald field: tuple of expected values}. A Rule attribute can
+        either hold a single value or a collection of values.
+
+        An empty dict means that the Rule applies to every entry.
+        """
+        scope = {}
+
+        for field, attr in cls.fields.items():
+            value = getattr(rule, attr, None)
+
+            if value is None:
+                continue
+
+            scope[field] = (value,) if isinstance(value, str) \
+                else tuple(value)
+
+        return scope
+
+    def build(self):
+        """
+        Indexes the Rules by scope.
+        """
+        for rule_index, rule in enumerate(self.rules):
+            scope = self.scope(rule)
+
+            if not scope:
+                self.unscoped.append(rule_index)
+
+            for field, values in scope.items():
+                for value in values:
+                    self.index[field].setdefault(value, []).append(rule_index)
+
+        return self
+
+    def route(self, entry):
+        """
+        Returns the :class:`ruleset.RuleSet` that has to be used for the
+        given journald *entry* (a dict of fields).
+        """
+        return self._route(entry)[1]
+
+    def _route(self, entry):
+        """
+        Returns a (rule indexes, RuleSet) tuple for the given journald
+        *entry*. The rule indexes are the indexes, in :attr:`rules`, of the
+        Rules of the RuleSet.
+        """
+        key = tuple(entry.get(field) for field in self.fields)
+
+        try:
+            return self.routes[key]
+        except KeyError:
+            pass
+
+        # Candidates are the unscoped Rules and the Rules indexed under one
+        # of the entry values. A scoped Rule applies if *all* its scope
+        # fields hold one of the expected values:
+        candidates = set(self.unscoped)
+
+        for field, value in zip(self.fields, key):
+            candidates.update(self.index[field].get(value, ()))
+
+        applicable = tuple(
+            rule_index for rule_index in sorted(candidates)
+            if all(entry.get(field) in values
+                   for field, values in self.scope(self.rules[rule_index])
+                                          .items()))
+
+        ruleset = self.rulesets.get(applicable)
+
+        if ruleset is None:
+            # Two threads may build the same RuleSet, only one is kept:
+            ruleset = self.rulesets.setdefault(
+                applicable,
+                RuleSet([self.rules[i] for i in applicable], self.cache))
+
+        if len(self.routes) >= self.max_routes:
+            self.routes.clear()
+
+        route = (applicable, ruleset)
+        self.routes[key] = route
+
+        return route
+
+    def scan(self, entry):
+        """
+        Scans the `MESSAGE` of the given journald *entry*, using only the
+        Rules that apply to this entry. The message can either be a `str` or
+        raw `bytes`.
+
+        Returns a list of (rule_index, regex_index, groupdict) tuples, where
+        *rule_index* is the index of the Rule in :attr:`rules`.
+        """
+        message = entry.get('MESSAGE')
+
+        if message is None:
+            return []
+
+        applicable, ruleset = self._route(entry)
+
+        return [(applicable[rule_index], regex_index, groupdict)
+                for rule_index, regex_index, groupdict
+                in ruleset.scan(message)]
+
+    def search(self, entry):
+        """
+        Searches the `MESSAGE` of the given journald *entry* for matches,
+        using only the Rules that apply to this entry.
+
+        Returns a list of (rule, regex, groupdict) tuples (see
+        :func:`ruleset.RuleSet.search`).
+        """
+        message = entry.get('MESSAGE')
+
+        if message is None:
+            return []
+
+        return self.route(entry).search(message)
+
+    def search_batch(self, entries):
+        """
+        Searches each of the given journald entries for matches.
+
+        Returns a list holding, for each entry, the list of (rule, regex,
+        groupdict) tuples returned by :func:`search`.
+        """
+        return [self.search(entry) for entry in entries]
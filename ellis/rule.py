@@ -11,8 +11,33 @@ class Rule(object):
     A Rule is a combination of a :class:`filter.Filter` and an
     :class:`action.Action`.
 
+    A Rule can also be scoped to a systemd unit, a syslog identifier, a set
+    of priorities and/or a transport (see *systemd_unit*,
+    *syslog_identifier*, *priority* and *transport*), in which case it only
+    applies to the journald entries that match all of them (see
+    :class:`router.Router`).
+
+    Once the action has been executed for a set of captured values, the
+    Rule doesn't fire again for them until it is *re-armed* (see *rearm*):
+    further matches are ignored, so that an offender doesn't trigger the
+    same action over and over while it is being dealt with.
+
    """
-    def __init__(self, name, filter, limit, action):
+
+    __slots__ = ('name', 'filter', 'limit', 'action', 'systemd_unit',
+                 'syslog_identifier', 'priority', 'transport', 'findtime',
+                 'max_keys', 'rearm', 'rearm_ttl', 'reset_on_fire',
+                 'counting', 'sketch_error', 'sketch_confidence')
+
+    rearm_policies = ('always', 'ttl', 'never')
+
+    counting_modes = ('exact', 'approximate')
+
+    def __init__(self, name, filter, limit, action, systemd_unit=None,
+                 syslog_identifier=None, priority=None, transport=None,
+                 findtime=None, max_keys=None, rearm='ttl', rearm_ttl=600,
+                 reset_on_fire=False, counting='exact', sketch_error=0.0001,
+                 sketch_confidence=0.99):
         """
         Initializes a newly created Rule with the following arguments:
 
@@ -28,8 +53,53 @@ class Rule(object):
         *action* is a string designating the action to execute when *limit* is
         reached. It is converted in a :class:`action.Action` object.
 
+        *systemd_unit* (optional) is the name of the systemd unit the Rule is
+        scoped to.
+
+        *syslog_identifier* (optional) is the syslog identifier the Rule is
+        scoped to.
+
+        *priority* (optional) is the collection of journald `PRIORITY`
+        values the Rule is scoped to.
+
+        *transport* (optional) is the journald transport the Rule is scoped
+        to.
+
+        *findtime* (optional) is the time window (in seconds) in which
+        *limit* matches have to happen for the action to be executed. By
+        default, matches are counted forever.
+
+        *max_keys* (optional) is the maximum number of keys (distinct
+        captured values) tracked for the Rule.
+
+        *rearm* tells when the Rule fires again for captured values it has
+        already fired for:
+
+            * `always`: on every match, as long as the limit is reached ;
+            * `ttl` (the default): once *rearm_ttl* seconds went by ;
+            * `never`: only once (as long as the values are tracked).
+
+        *rearm_ttl* is the time (in seconds) during which the Rule doesn't
+        fire again, with the `ttl` policy. Defaults to 10 minutes.
+
+        *reset_on_fire* tells if the counter of the captured values is reset
+        when the Rule fires.
+
+        *counting* is either `exact` (the default) or `approximate`, in which
+        case matches are counted in a fixed amount of memory, and only the
+        keys whose estimate reaches *limit* are tracked (see
+        :class:`matches.ApproximateCounter`). *max_keys* is then the number
+        of tracked keys, 1024 by default. `approximate` requires a
+        *findtime*.
+
+        *sketch_error* and *sketch_confidence* are the error bounds of the
+        `approximate` counting (see :class:`sketch.CountMinSketch`).
+
         Raises ValueError if the limit is invalid (<=0, not an integer).
 
+        Raises ValueError if the re-arm policy or the counting mode is
+        unknown, or if the counting is `approximate` without *findtime*.
+
         Raises ValueError if the *filter* can't be converted in a
         :class:`filter.Filter` object.
 
@@ -40,6 +110,27 @@ class Rule(object):
         self.filter = None
         self.limit = None
         self.action = None
+        self.systemd_unit = systemd_unit
+        self.syslog_identifier = syslog_identifier
+        self.priority = priority
+        self.transport = transport
+        self.findtime = findtime
+        self.max_keys = max_keys
+        self.rearm = rearm
+        self.rearm_ttl = rearm_ttl
+        self.reset_on_fire = reset_on_fire
+        self.counting = counting
+        self.sketch_error = sketch_error
+        self.sketch_confidence = sketch_confidence
+
+        if rearm not in self.rearm_policies:
+            raise ValueError("Unknown re-arm policy: {0}".format(rearm))
+
+        if counting not in self.counting_modes:
+            raise ValueError("Unknown counting mode: {0}".format(counting))
+
+        if counting == 'approximate' and not findtime:
+            raise ValueError("Approximate counting requires a findtime")
 
         self.check_limit(limit) \
             .build_filter(filter) \
@@ -53,8 +144,8 @@ class Rule(object):
     def __str__(self):
         """
         """
-        return '<Rule - name: {0}, action: {1}, limit: {2}>' \
-               .format(self.name, self.action, self.limit)
+        return '<Rule - name: {0}, action: {1}, limit: {2}, findtime: {3}>' \
+               .format(self.name, self.action, self.limit, self.findtime)
 
     def check_limit(self, limit):
         """
@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import re
+
+
+class RuleSet(object):
+    """
+    A RuleSet is a compiled view of the :class:`filter.Filter`s of several
+    :class:`rule.Rule`s.
+
+    Instead of running every pattern of every Rule against a message, the
+    RuleSet merges the patterns into a few alternations (one capturing group
+    per pattern) and scans the message with them. Since most messages don't
+    match anything, this means that most messages only cost a single
+    :func:`re.search` per alternation.
+
+    When an alternation does match, the pattern that produced the match is
+    known thanks to :attr:`re.Match.lastindex` and its captures are read from
+    the combined match. The other patterns of the same alternation are then
+    checked one by one, so that *every* matching pattern is reported, exactly
+    as if each pattern had been searched separately.
+
+    Patterns that can't be safely merged (numbered back-references,
+    conditional groups, inline global flags, ...) are kept *standalone* and
+    are always searched separately.
+
+    The captures of typed groups are validated and converted (see
+    :func:`filter.Filter.convert`), and a match whose captures are not valid
+    is dropped right away.
+
+    In front of all this sits a *prefilter*: a single case-insensitive
+    alternation of the literals required by the patterns (see
+    :func:`filter.Filter.extract_literal`). A message that doesn't contain
+    any of these literals can't match any of the patterns that have one, so
+    these patterns are skipped altogether. Patterns without a required
+    literal are always scanned.
+
+    Messages can either be `str` or raw `bytes` (see :func:`compile_view`),
+    in which case only the captures of the matching patterns are decoded.
+
+    Finally, scan results can be memoized in a :class:`cache.MatchCache`.
+
+    .. note::
+        The RuleSet is built once, when the Rules are loaded. It never
+        modifies the Rules nor their Filters.
+    """
+
+    chunk_size = 32
+    """Maximum number of patterns merged in a single alternation."""
+
+    _group_re = re.compile(r'(?<!\\)((?:\\\\)*)\(\?P([<=])(\w+)')
+    _unsafe_re = re.compile(r'(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?\()')
+
+    def __init__(self, rules, cache=None):
+        """
+        Initializes a newly created RuleSet with the given list of
+        :class:`rule.Rule`s.
+
+        *rules* is a list of :class:`rule.Rule`s (or of any object having a
+        *filter* attribute).
+
+        *cache* is an optional :class:`cache.MatchCache` used to memoize the
+        scan results. It can be shared by several RuleSets.
+        """
+        self.rules = list(rules)
+        self.cache = cache
+
+        # Flat list of (rule_index, regex_index, regex) tuples, in the order
+        # in which they would have been checked one by one:
+        self.patterns = []
+
+        # List of (pattern_index, literal, renamed_pattern) tuples, where
+        # `literal` is the literal required by the pattern (or None) and
+        # `renamed_pattern` is None when the pattern can't be merged:
+        self.members = []
+
+        # Required literals:
+        self.literals = []
+
+        # Compiled views of the patterns, for `str` messages (False) and for
+        # `bytes` messages (True). See `compile_view`:
+        self.views = {}
+
+        self.build()
+
+    def __len__(self):
+        """
+        Returns the number of patterns in the RuleSet.
+        """
+        return len(self.patterns)
+
+    def __repr__(self):
+        """
+        """
+        prefilter, combined, standalone, unguarded = self.view(False)
+
+        return '<RuleSet - rules: {0}, patterns: {1}, alternations: {2}, ' \
+               'standalone: {3}, literals: {4}>' \
+               .format(len(self.rules), len(self.patterns), len(combined),
+                       len(standalone), len(self.literals))
+
+    @classmethod
+    def rename_groups(cls, pattern, prefix):
+        """
+        Prefixes every named group (and every named back-reference) of the
+        given pattern with *prefix*, so that several patterns using the same
+        group names can be merged in a single regular expression.
+
+        Returns the modified pattern.
+        """
+        return cls._group_re.sub(
+            lambda m: '{0}(?P{1}{2}{3}'.format(m.group(1), m.group(2),
+                                               prefix, m.group(3)),
+            pattern)
+
+    @classmethod
+    def is_combinable(cls, regex, renamed):
+        """
+        Checks if the given :class:`re.RegexObject` can be merged with other
+        patterns once its groups have been renamed (*renamed* is the renamed
+        pattern, as returned by :func:`rename_groups`).
+
+        Returns True if the pattern can be merged, False otherwise.
+        """
+        if not isinstance(regex.pattern, str):
+            return False
+
+        if cls._unsafe_re.search(regex.pattern):
+            return False
+
+        try:
+            wrapped = re.compile('({0})'.format(renamed), flags=regex.flags)
+        except re.error:
+            return False
+
+        # Make sure the renaming didn't break anything:
+        return wrapped.groups == regex.groups + 1 \
+            and len(wrapped.groupindex) == len(regex.groupindex)
+
+    @staticmethod
+    def encode(pattern, flags):
+        """
+        Compiles the given `str` *pattern* as a `bytes` regular expression,
+        so that it can be used on raw messages.
+
+        Returns the compiled regular expression, or None if the pattern can
+        not be used on bytes (non-ASCII pattern, escapes that are only valid
+        in `str` patterns, ...).
+        """
+        if not pattern.isascii():
+            return None
+
+        try:
+            return re.compile(pattern.encode('ascii'),
+                              flags=flags & ~re.UNICODE)
+        except (re.error, ValueError):
+            return None
+
+    def build(self):
+        """
+        Gathers the patterns of the Rules' Filters, their required literals,
+        and finds out which patterns can be merged.
+
+        The view for `str` messages is compiled right away. The one for
+        `bytes` messages is only compiled if needed.
+        """
+        literals = set()
+
+        for rule_index, rule in enumerate(self.rules):
+            for regex_index, regex in enumerate(rule.filter):
+                pattern_index = len(self.patterns)
+                self.patterns.append((rule_index, regex_index, regex))
+
+                literal = rule.filter.literals[regex_index]
+
+                if literal is not None:
+                    literals.add(literal)
+
+                prefix = '_p{0}_'.format(pattern_index)
+                renamed = self.rename_groups(regex.pattern, prefix)
+
+                if not self.is_combinable(regex, renamed):
+                    renamed = None
+
+                self.members.append((pattern_index, literal, renamed))
+
+        self.literals = sorted(literals, key=len, reverse=True)
+        self.view(False)
+
+        return self
+
+    def view(self, raw):
+        """
+        Returns the compiled view for `bytes` messages if *raw* is True, or
+        for `str` messages otherwise (see :func:`compile_view`).
+        """
+        try:
+            return self.views[raw]
+        except KeyError:
+            self.views[raw] = self.compile_view(raw)
+
+        return self.views[raw]
+
+    def compile_view(self, raw):
+        """
+        Compiles the prefilter and the combined regular expressions, either
+        for `str` messages or for `bytes` messages (when *raw* is True).
+
+        For `bytes` messages, patterns are compiled as `bytes` regular
+        expressions so that the messages don't have to be decoded. Patterns
+        that can't be used on bytes are matched against the decoded message.
+        Since case-insensitive `bytes` patterns only fold ASCII letters, only
+        ASCII literals are used by the prefilter.
+
+        Returns a (prefilter, combined, standalone, unguarded) tuple:
+
+            * *prefilter* is the alternation of the required literals, or
+              None ;
+            * *combined* is a list of (guarded, combined_regex,
+              {group_index: (pattern_index, regex)}) tuples. *guarded* tells
+              if all the patterns of the alternation have a required literal
+              (and can thus be skipped by the prefilter) ;
+            * *standalone* is a list of (guarded, pattern_index, regex,
+              decode) tuples for the patterns that are searched separately.
+              *decode* tells if the message has to be decoded first ;
+            * *unguarded* tells if some patterns don't have a required
+              literal.
+        """
+        chunks = {}
+        combined = []
+        standalone = []
+        literals = set()
+        unguarded = False
+
+        for pattern_index, literal, renamed in self.members:
+            regex = self.patterns[pattern_index][2]
+            decode = False
+
+            if raw and literal is not None and not literal.isascii():
+                literal = None
+
+            guarded = literal is not None
+
+            if guarded:
+                literals.add(literal)
+            else:
+                unguarded = True
+
+            if raw:
+                raw_regex = self.encode(regex.pattern, regex.flags)
+
+                if raw_regex is None:
+                    decode = True
+                    renamed = None
+                else:
+                    regex = raw_regex
+
+            if renamed is None:
+                standalone.append((guarded, pattern_index, regex, decode))
+            else:
+                # Patterns can only be merged if they share their flags:
+                chunks.setdefault((guarded, regex.flags), []) \
+                      .append((pattern_index, renamed, regex))
+
+        for (guarded, flags), members in chunks.items():
+            for i in range(0, len(members), self.chunk_size):
+                combined_regex, groups = self.combine(
+                    members[i:i + self.chunk_size], flags, raw)
+                combined.append((guarded, combined_regex, groups))
+
+        prefilter = None
+
+        if literals:
+            pattern = '|'.join(map(re.escape,
+                                   sorted(literals, key=len, reverse=True)))
+
+            if raw:
+                pattern = pattern.encode('ascii')
+
+            prefilter = re.compile(pattern, flags=re.IGNORECASE)
+
+        return (prefilter, combined, standalone, unguarded)
+
+    def combine(self, members, flags, raw=False):
+        """
+        Merges the given patterns in a single alternation.
+
+        *members* is a list of (pattern_index, renamed_pattern, regex)
+        tuples.
+
+        *flags* are the flags used to compile the alternation.
+
+        If *raw* is True, the alternation is compiled as a `bytes` regular
+        expression.
+
+        Returns a (combined_regex, {group_index: (pattern_index, regex)})
+        tuple.
+        """
+        alternatives = []
+        groups = {}
+        group_index = 1
+
+        for pattern_index, renamed, regex in members:
+            alternatives.append('({0})'.format(renamed))
+            groups[group_index] = (pattern_index, regex)
+            group_index += regex.groups + 1
+
+        pattern = '|'.join(alternatives)
+
+        if raw:
+            pattern = pattern.encode('ascii')
+
+        combined = re.compile(pattern, flags=flags)
+
+        return (combined, groups)
+
+    def scan(self, message):
+        """
+        Scans the given message (or gets the result from the cache, if any).
+
+        Returns a sorted sequence of (rule_index, regex_index, groupdict)
+        tuples, one for each pattern that matches the message with valid
+        captures.
+        """
+        if self.cache is None:
+            return self._scan(message)[0]
+
+        return self.cache.fetch(self, message, self._scan)
+
+    def _scan(self, message):
+        """
+        Actually scans the given message, which can either be a `str` or
+        raw `bytes`.
+
+        Returns a (results, rejected) tuple where *results* is the list
+        returned by :func:`scan` and *rejected* tells if the message was
+        rejected by the prefilter alone, without any regular expression
+        being run.
+        """
+        raw = isinstance(message, bytes)
+        prefilter, combined, standalone, unguarded = self.view(raw)
+        hits = []
+
+        # If the message doesn't contain any required literal, only the
+        # patterns that don't have one can match:
+        candidate = prefilter is not None \
+            and prefilter.search(message) is not None
+
+        for guarded, combined_regex, groups in combined:
+            if guarded and not candidate:
+                continue
+
+            match = combined_regex.search(message)
+
+            if match is None:
+                continue
+
+            first = match.lastindex
+
+            for group_index, (pattern_index, regex) in groups.items():
+                rule_index, regex_index = self.patterns[pattern_index][:2]
+
+                if group_index == first:
+                    # Captures of the matching pattern can be read directly
+                    # from the combined match:
+                    groupdict = {name: match.group(group_index + i)
+                                 for name, i in regex.groupindex.items()}
+                else:
+                    m = regex.search(message)
+
+                    if m is None:
+                        continue
+
+                    groupdict = m.groupdict()
+
+                hits.append((rule_index, regex_index, groupdict))
+
+        decoded = None
+
+        for guarded, pattern_index, regex, decode in standalone:
+            if guarded and not candidate:
+                continue
+
+            rule_index, regex_index = self.patterns[pattern_index][:2]
+
+            if decode:
+                if decoded is None:
+                    decoded = message.decode('utf-8', 'replace')
+
+                m = regex.search(decoded)
+            else:
+                m = regex.search(message)
+
+            if m is not None:
+                hits.append((rule_index, regex_index, m.groupdict()))
+
+        hits.sort(key=lambda hit: (hit[0], hit[1]))
+
+        results = []
+
+        for rule_index, regex_index, groupdict in hits:
+            if raw:
+                # Captures are only decoded once we know they are needed:
+                groupdict = {name: value.decode('utf-8', 'replace')
+                             if isinstance(value, bytes) else value
+                             for name, value in groupdict.items()}
+
+            groupdict = self.rules[rule_index].filter.convert(regex_index,
+                                                              groupdict)
+
+            if groupdict is not None:
+                results.append((rule_index, regex_index, groupdict))
+
+        rejected = not candidate and not unguarded
+
+        return (results, rejected)
+
+    def search(self, message):
+        """
+        Searches the given message for matches.
+
+        Returns a list of (rule, regex, groupdict) tuples, one for each
+        pattern that matches the message, in the order of the Rules and of
+        their Filters.
+        """
+        return [(self.rules[rule_index],
+                 self.rules[rule_index].filter[regex_index],
+                 groupdict)
+                for rule_index, regex_index, groupdict in self.scan(message)]
+
+    def search_batch(self, messages):
+        """
+        Searches each of the given messages for matches.
+
+        This allows to handle a whole batch of messages with a single call
+        (and thus with a single hop to an executor, if needed).
+
+        Returns a list holding, for each message, the list of (rule, regex,
+        groupdict) tuples returned by :func:`search`.
+        """
+        return [self.search(message) for message in messages]
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import warnings
+
+
+class ActionLane(object):
+    """
+    An ActionLane holds the queue of the Actions of a given module (e.g.
+    `ipset`), along with its concurrency limit, its priority, its own
+    thread pool and its statistics (see :class:`ActionScheduler`).
+    """
+    def __init__(self, name, limit, priority):
+        """
+        Initializes a newly created ActionLane.
+
+        *name* is the name of the module of the Actions.
+
+        *limit* is the maximum number of Actions of this lane running at
+        once. It is also the size of the thread pool of the lane.
+
+        *priority* is the priority of the lane. The lower, the sooner.
+        """
+        self.name = name
+        self.limit = limit
+        self.priority = priority
+
+        self.queue = collections.deque()
+        self.running = 0
+        self.done = 0
+        self.dropped = 0
+        self.waited = 0
+        self.max_wait = 0
+        self.executor = None
+
+    def __repr__(self):
+        """
+        """
+        return '<ActionLane - name: {0}, priority: {1}, queued: {2}, ' \
+               'running: {3}/{4}>'.format(self.name, self.priority,
+                                          len(self.queue), self.running,
+                                          self.limit)
+
+    def get_executor(self):
+        """
+        Returns the thread pool of the lane, creating it if needed.
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.limit,
+                thread_name_prefix='ellis-{0}'.format(self.name))
+
+        return self.executor
+
+    def average_wait(self):
+        """
+        Returns the average time (in seconds) the started Actions spent in
+        the queue.
+        """
+        started = self.done + self.running
+
+        return self.waited / started if started else 0
+
+
+class ActionScheduler(object):
+    """
+    An ActionScheduler runs the :class:`action.Action`s of the Rules that
+    fired, instead of starting each of them right away, so that a burst of
+    Actions can't start thousands of processes and a slow Action (e.g.
+    sending e-mails) can't starve the other ones (e.g. bans).
+
+    Actions are queued in one :class:`ActionLane` per action module. Each
+    lane runs at most *limit* Actions at once, and blocking Actions run in
+    the lane's own thread pool instead of the loop's default executor. On
+    top of that, at most *workers* Actions run at once, all lanes together:
+    when a slot is free, it goes to the lane with the lowest *priority*
+    value that has an Action waiting (bans come first, see
+    :attr:`priorities`). Within a lane, Actions run in order.
+
+    At most *queue_size* Actions wait in the queues, all lanes together.
+    When they are full, the ActionScheduler either:
+
+        * drops the new Action (`drop` policy) ;
+        * drops the newest Action of the lowest priority lane (`lowest`
+          policy), if its priority is lower than the new Action's one.
+          Otherwise, the new Action is dropped.
+
+    Dropped Actions are counted, and their future is cancelled.
+    """
+
+    policies = ('lowest', 'drop')
+
+    priorities = {
+        'ipset': 0,
+        'nftables': 0,
+        'mail': 20,
+        'sendmail': 20,
+    }
+    """Default priorities of the action modules. Other modules get 10."""
+
+    def __init__(self, workers=64, limit=8, limits=None, priorities=None,
+                 queue_size=10000, policy='lowest', loop=None):
+        """
+        Initializes a newly created ActionScheduler.
+
+        *workers* is the maximum number of Actions running at once.
+
+        *limit* is the default maximum number of Actions of a given module
+        running at once, and *limits* an optional dict of
+        {module: limit} overriding it.
+
+        *priorities* is an optional dict of {module: priority} overriding
+        the default priorities (see :attr:`priorities`).
+
+        *queue_size* is the maximum number of Actions waiting to run.
+
+        *policy* is what happens when the queues are full (`lowest` or
+        `drop`).
+
+        Raises :class:`exceptions.ValueError` if the policy is unknown.
+        """
+        if policy not in self.policies:
+            raise ValueError("Unknown queue policy: {0}".format(policy))
+
+        self.workers = workers
+        self.limit = limit
+        self.limits = dict(limits) if limits is not None else {}
+        self.priorities = dict(self.priorities)
+        self.priorities.update(priorities if priorities is not None else {})
+        self.queue_size = queue_size
+        self.policy = policy
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+
+        # Lanes, by name and by priority:
+        self.lanes = {}
+        self.ordered = []
+
+        self.queued = 0
+        self.running = 0
+        self.dropped = 0
+
+        self._dropping = False
+
+    def __repr__(self):
+        """
+        """
+        return '<ActionScheduler - queued: {0}/{1}, running: {2}/{3}, ' \
+               'dropped: {4}>'.format(self.queued, self.queue_size,
+                                      self.running, self.workers,
+                                      self.dropped)
+
+    def lane(self, name):
+        """
+        Returns the :class:`ActionLane` of the given action module, creating
+        it if needed.
+        """
+        lane = self.lanes.get(name)
+
+        if lane is None:
+            lane = ActionLane(name, self.limits.get(name, self.limit),
+                              self.priorities.get(name, 10))
+            self.lanes[name] = lane
+
+            self.ordered.append(lane)
+            self.ordered.sort(key=lambda lane: lane.priority)
+
+        return lane
+
+    def submit(self, action, kwargs=None):
+        """
+        Queues the given :class:`action.Action`, to be run with the given
+        *kwargs* (see :func:`action.Action.run`).
+
+        Returns a :class:`asyncio.Future` that is done once the Action has
+        run, or cancelled if the Action has been dropped.
+        """
+        lane = self.lane(action.mod_name)
+        future = self.loop.create_future()
+
+        if self.queued >= self.queue_size and not self.overflow(lane):
+            self.drop(lane, future)
+            return future
+
+        lane.queue.append((future, action, kwargs, self.loop.time()))
+        self.queued += 1
+
+        self.dispatch()
+
+        return future
+
+    def overflow(self, lane):
+        """
+        Makes room in the full queues for an Action of the given lane,
+        according to the policy.
+
+        Returns True if there is room for it.
+        """
+        if self.policy == 'lowest':
+            for victim in reversed(self.ordered):
+                if victim.priority <= lane.priority:
+                    break
+
+                if victim.queue:
+                    future = victim.queue.pop()[0]
+                    self.queued -= 1
+                    self.drop(victim, future)
+
+                    return True
+
+        return False
+
+    def drop(self, lane, future):
+        """
+        Drops the Action of the given lane whose future is given.
+        """
+        if not self._dropping:
+            warnings.warn("The action queue is full, actions are being "
+                          "dropped ({0} dropped so far).".format(self.dropped))
+            self._dropping = True
+
+        lane.dropped += 1
+        self.dropped += 1
+        future.cancel()
+
+    def dispatch(self):
+        """
+        Starts the queued Actions, as long as there are free slots.
+        """
+        now = self.loop.time()
+
+        for lane in self.ordered:
+            while lane.queue and lane.running < lane.limit \
+                    and self.running < self.workers:
+                future, action, kwargs, queued_at = lane.queue.popleft()
+                self.queued -= 1
+
+                if future.cancelled():
+                    continue
+
+                wait = now - queued_at
+                lane.waited += wait
+                lane.max_wait = max(lane.max_wait, wait)
+
+                lane.running += 1
+                self.running += 1
+
+                executor = None if asyncio.iscoroutinefunction(action.func) \
+                    else lane.get_executor()
+
+                task = asyncio.ensure_future(action.run(kwargs, executor))
+                task.add_done_callback(
+                    functools.partial(self._done, lane, future))
+
+            if self.running >= self.workers:
+                break
+
+        if self._dropping and self.queued < self.queue_size:
+            self._dropping = False
+
+    def _done(self, lane, future, task):
+        """
+        Called once an Action of the given lane has run: passes its outcome
+        to its *future* and starts the next Actions.
+        """
+        lane.running -= 1
+        lane.done += 1
+        self.running -= 1
+
+        if not future.done():
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        self.dispatch()
+
+    def stats(self):
+        """
+        Returns a list of (name, queued, running, limit, done, dropped,
+        average wait, max wait) tuples, one per lane, by priority. Wait times
+        are in seconds.
+        """
+        return [(lane.name, len(lane.queue), lane.running, lane.limit,
+                 lane.done, lane.dropped, lane.average_wait(), lane.max_wait)
+                for lane in self.ordered]
+
+    def stop(self):
+        """
+        Drops the queued Actions and shuts the thread pools down, without
+        waiting for the running Actions.
+        """
+        for lane in self.ordered:
+            while lane.queue:
+                lane.queue.popleft()[0].cancel()
+
+            if lane.executor is not None:
+                lane.executor.shutdown(wait=False)
+                lane.executor = None
+
+        self.queued = 0
@@ -12,16 +12,29 @@ class SearchMatches():
 
     See PEP-0492_ for further details about asynchronous iterators.
 
+    .. note::
+        The regular expressions are evaluated inline, on the loop: a
+        :func:`re.search` is much cheaper than the thread handoff needed to
+        run it in an executor. Use *executor=True* to get the former
+        behavior back.
+
+    .. seealso::
+        :class:`ruleset.RuleSet`, which checks a message against all the Rules
+        at once.
+
     .. _PEP-O492: https://www.python.org/dev/peps/pep-0492/#id62
     """
-    def __init__(self, rule, msg):
+    def __init__(self, rule, msg, executor=False):
         """
         Initializes a newly created SearchMatches object.
 
         The only noticeable thing here is that we use ``iter`` to get the
         Rule's filters as an iterable.
+
+        If *executor* is True, each search is wrapped in an `executor`_.
         """
         self.msg = msg
+        self.executor = executor
         self._regexes = iter(rule.filter)
         self._loop = asyncio.get_event_loop()
 
@@ -44,10 +57,14 @@ class SearchMatches():
 
     async def search(self, regex):
         """
-        Wraps the search for a match in an `executor`_ and awaits for it.
+        Searches for a match, either inline or wrapped in an `executor`_
+        (see *executor* in :func:`__init__`).
 
         .. _executor: https://docs.python.org/3/library/asyncio-eventloop.html#executor
         """
+        if not self.executor:
+            return self._search(regex)
+
         coro = self._loop.run_in_executor(None, self._search, regex)
         match = await coro
 
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import array
+import math
+
+
+def zeros(size):
+    """
+    Returns an array of *size* unsigned counters set to zero.
+    """
+    return array.array('I', bytes(size * array.array('I').itemsize))
+
+
+class CountMinSketch(object):
+    """
+    A CountMinSketch estimates how many times each key has been seen, in a
+    fixed amount of memory, whatever the number of distinct keys is.
+
+    The sketch is a table of *depth* rows of *width* counters. Each key is
+    hashed to one counter per row, and the estimate of a key is the lowest of
+    its counters. An estimate is never lower than the real count, and, with
+    a probability of at least *confidence*, it is not higher than the real
+    count plus *error* times the total count of all the keys.
+
+    With a *findtime*, the sketch only counts the last *findtime* seconds:
+    it is made of :attr:`generations` tables, each of them counting
+    *findtime* / :attr:`generations` seconds, plus a table holding their
+    sum. When time goes by, the oldest table is subtracted from the sum and
+    cleared.
+
+    .. note::
+        The window slides by steps of one generation: a key may be counted
+        up to *findtime* / :attr:`generations` seconds longer than
+        *findtime*.
+    """
+
+    generations = 4
+    """Number of tables of the window."""
+
+    def __init__(self, error=0.0001, confidence=0.99, findtime=None):
+        """
+        Initializes a newly created CountMinSketch.
+
+        *error* is the maximum overestimation, relatively to the total count.
+
+        *confidence* is the probability that an estimate is within the error
+        bound.
+
+        *findtime* is the length of the window, in seconds. None means that
+        keys are counted forever.
+
+        Raises :class:`exceptions.ValueError` if *error* or *confidence* are
+        not in ]0, 1[.
+        """
+        if not 0 < error < 1 or not 0 < confidence < 1:
+            raise ValueError("Error and confidence must be in ]0, 1[")
+
+        self.error = error
+        self.width = int(math.ceil(math.e / error))
+        self.depth = int(math.ceil(math.log(1 / (1 - confidence))))
+        self.findtime = findtime
+        self.resolution = findtime / self.generations if findtime else None
+
+        # Sum of the tables of the window, and the tables themselves:
+        self.total = zeros(self.width * self.depth)
+        self.tables = [zeros(self.width * self.depth)
+                       for i in range(self.generations)] if findtime else None
+
+        # Total count of the window, and of each of its tables:
+        self.count = 0
+        self.counts = [0] * self.generations if findtime else None
+
+        # Current generation (timestamp / resolution):
+        self.tick = None
+
+    def __repr__(self):
+        """
+        """
+        return '<CountMinSketch - width: {0}, depth: {1}, findtime: {2}>' \
+               .format(self.width, self.depth, self.findtime)
+
+    def cells(self, key):
+        """
+        Returns the position of the counter of the given *key* in each row.
+
+        Positions are derived from a single hash (see Kirsch and
+        Mitzenmacher, "Less Hashing, Same Performance"). The hash is mixed
+        first, since the hash of an int is the int itself.
+        """
+        h = (hash(key) * 0x9e3779b97f4a7c15) & 0xffffffffffffffff
+        h1 = h >> 32
+        h2 = (h & 0xffffffff) | 1
+        width = self.width
+
+        return [row * width + (h1 + row * h2) % width
+                for row in range(self.depth)]
+
+    def advance(self, tick):
+        """
+        Moves the window forward to the given *tick*, clearing the tables
+        that fall out of it.
+        """
+        if self.tick is None:
+            self.tick = tick
+            return
+
+        elapsed = tick - self.tick
+
+        if elapsed <= 0:
+            return
+
+        if elapsed >= self.generations:
+            self.clear()
+        else:
+            total = self.total
+
+            for t in range(self.tick + 1, tick + 1):
+                table = self.tables[t % self.generations]
+
+                self.count -= self.counts[t % self.generations]
+                self.counts[t % self.generations] = 0
+
+                for i, count in enumerate(table):
+                    if count:
+                        total[i] -= count
+                        table[i] = 0
+
+        self.tick = tick
+
+    def add(self, key, timestamp=None, amount=1):
+        """
+        Counts *amount* occurrences of the given *key* at the given
+        *timestamp* (in seconds since the epoch, only used with a
+        *findtime*). Occurrences that are already out of the window are
+        not counted.
+
+        Returns the new estimate of the key.
+        """
+        table = None
+
+        if self.findtime:
+            tick = int(timestamp // self.resolution)
+
+            if tick != self.tick:
+                self.advance(tick)
+
+            if tick <= self.tick - self.generations:
+                return self.estimate(key)
+
+            table = self.tables[tick % self.generations]
+            self.counts[tick % self.generations] += amount
+
+        self.count += amount
+
+        # Note: this runs for every match, hence the inlined loop.
+        total = self.total
+        estimate = None
+
+        for i in self.cells(key):
+            if table is not None:
+                table[i] += amount
+
+            count = total[i] + amount
+            total[i] = count
+
+            if estimate is None or count < estimate:
+                estimate = count
+
+        return estimate
+
+    def estimate(self, key):
+        """
+        Returns the estimate of the given *key*.
+        """
+        total = self.total
+
+        return min(total[i] for i in self.cells(key))
+
+    def error_bound(self):
+        """
+        Returns the maximum overestimation of the estimates (with a
+        probability of at least *confidence*): *error* times the total count
+        of the window.
+        """
+        return int(self.error * self.count)
+
+    def clear(self):
+        """
+        Resets every counter.
+        """
+        self.total = zeros(len(self.total))
+        self.count = 0
+
+        if self.tables is not None:
+            self.tables = [zeros(len(self.total))
+                           for i in range(self.generations)]
+            self.counts = [0] * self.generations
+
+    def memory(self):
+        """
+        Returns the memory used by the counters, in bytes.
+        """
+        tables = len(self.tables) + 1 if self.tables is not None else 1
+
+        return tables * len(self.total) * self.total.itemsize
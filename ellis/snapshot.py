@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
+import warnings
+
+
+def encode_key(index):
+    """
+    Returns the text stored for the given Counter *index* (see
+    :func:`filter.Filter.pack`).
+    """
+    return json.dumps(index, separators=(',', ':'))
+
+
+def decode_keys(texts, typed=False):
+    """
+    Returns the list of the Counter indexes stored as the given *texts* (see
+    :func:`encode_key`). Strings are interned again.
+
+    *typed* tells if the indexes only hold single ints (typed captures),
+    which don't need any conversion.
+
+    .. note::
+        The texts are decoded as a single JSON array, which is several times
+        faster than decoding them one by one.
+    """
+    indexes = json.loads('[{0}]'.format(','.join(texts)))
+
+    if typed:
+        return indexes
+
+    for i, index in enumerate(indexes):
+        if isinstance(index, list):
+            indexes[i] = tuple(sys.intern(value) if isinstance(value, str)
+                               else value for value in index)
+        elif isinstance(index, str):
+            indexes[i] = sys.intern(index)
+
+    return indexes
+
+
+class Snapshot(object):
+    """
+    A Snapshot saves the state of the :class:`matches.Matches` (the counts
+    of every tracked key and the keys each Rule fired for) to a SQLite
+    database, so that a restart doesn't give every offender a fresh start.
+
+    The database is loaded once, when Ellis starts. Then, every *interval*
+    seconds, only the keys that changed since the previous save are written
+    (see :func:`matches.Counter.collect`). Changes are collected on the
+    event loop, but written off the event loop. The database uses
+    write-ahead logging, so that a save never has to rewrite it.
+
+    The state of a Rule is only restored if the Rule's captures (see
+    :func:`filter.Filter.build_layout`) and `findtime` didn't change.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS rules ('
+        ' name TEXT PRIMARY KEY, layout TEXT, findtime REAL, tick INTEGER)',
+        'CREATE TABLE IF NOT EXISTS counts ('
+        ' rule TEXT, key TEXT, tick INTEGER, count INTEGER,'
+        ' PRIMARY KEY (rule, key, tick)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS actioned ('
+        ' rule TEXT, key TEXT, rearmed_at REAL,'
+        ' PRIMARY KEY (rule, key)) WITHOUT ROWID',
+    )
+
+    def __init__(self, path, interval=30, loop=None):
+        """
+        Initializes a newly created Snapshot.
+
+        *path* is the path to the database.
+
+        *interval* is the time (in seconds) between two saves.
+        """
+        self.path = path
+        self.interval = interval
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+
+        self.matches = None
+        self.rules = {}
+        self.connection = None
+        self.saved = 0
+
+        self._handle = None
+        self._saving = False
+        self._lock = threading.RLock()
+
+        # Changes collected but not written yet (see `_tick`):
+        self._unsaved = []
+
+    def __repr__(self):
+        """
+        """
+        return '<Snapshot - path: {0}, saved keys: {1}>' \
+               .format(self.path, self.saved)
+
+    def connect(self):
+        """
+        Opens the database, creating it if needed.
+        """
+        directory = os.path.dirname(self.path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Saves happen in an executor, one at a time:
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+        with self.connection:
+            for statement in self.schema:
+                self.connection.execute(statement)
+
+        return self
+
+    @staticmethod
+    def describe(rule):
+        """
+        Returns the (layout, findtime) the state of the given Rule depends
+        on.
+        """
+        return (json.dumps(rule.filter.layout), rule.findtime)
+
+    def load(self, matches, rules):
+        """
+        Restores the state of the given :class:`matches.Matches` for the
+        given Rules, and starts tracking the changes of their Counters.
+
+        The state of the Rules that no longer exist, or whose captures or
+        `findtime` changed, is dropped.
+
+        .. note:: This method **is** blocking.
+        """
+        self.matches = matches
+        self.rules = {rule.name: rule for rule in rules}
+
+        try:
+            self.connect()
+            saved = {name: (layout, findtime, tick)
+                     for name, layout, findtime, tick
+                     in self.connection.execute('SELECT * FROM rules')}
+        except (OSError, sqlite3.Error) as e:
+            warnings.warn("Unable to open the state database ({0}): {1}. "
+                          "The state won't be saved.".format(self.path, e))
+
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+            return self
+
+        for name, rule in self.rules.items():
+            counter = matches.counter(rule).track()
+
+            if name not in saved:
+                continue
+
+            layout, findtime, tick = saved.pop(name)
+
+            if (layout, findtime) != self.describe(rule):
+                warnings.warn("Rule '{0}' changed, its saved state is "
+                              "dropped.".format(name))
+                saved[name] = None
+                continue
+
+            typed = len(rule.filter.layout) == 1 \
+                and rule.filter.layout[0][1] in rule.filter.tag_encoders
+
+            rows = self.connection.execute('SELECT key, tick, count '
+                                           'FROM counts WHERE rule = ?',
+                                           (name,)).fetchall()
+            counts = zip(decode_keys([row[0] for row in rows], typed),
+                         [row[1] for row in rows], [row[2] for row in rows])
+
+            rows = self.connection.execute('SELECT key, rearmed_at '
+                                           'FROM actioned WHERE rule = ?',
+                                           (name,)).fetchall()
+            actioned = zip(decode_keys([row[0] for row in rows], typed),
+                           [row[1] for row in rows])
+
+            counter.restore(counts, actioned, tick)
+
+        if saved:
+            with self.connection:
+                for name in saved:
+                    self.drop(name)
+
+        return self
+
+    def drop(self, name):
+        """
+        Deletes the saved state of the given Rule.
+        """
+        for table, column in (('rules', 'name'), ('counts', 'rule'),
+                              ('actioned', 'rule')):
+            self.connection.execute('DELETE FROM {0} WHERE {1} = ?'
+                                    .format(table, column), (name,))
+
+    def start(self):
+        """
+        Starts saving the state periodically.
+        """
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+        return self
+
+    def stop(self):
+        """
+        Stops saving the state periodically, saves it one last time (along
+        with the changes of the save in progress, if it didn't run yet) and
+        closes the database.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        # Waits for the save in progress, if it's running:
+        with self._lock:
+            if self.connection is None:
+                return
+
+            self._unsaved.extend(self.collect())
+
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                warnings.warn("Unable to write the state database ({0}): "
+                              "{1}.".format(self.path, e))
+            finally:
+                self.connection.close()
+                self.connection = None
+
+    def _tick(self):
+        """
+        Collects the changes and saves them in an executor, if needed, and
+        schedules the next save.
+        """
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+        if self.connection is not None and not self._saving:
+            self._saving = True
+            self._unsaved.extend(self.collect())
+
+            future = self.loop.run_in_executor(None, self.flush)
+            future.add_done_callback(self._saved)
+
+    def flush(self):
+        """
+        Writes the changes that have been collected but not written yet.
+        If the write fails, they are written again on the next save.
+
+        .. note:: This method **is** blocking.
+        """
+        with self._lock:
+            # The database is closed once `stop` wrote everything:
+            if self.connection is None or not self._unsaved:
+                return
+
+            changes = self._unsaved
+            self.save(changes)
+            self._unsaved = []
+
+    def _saved(self, future):
+        """
+        Called once the changes have been written by the executor.
+        """
+        self._saving = False
+
+        exception = future.exception()
+
+        if exception is not None:
+            warnings.warn("Unable to write the state database ({0}): {1}."
+                          .format(self.path, exception))
+
+    def collect(self):
+        """
+        Collects the changes of every Counter (see
+        :func:`matches.Counter.collect`).
+
+        Returns a list of (rule name, rule description, tick, changes)
+        tuples.
+        """
+        changes = []
+
+        for name, rule in self.rules.items():
+            counter = self.matches.counter(rule)
+            changes.append((name, self.describe(rule), counter.tick,
+                            counter.collect()))
+
+        return changes
+
+    def save(self, changes):
+        """
+        Writes the given changes (see :func:`collect`) to the database, in a
+        single transaction.
+
+        .. note:: This method **is** blocking.
+        """
+        connection = self.connection
+
+        with self._lock, connection:
+            for name, (layout, findtime), tick, \
+                    (dropped, counts, actioned, expired) in changes:
+                connection.execute(
+                    'INSERT OR REPLACE INTO rules VALUES (?, ?, ?, ?)',
+                    (name, layout, findtime, tick))
+
+                if expired is not None:
+                    connection.execute('DELETE FROM counts '
+                                       'WHERE rule = ? AND tick <= ?',
+                                       (name, expired))
+
+                connection.executemany(
+                    'DELETE FROM counts WHERE rule = ? AND key = ?',
+                    ((name, encode_key(index)) for index in dropped))
+
+                connection.executemany(
+                    'DELETE FROM counts '
+                    'WHERE rule = ? AND key = ? AND tick = ?',
+                    ((name, encode_key(index), tick)
+                     for index, tick, count in counts if not count))
+                connection.executemany(
+                    'INSERT OR REPLACE INTO counts VALUES (?, ?, ?, ?)',
+                    ((name, encode_key(index), tick, count)
+                     for index, tick, count in counts if count))
+
+                connection.executemany(
+                    'DELETE FROM actioned WHERE rule = ? AND key = ?',
+                    ((name, encode_key(index))
+                     for index, rearmed_at in actioned if rearmed_at is None))
+                connection.executemany(
+                    'INSERT OR REPLACE INTO actioned VALUES (?, ?, ?)',
+                    ((name, encode_key(index), rearmed_at)
+                     for index, rearmed_at in actioned
+                     if rearmed_at is not None))
+
+                self.saved += len(counts) + len(actioned)
@@ -0,0 +1,981 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import collections
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import json
+import os
+import re
+import socket
+import struct
+import sys
+import time
+import warnings
+
+try:
+    from systemd import journal
+except ImportError:
+    # Only needed by the JournalSource:
+    journal = None
+
+from .journald import add_matches, read_entries
+from .router import Router
+
+
+class Source(object):
+    """
+    A Source provides the entries that Ellis checks against the
+    :class:`rule.Rule`s.
+
+    Entries are journald-like dicts of fields:
+
+        * `MESSAGE` (a `str`, or `bytes` with the `raw_messages` setting) ;
+        * optionally `_SYSTEMD_UNIT` and `SYSLOG_IDENTIFIER`, used to route
+          the entry to the Rules that apply to it (see
+          :class:`router.Router`) ;
+        * optionally `__REALTIME_TIMESTAMP` (in microseconds since the epoch)
+          and `__CURSOR` (see :class:`checkpoint.Checkpoint`).
+
+    A Source doesn't push its entries, nor spawns a task per entry: it calls
+    *notify* whenever new entries are available, and the
+    :class:`pipeline.Pipeline` then pulls them in batches with :func:`read`.
+
+    Subclasses have to implement :func:`read`, and :func:`start` /
+    :func:`stop` when they need to set something up on the loop.
+    """
+    def __init__(self):
+        """
+        Initializes a newly created Source.
+        """
+        self.loop = None
+        self.notify = None
+        self.finished = None
+
+    def start(self, loop, notify, finished=None):
+        """
+        Starts watching for new entries.
+
+        *notify* is a callable that has to be called (without argument)
+        whenever new entries can be read.
+
+        *finished* is an optional callable, called once all the entries of a
+        finite Source have been read.
+        """
+        self.loop = loop
+        self.notify = notify
+        self.finished = finished
+
+        return self
+
+    def read(self, max_entries):
+        """
+        Returns a list of at most *max_entries* new entries, which is empty
+        when there is no new entry for now.
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        """
+        Stops watching for new entries.
+        """
+        pass
+
+
+class JournalSource(Source):
+    """
+    A JournalSource follows systemd-journald.
+
+    Only the entries that are in one of the given *scopes* are read (all of
+    them if there is no scope, see :func:`journald.add_matches`). When a
+    :class:`checkpoint.Checkpoint` is given, the JournalSource resumes right
+    after the last processed entry (see :func:`seek`).
+    """
+    def __init__(self, scopes=(), fields=None, raw_messages=False,
+                 checkpoint=None, max_catchup=86400):
+        """
+        Initializes a newly created JournalSource.
+
+        *fields* is the list of the fields to fetch (see
+        :func:`journald.read_entries`). Defaults to `MESSAGE` and the fields
+        used for routing.
+
+        *raw_messages* tells if messages have to be kept as `bytes`.
+
+        *max_catchup* is the maximum age (in seconds) of the entries the
+        JournalSource catches up with when it starts. 0 means no limit.
+        """
+        super().__init__()
+
+        if fields is None:
+            fields = ('MESSAGE',) + tuple(Router.fields)
+
+        self.scopes = list(scopes)
+        self.fields = tuple(fields)
+        self.raw_messages = raw_messages
+        self.checkpoint = checkpoint
+        self.max_catchup = max_catchup
+
+        self.reader = None
+
+    def __repr__(self):
+        """
+        """
+        return '<JournalSource - scopes: {0}>'.format(self.scopes)
+
+    def start(self, loop, notify, finished=None):
+        """
+        Opens the journal, seeks to where we have to start reading and adds
+        the journal to the loop.
+
+        Raises :class:`exceptions.RuntimeError` if python-systemd is not
+        available.
+        """
+        if journal is None:
+            raise RuntimeError("Reading systemd-journald requires the "
+                               "systemd-python package.")
+
+        super().start(loop, notify, finished)
+
+        self.reader = journal.Reader()
+
+        # Let journald filter the entries (debug entries are ignored):
+        add_matches(self.reader, self.scopes, journal.LOG_INFO)
+
+        # And seek to where we have to start reading:
+        catching_up = self.seek()
+
+        self.loop.add_reader(self.reader.fileno(), self.process)
+
+        # Entries written while we were down are already there:
+        if catching_up:
+            self.loop.call_soon(self.notify)
+
+        return self
+
+    def process(self):
+        """
+        Called by the loop when the journal changed.
+        """
+        op = self.reader.process()
+
+        if op is journal.APPEND:
+            self.notify()
+
+    def read(self, max_entries):
+        """
+        Reads at most *max_entries* new entries from journald (see
+        :func:`journald.read_entries`).
+        """
+        return read_entries(self.reader, max_entries, self.fields,
+                            self.raw_messages)
+
+    def seek(self):
+        """
+        Moves the journald reader right after the last entry processed
+        before Ellis stopped, if it's known (see *checkpoint*).
+
+        If this entry is older than *max_catchup*, the reader is moved to the
+        first entry that is not. If there is no such entry, the reader is
+        moved to the end of the journal, so that we only get new entries.
+
+        Returns True if there are entries to catch up with, False otherwise.
+        """
+        cursor, timestamp = (None, None)
+
+        if self.checkpoint is not None:
+            cursor, timestamp = self.checkpoint.load()
+
+        if cursor is None:
+            self.reader.seek_tail()
+            self.reader.get_previous()
+
+            return False
+
+        oldest = time.time() - self.max_catchup
+
+        if self.max_catchup and timestamp < oldest:
+            warnings.warn("The last processed entry is too old, only "
+                          "catching up with the last {0} seconds."
+                          .format(self.max_catchup))
+
+            self.reader.seek_realtime(datetime.datetime.fromtimestamp(oldest))
+
+            return True
+
+        self.reader.seek_cursor(cursor)
+
+        # The entry at the cursor has already been processed:
+        self.reader.get_next()
+
+        if not self.reader.test_cursor(cursor):
+            # It doesn't exist anymore, so we just skipped an entry that
+            # hasn't been processed yet:
+            self.reader.get_previous()
+
+        return True
+
+    def stop(self):
+        """
+        Removes the journal from the loop and closes it.
+        """
+        if self.reader is None:
+            return
+
+        self.loop.remove_reader(self.reader.fileno())
+
+        self.reader.flush_matches()
+        self.reader.close()
+        self.reader = None
+
+
+class ReplaySource(Source):
+    """
+    A ReplaySource replays entries from a file, so that Ellis can run (and be
+    tested or benchmarked) without systemd-journald.
+
+    Supported formats are:
+
+        * `json`: the output of `journalctl -o json`, one JSON object per
+          line ;
+        * `export`: the output of `journalctl -o export` (the `Journal Export
+          Format`_) ;
+        * `text`: plain text, each line being a `MESSAGE`. Entries get the
+          given *unit* as `_SYSTEMD_UNIT`, so that scoped Rules apply.
+
+    The file is parsed as a stream, only the fields needed for matching are
+    kept, and cursors are dropped so that replayed entries are never
+    checkpointed.
+
+    Entries are either replayed as fast as possible (*speed* is 0) or with
+    their original timing, sped up *speed* times (which requires timestamps,
+    text files are always replayed as fast as possible).
+
+    .. note::
+        The file is read on the loop: a ReplaySource is meant for offline
+        runs, not to be used next to a live Source.
+
+    .. _Journal Export Format: https://www.freedesktop.org/wiki/Software/systemd/export/
+    """
+
+    formats = ('json', 'export', 'text')
+
+    def __init__(self, path, format=None, speed=0, unit=None, fields=None,
+                 raw_messages=False):
+        """
+        Initializes a newly created ReplaySource.
+
+        *path* is the path to the file, `-` meaning the standard input.
+
+        *format* is one of :attr:`formats`. It is guessed from the first
+        bytes of the file when it's not given.
+
+        *speed* is the timing factor (see above).
+
+        *fields* and *raw_messages*: see :class:`JournalSource`.
+
+        Raises :class:`exceptions.ValueError` if the format or the speed is
+        invalid.
+        """
+        super().__init__()
+
+        if format is not None and format not in self.formats:
+            raise ValueError("Unknown replay format: {0}".format(format))
+
+        if speed < 0:
+            raise ValueError("Replay speed must be >= 0 ({0} given)"
+                             .format(speed))
+
+        if fields is None:
+            fields = ('MESSAGE',) + tuple(Router.fields)
+
+        self.path = path
+        self.format = format
+        self.speed = speed
+        self.unit = unit
+        self.fields = tuple(fields)
+        self.raw_messages = raw_messages
+
+        self.file = None
+        self.entries = None
+        self.count = 0
+
+        # Next entry, when it's not time to replay it yet:
+        self._next = None
+        self._handle = None
+
+        # Original and actual time of the first entry:
+        self._origin = None
+        self._started = None
+
+    def __repr__(self):
+        """
+        """
+        return '<ReplaySource - path: {0}, format: {1}, speed: {2}, ' \
+               'replayed: {3}>'.format(self.path, self.format, self.speed,
+                                       self.count)
+
+    def start(self, loop, notify, finished=None):
+        """
+        Opens the file and starts replaying it.
+        """
+        super().start(loop, notify, finished)
+
+        if self.path == '-':
+            self.file = sys.stdin.buffer
+        else:
+            self.file = open(self.path, 'rb')
+
+        if self.format is None:
+            self.format = self.guess_format(self.file.peek(64))
+
+        parse = getattr(self, 'parse_{0}'.format(self.format))
+        self.entries = parse(self.file)
+
+        self.loop.call_soon(self.notify)
+
+        return self
+
+    @staticmethod
+    def guess_format(head):
+        """
+        Guesses the format of a file from its first bytes.
+        """
+        head = head.lstrip()
+
+        if head.startswith(b'{'):
+            return 'json'
+
+        field = head.split(b'\n', 1)[0].split(b'=', 1)[0]
+
+        if field and field.replace(b'_', b'').isalnum() \
+                and field.upper() == field and b'=' in head:
+            return 'export'
+
+        return 'text'
+
+    def project(self, fields):
+        """
+        Returns an entry holding the needed fields of the given dict of
+        *fields* (whose values are `str`).
+        """
+        entry = {field: fields[field]
+                 for field in self.fields if field in fields}
+
+        if self.raw_messages and 'MESSAGE' in entry:
+            entry['MESSAGE'] = entry['MESSAGE'].encode('utf-8')
+
+        try:
+            entry['__REALTIME_TIMESTAMP'] = \
+                int(fields['__REALTIME_TIMESTAMP'])
+        except (KeyError, ValueError):
+            pass
+
+        return entry
+
+    def parse_json(self, f):
+        """
+        Parses the output of `journalctl -o json`.
+
+        Yields entries.
+        """
+        for line in f:
+            try:
+                data = json.loads(line.decode('utf-8', 'replace'))
+            except ValueError:
+                warnings.warn("Ignoring invalid JSON entry: {0!r}"
+                              .format(line[:80]))
+                continue
+
+            fields = {}
+
+            for field, value in data.items():
+                if isinstance(value, list):
+                    if value and all(isinstance(i, int) for i in value):
+                        # Binary values are given as arrays of bytes:
+                        value = bytes(value).decode('utf-8', 'replace')
+                    elif value:
+                        # Fields set several times, keep the last value:
+                        value = value[-1]
+                    else:
+                        continue
+
+                if value is not None:
+                    fields[field] = str(value)
+
+            yield self.project(fields)
+
+    def parse_export(self, f):
+        """
+        Parses the Journal Export Format (`journalctl -o export`).
+
+        Yields entries.
+        """
+        fields = {}
+
+        while True:
+            line = f.readline()
+
+            if not line or line == b'\n':
+                # End of an entry:
+                if fields:
+                    yield self.project(fields)
+                    fields = {}
+
+                if not line:
+                    break
+
+                continue
+
+            line = line[:-1] if line.endswith(b'\n') else line
+
+            if b'=' in line:
+                field, value = line.split(b'=', 1)
+            else:
+                # Binary field: the name, then the size (64-bit LE), the
+                # data and a newline.
+                field = line
+                size = f.read(8)
+
+                if len(size) < 8:
+                    break
+
+                value = f.read(struct.unpack('<Q', size)[0])
+                f.read(1)
+
+            fields[field.decode('ascii', 'replace')] = \
+                value.decode('utf-8', 'replace')
+
+    def parse_text(self, f):
+        """
+        Parses plain text, one message per line.
+
+        Yields entries.
+        """
+        for line in f:
+            fields = {'MESSAGE': line.rstrip(b'\r\n')
+                                     .decode('utf-8', 'replace')}
+
+            if self.unit is not None:
+                fields['_SYSTEMD_UNIT'] = self.unit
+
+            yield self.project(fields)
+
+    def delay(self, entry):
+        """
+        Returns the time (in seconds) to wait before the given entry can be
+        replayed.
+        """
+        timestamp = entry.get('__REALTIME_TIMESTAMP')
+
+        if not self.speed or timestamp is None:
+            return 0
+
+        if self._origin is None:
+            self._origin = timestamp
+            self._started = self.loop.time()
+
+        due = self._started + (timestamp - self._origin) / 1000000 \
+            / self.speed
+
+        return due - self.loop.time()
+
+    def read(self, max_entries):
+        """
+        Returns at most *max_entries* entries that are due.
+        """
+        entries = []
+
+        if self.entries is None or self._handle is not None:
+            return entries
+
+        while len(entries) < max_entries:
+            if self._next is not None:
+                entry, self._next = self._next, None
+            else:
+                try:
+                    entry = next(self.entries)
+                except StopIteration:
+                    self.close()
+                    break
+
+            delay = self.delay(entry)
+
+            if delay > 0:
+                # Not yet, come back later:
+                self._next = entry
+                self._handle = self.loop.call_later(delay, self.wake_up)
+                break
+
+            entries.append(entry)
+
+        self.count += len(entries)
+
+        return entries
+
+    def wake_up(self):
+        """
+        Called when the next entry is due.
+        """
+        self._handle = None
+        self.notify()
+
+    def close(self):
+        """
+        Closes the file, and tells that all the entries have been read.
+        """
+        if self.file is not None and self.file is not sys.stdin.buffer:
+            self.file.close()
+
+        self.file = None
+        self.entries = None
+
+        if self.finished is not None:
+            self.loop.call_soon(self.finished)
+
+    def stop(self):
+        """
+        Stops replaying.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        if self.file is not None and self.file is not sys.stdin.buffer:
+            self.file.close()
+
+        self.file = None
+        self.entries = None
+
+
+class Inotify(object):
+    """
+    A minimal wrapper around the Linux inotify API (through :mod:`ctypes`),
+    so that the events can be read on the loop.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+
+    _event = struct.Struct('iIII')
+
+    def __init__(self):
+        """
+        Initializes a newly created Inotify instance.
+
+        Raises :class:`exceptions.OSError` if inotify is not available.
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+        try:
+            self._add_watch = libc.inotify_add_watch
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        if fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+        self.fd = fd
+
+    def watch(self, path, mask):
+        """
+        Watches the given *path* for the events of the given *mask*.
+
+        Returns the watch descriptor.
+        """
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+
+        return wd
+
+    def read(self):
+        """
+        Reads the pending events.
+
+        Returns a list of (wd, mask, name) tuples.
+        """
+        events = []
+
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+
+            while offset < len(data):
+                wd, mask, cookie, length = \
+                    self._event.unpack_from(data, offset)
+                offset += self._event.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+
+                events.append((wd, mask, os.fsdecode(name)))
+
+        return events
+
+    def close(self):
+        """
+        """
+        os.close(self.fd)
+
+
+class FileSource(Source):
+    """
+    A FileSource tails a log file, like `tail -F` does.
+
+    The directory of the file is watched with inotify, so nothing happens
+    until the file is written to. The file is then read incrementally in
+    chunks of *chunk_size* bytes and split into lines, each line being the
+    `MESSAGE` of an entry.
+
+    The FileSource follows the rotations of the file: once the rotated file
+    has been read up to its end, the new file is read from its beginning.
+    Truncated files (`copytruncate`) are read again from their beginning.
+
+    Entries get the given *unit* as `_SYSTEMD_UNIT`, so that Rules scoped to
+    this unit apply to them.
+    """
+
+    mask = Inotify.IN_MODIFY | Inotify.IN_ATTRIB | Inotify.IN_CREATE \
+        | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO
+
+    def __init__(self, path, unit=None, fields=None, raw_messages=False,
+                 chunk_size=65536):
+        """
+        Initializes a newly created FileSource.
+
+        *path* is the path to the file. It doesn't have to exist yet.
+
+        *fields* and *raw_messages*: see :class:`JournalSource`.
+        """
+        super().__init__()
+
+        if fields is None:
+            fields = ('MESSAGE',) + tuple(Router.fields)
+
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(self.path)
+        self.unit = unit
+        self.fields = tuple(fields)
+        self.raw_messages = raw_messages
+        self.chunk_size = chunk_size
+
+        self.inotify = None
+        self.file = None
+        self.inode = None
+
+        # Complete lines not read yet, and the beginning of the next line:
+        self.lines = collections.deque()
+        self.buffer = b''
+
+    def __repr__(self):
+        """
+        """
+        return '<FileSource - path: {0}, unit: {1}>' \
+               .format(self.path, self.unit)
+
+    def start(self, loop, notify, finished=None):
+        """
+        Opens the file (we only want the lines written from now on) and
+        starts watching it.
+        """
+        super().start(loop, notify, finished)
+
+        self.inotify = Inotify()
+        self.inotify.watch(os.path.dirname(self.path), self.mask)
+        self.loop.add_reader(self.inotify.fd, self.process)
+
+        self.open(os.SEEK_END)
+
+        return self
+
+    def open(self, whence=os.SEEK_SET):
+        """
+        (Re)opens the file, at its beginning or at its end (*whence*).
+
+        Returns False if the file doesn't exist.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+
+        self.file.seek(0, whence)
+        self.inode = os.fstat(self.file.fileno()).st_ino
+
+        return True
+
+    def process(self):
+        """
+        Called by the loop when inotify events are available.
+        """
+        if any(name == self.name for wd, mask, name in self.inotify.read()):
+            self.notify()
+
+    def fill(self):
+        """
+        Reads the next chunk of the file.
+
+        When the end of the file is reached, checks if the file has been
+        rotated or truncated.
+
+        Returns False when there is nothing more to read for now.
+        """
+        chunk = self.file.read(self.chunk_size) if self.file else b''
+
+        if chunk:
+            lines = (self.buffer + chunk).split(b'\n')
+            self.buffer = lines.pop()
+            self.lines.extend(lines)
+
+            return True
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # Rotated, and not created again yet:
+            return False
+
+        if self.file is None or stat.st_ino != self.inode:
+            # Rotated: the old file is over, read the new one:
+            if self.buffer:
+                self.lines.append(self.buffer)
+                self.buffer = b''
+
+            return self.open()
+
+        if stat.st_size < self.file.tell():
+            # Truncated:
+            self.buffer = b''
+            self.file.seek(0)
+
+            return True
+
+        return False
+
+    def read(self, max_entries):
+        """
+        Returns at most *max_entries* new lines, as entries.
+        """
+        while len(self.lines) < max_entries and self.fill():
+            pass
+
+        entries = []
+        now = int(time.time() * 1000000)
+
+        for i in range(min(max_entries, len(self.lines))):
+            message = self.lines.popleft().rstrip(b'\r')
+
+            entry = {
+                'MESSAGE': message if self.raw_messages
+                else message.decode('utf-8', 'replace'),
+                '__REALTIME_TIMESTAMP': now,
+            }
+
+            if self.unit is not None:
+                entry['_SYSTEMD_UNIT'] = self.unit
+
+            entries.append(entry)
+
+        return entries
+
+    def stop(self):
+        """
+        Stops watching the file and closes it.
+        """
+        if self.inotify is not None:
+            self.loop.remove_reader(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SyslogSource(Source):
+    """
+    A SyslogSource receives syslog messages (RFC 3164 or RFC 5424) on a
+    datagram socket: either a Unix socket (like `/dev/log`) or a UDP socket.
+
+    Datagrams are not handled as they arrive: the socket is removed from the
+    loop until the pending datagrams have been received and parsed, in
+    batches, by :func:`read`. While the pipeline is blocked, datagrams thus
+    wait in the socket buffer (see *buffer_size*).
+
+    The tag of each message is used as `SYSLOG_IDENTIFIER`, and as the unit
+    (`<tag>.service`) so that Rules scoped to a systemd unit apply to the
+    messages of the corresponding program.
+    """
+
+    _rfc5424_re = re.compile(r'<(\d{1,3})>1 \S+ \S+ (\S+) (\S+) \S+ '
+                             r'(?:-|(?:\[(?:[^\]\\]|\\.)*\])+) ?(.*)',
+                             re.DOTALL)
+    _rfc3164_re = re.compile(r'<(\d{1,3})>'
+                             r'(?:[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d )?'
+                             r'(?:\S+ )??([^\s:\[]+)(?:\[(\d+)\])?: ?(.*)',
+                             re.DOTALL)
+
+    def __init__(self, address, fields=None, raw_messages=False,
+                 buffer_size=None):
+        """
+        Initializes a newly created SyslogSource.
+
+        *address* is either the path of a Unix socket or a (host, port)
+        tuple.
+
+        *fields* and *raw_messages*: see :class:`JournalSource`.
+
+        *buffer_size* is an optional size (in bytes) for the receive buffer
+        of the socket.
+        """
+        super().__init__()
+
+        if fields is None:
+            fields = ('MESSAGE',) + tuple(Router.fields)
+
+        self.address = address
+        self.fields = tuple(fields)
+        self.raw_messages = raw_messages
+        self.buffer_size = buffer_size
+
+        self.socket = None
+        self.received = 0
+
+    def __repr__(self):
+        """
+        """
+        return '<SyslogSource - address: {0}, received: {1}>' \
+               .format(self.address, self.received)
+
+    def start(self, loop, notify, finished=None):
+        """
+        Binds the socket and adds it to the loop.
+        """
+        super().start(loop, notify, finished)
+
+        if isinstance(self.address, str):
+            try:
+                os.unlink(self.address)
+            except FileNotFoundError:
+                pass
+
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.socket.bind(self.address)
+        else:
+            host, port = self.address
+            family, type, proto, name, address = socket.getaddrinfo(
+                host, port, type=socket.SOCK_DGRAM)[0]
+
+            self.socket = socket.socket(family, socket.SOCK_DGRAM)
+            self.socket.bind(address)
+
+        if self.buffer_size is not None:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                   self.buffer_size)
+
+        self.socket.setblocking(False)
+        self.loop.add_reader(self.socket.fileno(), self.readable)
+
+        return self
+
+    def readable(self):
+        """
+        Called by the loop when datagrams are available.
+        """
+        # Stop watching the socket until the datagrams have been read:
+        self.loop.remove_reader(self.socket.fileno())
+        self.notify()
+
+    def parse(self, datagram, now):
+        """
+        Parses the given syslog datagram, received at *now* (in
+        microseconds).
+
+        Returns an entry.
+        """
+        message = datagram.decode('utf-8', 'replace').rstrip('\r\n\0')
+        match = self._rfc5424_re.match(message)
+
+        if match is not None:
+            priority, identifier, pid, message = match.groups()
+            message = message.lstrip('\ufeff')
+        else:
+            match = self._rfc3164_re.match(message)
+
+            if match is not None:
+                priority, identifier, pid, message = match.groups()
+            else:
+                priority, identifier = (None, None)
+
+        entry = {
+            'MESSAGE': message.encode('utf-8') if self.raw_messages
+            else message,
+            '__REALTIME_TIMESTAMP': now,
+        }
+
+        if identifier is not None and identifier != '-':
+            entry['SYSLOG_IDENTIFIER'] = identifier
+            entry['_SYSTEMD_UNIT'] = '{0}.service'.format(identifier)
+
+        if priority is not None and 'PRIORITY' in self.fields:
+            entry['PRIORITY'] = str(int(priority) & 7)
+
+        return entry
+
+    def read(self, max_entries):
+        """
+        Receives and parses at most *max_entries* datagrams.
+        """
+        datagrams = []
+
+        while len(datagrams) < max_entries:
+            try:
+                datagrams.append(self.socket.recv(65536))
+            except BlockingIOError:
+                # Nothing left, wait for the next datagrams:
+                self.loop.add_reader(self.socket.fileno(), self.readable)
+                break
+
+        self.received += len(datagrams)
+        now = int(time.time() * 1000000)
+
+        return [self.parse(datagram, now) for datagram in datagrams]
+
+    def stop(self):
+        """
+        Closes the socket.
+        """
+        if self.socket is None:
+            return
+
+        self.loop.remove_reader(self.socket.fileno())
+        self.socket.close()
+        self.socket = None
+
+        if isinstance(self.address, str):
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
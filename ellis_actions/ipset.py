@@ -2,8 +2,9 @@
 # coding: utf-8
 
 import ipaddress
+import re
 
-from .shell_commander import ShellCommander
+from .shell_commander import Batch, ShellCommander
 
 
 class IpsetError(Exception):
@@ -27,12 +28,18 @@ class Ipset(ShellCommander):
     """
     CMD = 'ipset'
 
+    # Interactive mode, the `version` command delimits the outputs:
+    COPROCESS = ['-']
+    SENTINEL = b'version\n'
+    MARKER = rb'^ipset v\S+, protocol version'
+    PROMPT = b'ipset> '
+
     def __init__(self):
         """
         """
         super().__init__()
 
-    async def add(self, setname, ip, timeout=0):
+    async def add(self, setname, ip, timeout=0, coprocess=False):
         """
         Adds the given IP address to the given ipset.
         
@@ -43,9 +50,16 @@ class Ipset(ShellCommander):
 
         ``ipset add -exist ellis_blacklist4 192.0.2.10 timeout 14400``
 
+        With *coprocess*, the command is sent to a long-lived ``ipset -``
+        process instead (see :func:`ShellCommander.call_coprocess`).
         """
         args = ['add', '-exist', setname, ip, 'timeout', timeout]
 
+        if coprocess:
+            line = " ".join(str(arg) for arg in args) + "\n"
+
+            return await self.call_coprocess(line.encode('utf-8'))
+
         return await self.start(__class__.CMD, args)
 
     async def list(self, setname=None):
@@ -74,28 +88,32 @@ class Ipset(ShellCommander):
         If the address is an IPv4, we have to use *ellis_blacklist4*.
         If the address is an IPv6, we have to use *ellis_blacklist6*.
 
+        *ip* can either be a string or an already parsed address (as
+        provided by the typed tags of the filters), in which case it is not
+        parsed again.
+
         Raises ipaddress.AddressValueError if the address is neither
         an IPv4 nor an IPv6.
         """
         blacklist = 'ellis_blacklist{0}'
 
-        try:
-            address = ipaddress.ip_address(ip)
-        except ipaddress.AddressValueError:
-            raise
+        if isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            address = ip
         else:
-            if address.version is 6:
-                # We don't ban private IPv6:
-                if address.is_private:
-                    msg = "We don't ban private addresses ({0} given)." \
-                          .format(address)
-                    raise ipaddress.AddressValueError(msg)
-                else:
-                    # Do we have an embedded IPv4 ?
-                    if address.ipv4_mapped is not None:
-                        address = address.ipv4_mapped
-                    elif address.sixtofour is not None:
-                        address = address.sixtofour
+            address = ipaddress.ip_address(ip)
+
+        if address.version == 6:
+            # We don't ban private IPv6:
+            if address.is_private:
+                msg = "We don't ban private addresses ({0} given)." \
+                      .format(address)
+                raise ipaddress.AddressValueError(msg)
+            else:
+                # Do we have an embedded IPv4 ?
+                if address.ipv4_mapped is not None:
+                    address = address.ipv4_mapped
+                elif address.sixtofour is not None:
+                    address = address.sixtofour
 
         blacklist = blacklist.format(address.version)
 
@@ -116,11 +134,110 @@ class Ipset(ShellCommander):
             raise IpsetError(msg)
 
 
-async def ban(ip, timeout=0):
+class IpsetBatch(Batch):
+    """
+    Coalesces the addresses to add to the ipsets, and adds each batch of
+    them with a single ``ipset restore -exist`` process (fed through its
+    stdin), instead of launching one ``ipset add`` process per address
+    (see :class:`shell_commander.Batch`).
+
+    ``ipset restore`` stops at the first line it can't process: the
+    addresses before it are added, the failing one gets its error and the
+    following ones are retried with a new process. Each caller thus gets
+    its own result.
+    """
+    ERROR = re.compile(r'Error in line (\d+): (.*)')
+
+    def __init__(self, interval=0.05, batch_size=1024):
+        """
+        """
+        super().__init__(interval, batch_size)
+
+        self.ipset = Ipset()
+
+    async def add(self, setname, ip, timeout=0):
+        """
+        Queues the given IP address to be added to the given ipset (see
+        :func:`Ipset.add`), and waits for the batch to be processed.
+
+        Returns True once the address has been added.
+        """
+        return await super().add(setname, ip, int(timeout))
+
+    async def process(self, batch):
+        """
+        Adds the given batch of (setname, ip, timeout, future) tuples with
+        ``ipset restore -exist``, and sets the result of each future.
+
+        The resulting input looks like this:
+
+        ``add ellis_blacklist4 192.0.2.10 timeout 14400``
+        ``add ellis_blacklist4 192.0.2.11 timeout 14400``
+
+        """
+        while batch:
+            lines = "".join(f"add {setname} {ip} timeout {timeout}\n"
+                            for setname, ip, timeout, future in batch)
+
+            returncode, stdout_data, stderr_data = \
+                await self.ipset.run(Ipset.CMD, ['restore', '-exist'],
+                                     lines.encode('utf-8'))
+
+            if returncode == 0 and not stderr_data:
+                self.resolve(batch, True)
+                return
+
+            error = stderr_data.decode(errors='replace')
+            m = __class__.ERROR.search(error)
+
+            if m is None or not 0 < int(m.group(1)) <= len(batch):
+                # Not related to a given line, the whole batch failed:
+                self.resolve(batch, exception=self.error(stderr_data))
+                return
+
+            failed = int(m.group(1)) - 1
+
+            self.resolve(batch[:failed], True)
+            self.resolve(batch[failed:failed + 1],
+                         exception=self.error(m.group(2).encode('utf-8')))
+
+            batch = batch[failed + 1:]
+
+    def error(self, err):
+        """
+        Returns the exception :func:`Ipset.handle_error` raises for the
+        given error message.
+        """
+        return self.ipset.error(err)
+
+
+# Shared by all the `ban_batch` calls (see `ban_batch`):
+_batch = None
+
+
+async def ban(ip, timeout=0, coprocess=False):
     """
     """
     ipset = Ipset()
     address, ipset_name = ipset.chose_blacklist(ip)
     print("Adding {0} to {1}".format(address, ipset_name))
 
-    return await ipset.add(ipset_name, address, timeout)
+    return await ipset.add(ipset_name, address, timeout, coprocess)
+
+
+async def ban_batch(ip, timeout=0, interval=0.05, batch_size=1024, **kwargs):
+    """
+    Same as :func:`ban`, but the addresses banned within *interval* seconds
+    are added together, by batches of at most *batch_size* addresses (see
+    :class:`IpsetBatch`).
+
+    The batch settings of the first call apply to the following ones.
+    """
+    global _batch
+
+    if _batch is None:
+        _batch = IpsetBatch(interval, batch_size)
+
+    address, ipset_name = _batch.ipset.chose_blacklist(ip)
+
+    return await _batch.add(ipset_name, address, timeout)
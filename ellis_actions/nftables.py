@@ -2,8 +2,17 @@
 # coding: utf-8
 
 import ipaddress
+import re
 
-from .shell_commander import ShellCommander
+from .shell_commander import Batch, ShellCommander
+
+
+class NFTablesError(Exception):
+    pass
+
+
+class NFTablesNoRights(Exception):
+    pass
 
 
 class NFTablesSetNotFound(Exception):
@@ -54,28 +63,32 @@ class NFTables(ShellCommander):
         If the address is an IPv4, we have to use *ellis_blacklist4*.
         If the address is an IPv6, we have to use *ellis_blacklist6*.
 
+        *ip* can either be a string or an already parsed address (as
+        provided by the typed tags of the filters), in which case it is not
+        parsed again.
+
         Raises ipaddress.AddressValueError if the address is neither
         an IPv4 nor an IPv6.
         """
         blacklist = 'ellis_blacklist{0}'
 
-        try:
-            address = ipaddress.ip_address(ip)
-        except ipaddress.AddressValueError:
-            raise
+        if isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            address = ip
         else:
-            if address.version is 6:
-                # We don't ban private IPv6:
-                if address.is_private:
-                    msg = "We don't ban private addresses ({0} given)." \
-                          .format(address)
-                    raise ipaddress.AddressValueError(msg)
-                else:
-                    # Do we have an embedded IPv4 ?
-                    if address.ipv4_mapped is not None:
-                        address = address.ipv4_mapped
-                    elif address.sixtofour is not None:
-                        address = address.sixtofour
+            address = ipaddress.ip_address(ip)
+
+        if address.version == 6:
+            # We don't ban private IPv6:
+            if address.is_private:
+                msg = "We don't ban private addresses ({0} given)." \
+                      .format(address)
+                raise ipaddress.AddressValueError(msg)
+            else:
+                # Do we have an embedded IPv4 ?
+                if address.ipv4_mapped is not None:
+                    address = address.ipv4_mapped
+                elif address.sixtofour is not None:
+                    address = address.sixtofour
 
         blacklist = blacklist.format(address.version)
 
@@ -86,17 +99,145 @@ class NFTables(ShellCommander):
         """
         msg = err.decode()
 
-        print("FIXME (raise a custom  Exception) - {}".format(msg))
-        """
-        if "Kernel error received: Operation not permitted" in msg:
-            raise IpsetNoRights(msg)
-        elif "The set with the given name does not exist" in msg:
-            raise IpsetSetNotFound(msg)
-        elif "Element cannot be added to the set: it's already added" in msg:
-            raise IpsetAlreadyInSet(msg)
+        if "Operation not permitted" in msg:
+            raise NFTablesNoRights(msg)
+        elif "No such file or directory" in msg:
+            raise NFTablesSetNotFound(msg)
         else:
-            raise IpsetError(msg)
+            raise NFTablesError(msg)
+
+
+class NFTablesBatch(Batch):
+    """
+    Coalesces the addresses to add to the sets of the given table, and adds
+    each batch of them with a single ``nft -f -`` process (fed through its
+    stdin), as a single ``add element`` statement per set, instead of
+    launching one ``nft add element`` process per address (see
+    :class:`shell_commander.Batch`).
+
+    ``nft -f -`` is atomic: if an element can't be added, nothing is. The
+    errors nft reports are located (line and columns) in the input, so the
+    faulty elements get their error and the other ones are retried with a
+    new process. Each caller thus gets its own result.
+    """
+    ERROR = re.compile(r'^\S*:(\d+):(\d+)-(\d+): Error: (.*)$', re.MULTILINE)
+
+    def __init__(self, table_family, table_name, interval=0.05,
+                 batch_size=1024):
+        """
+        """
+        super().__init__(interval, batch_size)
+
+        self.nft = NFTables(table_family, table_name)
+
+    async def add(self, setname, ip, timeout=0):
+        """
+        Queues the given IP address to be added to the given set (see
+        :func:`NFTables.add`), and waits for the batch to be processed.
+
+        Returns True once the address has been added.
+        """
+        return await super().add(setname, ip, int(timeout))
+
+    def statements(self, batch):
+        """
+        Returns the input of ``nft -f -`` for the given batch of
+        (setname, ip, timeout, future) tuples, and the position of each
+        element in this input, as a list of (line, first column, last
+        column) tuples (numbered from 1, like nft does).
+
+        The resulting input looks like this:
+
+        ``add element inet firewall ellis_blacklist4 { 192.0.2.10 timeout 30s, 192.0.2.11 timeout 30s }``
+
+        """
+        sets = {}
+
+        for i, (setname, ip, timeout, future) in enumerate(batch):
+            sets.setdefault(setname, []).append(i)
+
+        lines = []
+        positions = [None] * len(batch)
+
+        for lineno, (setname, indexes) in enumerate(sets.items(), 1):
+            line = "add element {0} {1} {2} {{ ".format(
+                self.nft.table_family, self.nft.table_name, setname)
+
+            for i in indexes:
+                setname, ip, timeout, future = batch[i]
+
+                if i != indexes[0]:
+                    line += ", "
+
+                element = f"{ip} timeout {timeout}s" if timeout > 0 \
+                    else f"{ip}"
+                positions[i] = (lineno, len(line) + 1,
+                                len(line) + len(element))
+                line += element
+
+            lines.append(line + " }\n")
+
+        return ("".join(lines), positions)
+
+    async def process(self, batch):
         """
+        Adds the given batch of (setname, ip, timeout, future) tuples with
+        ``nft -f -``, and sets the result of each future.
+        """
+        while batch:
+            statements, positions = self.statements(batch)
+
+            returncode, stdout_data, stderr_data = \
+                await self.nft.run(NFTables.CMD, ['-f', '-'],
+                                   statements.encode('utf-8'))
+
+            if returncode == 0:
+                self.resolve(batch, True)
+                return
+
+            errors = __class__.ERROR.findall(
+                stderr_data.decode(errors='replace'))
+            failed = {}
+
+            for lineno, first, last, msg in errors:
+                lineno, first, last = int(lineno), int(first), int(last)
+
+                # Elements the error points at, or every element of the
+                # statement if it points at something else (the set name):
+                located = [i for i, position in enumerate(positions)
+                           if position[0] == lineno
+                           and position[1] <= last and first <= position[2]]
+
+                if not located:
+                    located = [i for i, position in enumerate(positions)
+                               if position[0] == lineno]
+
+                for i in located:
+                    failed.setdefault(i, msg)
+
+            if not failed:
+                # Not related to given elements, the whole batch failed:
+                self.resolve(batch, exception=self.error(stderr_data))
+                return
+
+            for i, msg in failed.items():
+                self.resolve(batch[i:i + 1],
+                             exception=self.error(msg.encode('utf-8')))
+
+            # Nothing was added, retry the other elements:
+            batch = [entry for i, entry in enumerate(batch)
+                     if i not in failed]
+
+    def error(self, err):
+        """
+        Returns the exception :func:`NFTables.handle_error` raises for the
+        given error message.
+        """
+        return self.nft.error(err)
+
+
+# Shared by the `ban_batch` calls, one per table (see `ban_batch`):
+_batches = {}
 
 
 async def ban(ip, family='ip', table='filter', timeout=0):
@@ -107,3 +248,24 @@ async def ban(ip, family='ip', table='filter', timeout=0):
     print("Adding {0} to {1} {2} @{3}".format(address, family, table, set_name))
 
     return await nft.add(set_name, address, timeout)
+
+
+async def ban_batch(ip, family='ip', table='filter', timeout=0,
+                    interval=0.05, batch_size=1024, **kwargs):
+    """
+    Same as :func:`ban`, but the addresses banned within *interval* seconds
+    are added together, by batches of at most *batch_size* addresses (see
+    :class:`NFTablesBatch`).
+
+    The batch settings of the first call for a given table apply to the
+    following ones.
+    """
+    try:
+        batch = _batches[(family, table)]
+    except KeyError:
+        batch = NFTablesBatch(family, table, interval, batch_size)
+        _batches[(family, table)] = batch
+
+    address, set_name = batch.nft.chose_blacklist(ip)
+
+    return await batch.add(set_name, address, timeout)
@@ -2,14 +2,209 @@
 # coding: utf-8
 
 import asyncio
+import collections
+import re
 import shlex
 
-from asyncio.subprocess import PIPE
+from asyncio.subprocess import PIPE, STDOUT
+
+
+class CoprocessError(Exception):
+    pass
+
+
+class Coprocess(object):
+    """
+    A Coprocess is a long-lived process (such as ``ipset -``) commands are
+    streamed to through its stdin, so that running a command doesn't cost
+    a new process.
+
+    The output of each caller is framed by sending the *sentinel* command
+    after the caller's commands: the sentinel prints a line matching the
+    *marker* regex, which ends the caller's output. stderr is merged into
+    stdout, so that errors are framed along with the rest of the output.
+    Callers are served in order, and their commands are pipelined.
+
+    *prompt* is stripped from the beginning of the output lines, for the
+    commands that print a prompt in interactive mode.
+
+    The process is started on first use. If it dies, the callers waiting
+    for their output get a :class:`CoprocessError`, and the next call
+    starts a new process. If a call isn't answered within *timeout*
+    seconds (e.g. because the process doesn't flush its output, or the
+    marker never matches), the process is considered as hung: it's killed,
+    with the same outcome.
+
+    .. note::
+        The command has to flush its output after each command it reads,
+        as interactive modes usually do.
+    """
+    def __init__(self, cmd, args=(), sentinel=b'', marker=b'', prompt=None,
+                 timeout=10):
+        """
+        """
+        self.cmd = cmd
+        self.args = [str(arg) for arg in args]
+        self.sentinel = sentinel
+        self.marker = re.compile(marker)
+        self.prompt = prompt
+        self.timeout = timeout
+
+        self.proc = None
+        self.restarts = -1
+        self._waiting = None
+        self._lock = asyncio.Lock()
+
+    def __repr__(self):
+        """
+        """
+        return '<Coprocess - cmd: {0}, pid: {1}, restarts: {2}>' \
+               .format(self.cmd, self.proc.pid if self.proc else None,
+                       max(self.restarts, 0))
+
+    async def call(self, input_bytes):
+        """
+        Sends the given commands to the process and waits for their output.
+
+        Returns the output (stdout and stderr) of the commands.
+
+        Raises :class:`CoprocessError` if the process dies, or is killed
+        because it hung, before the commands are answered.
+        """
+        proc, waiting = await self.spawn()
+        future = asyncio.get_event_loop().create_future()
+
+        # Queuing the future and writing the commands happen without any
+        # await in between, so that outputs come back in the same order:
+        waiting.append(future)
+        proc.stdin.write(input_bytes + self.sentinel)
+
+        async def answer():
+            try:
+                await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # The reader fails the future when it reaches EOF:
+                pass
+
+            return await future
+
+        try:
+            return await asyncio.wait_for(answer(), self.timeout)
+        except asyncio.TimeoutError:
+            # The reader fails the other waiting callers once it's dead:
+            self.kill(proc)
+
+            raise CoprocessError("{0} didn't answer within {1}s, it has "
+                                 "been killed"
+                                 .format(self.cmd, self.timeout)) from None
+
+    async def spawn(self):
+        """
+        Starts the process if it isn't running.
+
+        Returns a (process, waiting callers) tuple.
+        """
+        async with self._lock:
+            if self.proc is None:
+                proc = await asyncio.create_subprocess_exec(
+                    self.cmd, *self.args,
+                    stdin=PIPE, stdout=PIPE, stderr=STDOUT)
+
+                self.proc = proc
+                self._waiting = collections.deque()
+                self.restarts += 1
+
+                asyncio.ensure_future(self.read(proc, self._waiting))
+
+            return (self.proc, self._waiting)
+
+    async def read(self, proc, waiting):
+        """
+        Reads the output of the given process, and hands it to the waiting
+        callers (see :func:`call`) until the process dies.
+        """
+        prompt = self.prompt
+        output = []
+
+        try:
+            while True:
+                line = await proc.stdout.readline()
+
+                if not line:
+                    break
+
+                while prompt and line.startswith(prompt):
+                    line = line[len(prompt):]
+
+                if self.marker.search(line):
+                    if waiting:
+                        future = waiting.popleft()
+
+                        if not future.done():
+                            future.set_result(b''.join(output))
+
+                    output = []
+                elif line.strip():
+                    output.append(line)
+        finally:
+            if self.proc is proc:
+                self.proc = None
+
+            returncode = await proc.wait()
+
+            while waiting:
+                future = waiting.popleft()
+
+                if not future.done():
+                    future.set_exception(CoprocessError(
+                        "{0} exited with code {1}: {2}"
+                        .format(self.cmd, returncode,
+                                b''.join(output).decode(errors='replace'))))
+
+    def kill(self, proc):
+        """
+        Kills the given process, so that the next call starts a new one.
+        """
+        if self.proc is proc:
+            self.proc = None
+
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+    def close(self):
+        """
+        Closes the stdin of the process, which makes it exit once the
+        pending commands are done.
+        """
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.proc = None
 
 
 class ShellCommander(object):
     """
     """
+    SHELL = False
+    """Tells if the commands are run through a shell."""
+
+    COPROCESS = None
+    """
+    Arguments of the coprocess mode of the command, if it has one, along
+    with the :attr:`SENTINEL` command, the :attr:`MARKER` of its output and
+    the :attr:`PROMPT` of this mode (see :class:`Coprocess`).
+    """
+    SENTINEL = b''
+    MARKER = b''
+    PROMPT = None
+
+    TIMEOUT = 10
+    """Time (in seconds) the coprocess has to answer a call."""
+
+    # Coprocesses, shared by all the instances of a class:
+    _coprocesses = {}
+
     def __init__(self):
         """
         """
@@ -18,17 +213,8 @@ class ShellCommander(object):
     async def start(self, cmd, cmd_args=[], input_bytes=None):
         """
         """
-        # Make sure the provided arguments are safe:
-        args = __class__.escape_args(*cmd_args)
-
-        # Build full command:
-        command = f"{cmd} {args}"
-
-        # And then launch the command:
-        proc = await asyncio.create_subprocess_shell(command, stdin=PIPE,
-                                                     stdout=PIPE, stderr=PIPE)
-
-        stdout_data, stderr_data = await proc.communicate(input_bytes)
+        returncode, stdout_data, stderr_data = \
+            await self.run(cmd, cmd_args, input_bytes)
 
         if stdout_data:
             print(stdout_data)
@@ -40,7 +226,78 @@ class ShellCommander(object):
         # When an error occurs, the cmd is supposed to print a message
         # on stderr. This message is caught and passed to
         # the `handle_error` method.
-        return True if proc.returncode is 0 else False
+        return True if returncode == 0 else False
+
+    async def run(self, cmd, cmd_args=[], input_bytes=None):
+        """
+        Runs the given command with the given arguments, feeding it with
+        *input_bytes*, and waits for it to exit.
+
+        Unlike :func:`start`, errors are not handled.
+
+        The command is executed directly, unless :attr:`SHELL` is set.
+
+        Returns a (returncode, stdout data, stderr data) tuple.
+        """
+        if self.SHELL:
+            # Make sure the provided arguments are safe:
+            args = __class__.escape_args(*cmd_args)
+
+            # Build full command:
+            command = f"{cmd} {args}"
+
+            # And then launch the command:
+            proc = await asyncio.create_subprocess_shell(
+                command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        else:
+            args = [str(arg) for arg in cmd_args]
+
+            proc = await asyncio.create_subprocess_exec(
+                cmd, *args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+        stdout_data, stderr_data = await proc.communicate(input_bytes)
+
+        return (proc.returncode, stdout_data, stderr_data)
+
+    def coprocess(self):
+        """
+        Returns the :class:`Coprocess` of the command (see
+        :attr:`COPROCESS`), shared by all the instances of the class.
+
+        Raises :class:`exceptions.NotImplementedError` if the command has no
+        coprocess mode.
+        """
+        cls = type(self)
+
+        if cls.COPROCESS is None:
+            msg = f"{cls.CMD} has no coprocess mode."
+            raise NotImplementedError(msg)
+
+        try:
+            return ShellCommander._coprocesses[cls]
+        except KeyError:
+            coprocess = Coprocess(cls.CMD, cls.COPROCESS, cls.SENTINEL,
+                                  cls.MARKER, cls.PROMPT, cls.TIMEOUT)
+            ShellCommander._coprocesses[cls] = coprocess
+
+            return coprocess
+
+    async def call_coprocess(self, input_bytes):
+        """
+        Streams the given commands to the coprocess of the command (see
+        :func:`coprocess`), instead of launching a new process.
+
+        Any output is considered as an error and passed to the
+        `handle_error` method.
+
+        Returns True if the commands succeeded.
+        """
+        output = await self.coprocess().call(input_bytes)
+
+        if output:
+            self.handle_error(output)
+
+        return True if not output else False
 
     def handle_error(self, err):
         """
@@ -49,6 +306,18 @@ class ShellCommander(object):
                " implementation in your subclass.")
         raise NotImplementedError(msg)
 
+    def error(self, err):
+        """
+        Returns the exception :func:`handle_error` raises for the given
+        error message, or None if it doesn't raise any.
+        """
+        try:
+            self.handle_error(err)
+        except Exception as e:
+            return e
+
+        return None
+
     @classmethod
     def escape_args(cls, *args):
         """
@@ -62,3 +331,91 @@ class ShellCommander(object):
         escaped_args = [shlex.quote(str(arg)) for arg in args]
 
         return " ".join(escaped_args)
+
+
+class Batch(object):
+    """
+    A Batch coalesces the items queued with :func:`add` and hands them to
+    :func:`process` all at once, so that a whole batch of them is handled
+    by a single command instead of one command per item.
+
+    A batch is flushed *interval* seconds after its first item was queued,
+    or as soon as it holds *batch_size* items.
+
+    Subclasses implement :func:`process`, which has to set the result of
+    the future of each item (see :func:`resolve`).
+    """
+    def __init__(self, interval=0.05, batch_size=1024):
+        """
+        """
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending = []
+        self._handle = None
+
+    async def add(self, *item):
+        """
+        Queues the given item and waits for its batch to be processed.
+
+        Returns the result :func:`process` set for this item.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        self.pending.append(item + (future,))
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self._handle is None:
+            self._handle = loop.call_later(self.interval, self.flush)
+
+        return await future
+
+    def flush(self):
+        """
+        Starts processing the queued items, by batches of *batch_size*.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            self.pending = self.pending[self.batch_size:]
+
+            asyncio.ensure_future(self._process(batch))
+
+    async def _process(self, batch):
+        """
+        Processes the given batch, making sure no caller waits forever.
+        """
+        try:
+            await self.process(batch)
+        except Exception as e:
+            self.resolve(batch, exception=e)
+
+    async def process(self, batch):
+        """
+        Processes the given batch: a list of the queued items, each of them
+        followed by its future.
+        """
+        msg = ("You have to overwrite this method and provide your own"
+               " implementation in your subclass.")
+        raise NotImplementedError(msg)
+
+    @staticmethod
+    def resolve(batch, result=None, exception=None):
+        """
+        Sets the result (or the exception) of the futures of the given
+        batch.
+        """
+        for item in batch:
+            future = item[-1]
+
+            if future.done():
+                continue
+
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
@@ -22,7 +22,10 @@ setup(name='ellis',
       author_email='francois+ellis@kubler.org',
 
       entry_points={
-          "console_scripts": ['ellis = ellis.main:main']
+          "console_scripts": [
+              'ellis = ellis.main:main',
+              'ellis-aggregator = ellis.cluster:main',
+          ]
       },
 
       # data_files=[
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import concurrent.futures
+import time
+import unittest
+from unittest import mock
+
+from ellis import backfill
+from ellis.matches import Matches
+from ellis.rule import Rule
+
+
+def scan_slice(since, until, batch_size):
+    """
+    Fake :func:`backfill._scan_slice`: one hit per second of the slice.
+    The first slices are the slowest ones, so that they complete last.
+    """
+    time.sleep(0.05 if since < 1000000000 * 1000000 + 5000000 else 0)
+
+    if since == 1000000000 * 1000000 + 5000000:
+        raise OSError("unreadable journal file")
+
+    hits = [(timestamp, 0, {'ip': '1.2.3.4'})
+            for timestamp in range(since, until, 1000000)]
+
+    return (len(hits), hits)
+
+
+class RecordingMatches(Matches):
+    """
+    Matches recording the timestamps of the hits.
+    """
+    def __init__(self):
+        super().__init__()
+        self.timestamps = []
+
+    def hit(self, rule, kwargs=None, timestamp=None):
+        self.timestamps.append(timestamp)
+
+        return super().hit(rule, kwargs, timestamp)
+
+
+@mock.patch.object(backfill, 'journal', object())
+class BackfillTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.rule = Rule('r', r'from (?P<ip>\S+)', 3, 'dummy.wait()',
+                         findtime=10)
+
+    def test_split(self):
+        slices = backfill.Backfill([self.rule], 10, 20, slices=3).split()
+
+        self.assertEqual(slices[0][0], 10000000)
+        self.assertEqual(slices[-1][1], 20000000)
+
+        # Slices are contiguous and don't overlap:
+        for (since, until), (next_since, next_until) \
+                in zip(slices, slices[1:]):
+            self.assertEqual(until, next_since)
+            self.assertLess(since, until)
+
+    def test_split_tiny_range(self):
+        slices = backfill.Backfill([self.rule], 10, 10.000002,
+                                   slices=8).split()
+
+        self.assertEqual(slices, [(10000000, 10000001),
+                                  (10000001, 10000002)])
+
+    def test_invalid_arguments(self):
+        for kwargs in ({'slices': 0}, {'workers': -1}, {'until': 5}):
+            with self.assertRaises(ValueError):
+                backfill.Backfill([self.rule], 10, **kwargs)
+
+    @mock.patch.object(backfill, '_scan_slice', scan_slice)
+    @mock.patch('concurrent.futures.ProcessPoolExecutor',
+                concurrent.futures.ThreadPoolExecutor)
+    def test_ordered_merge(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        matches = RecordingMatches()
+        job = backfill.Backfill([self.rule], 1000000000, 1000000010,
+                                workers=4, slices=10)
+
+        with self.assertWarnsRegex(UserWarning, 'unreadable'):
+            loop.run_until_complete(job.run(matches))
+
+        # The failing slice is skipped, the other ones are merged in order:
+        self.assertEqual(job.failed_slices, 1)
+        self.assertEqual(job.scanned, 9)
+        self.assertEqual(matches.timestamps, sorted(matches.timestamps))
+        self.assertEqual(len(matches.timestamps), 9)
+        self.assertIn('partial', job.report())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import concurrent.futures
+import pickle
+import sys
+import unittest
+
+from ellis.cache import MatchCache
+
+
+def scan(message):
+    """
+    Fake scan: messages holding `hit` match, the other ones are rejected by
+    the prefilter.
+    """
+    if 'hit' in message:
+        return ([(0, 0, {'message': message})], False)
+
+    return ([], True)
+
+
+class MatchCacheTest(unittest.TestCase):
+    """
+    """
+    def test_exact_cache(self):
+        cache = MatchCache(size=2)
+
+        for message in ('hit 1', 'hit 1', 'hit 2', 'hit 3', 'hit 1'):
+            cache.fetch('ruleset', message, scan)
+
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+        self.assertEqual(list(cache.entries),
+                         [('ruleset', 'hit 3'), ('ruleset', 'hit 1')])
+
+    def test_negative_cache(self):
+        cache = MatchCache(size=0, templates_size=10)
+
+        self.assertEqual(cache.fetch('ruleset', 'port 22', scan), ())
+        self.assertEqual(cache.fetch('ruleset', 'port 23', scan), ())
+        self.assertEqual(cache.fetch('ruleset', 'hit 22', scan),
+                         ((0, 0, {'message': 'hit 22'}),))
+
+        self.assertEqual((cache.template_hits, cache.misses), (1, 2))
+
+    def test_shared_by_threads(self):
+        cache = MatchCache(size=8, templates_size=8)
+        messages = ['hit {0}'.format(i % 50) for i in range(20000)]
+
+        # Switch threads as often as possible:
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(
+                lambda message: cache.fetch('ruleset', message, scan),
+                messages))
+
+        self.assertEqual(results, [tuple(scan(message)[0])
+                                   for message in messages])
+        self.assertLessEqual(len(cache), 8)
+
+    def test_pickle(self):
+        cache = MatchCache(size=8)
+        cache.fetch('ruleset', 'hit', scan)
+
+        copy = pickle.loads(pickle.dumps(cache))
+
+        self.assertEqual(copy.fetch('ruleset', 'hit', scan),
+                         cache.fetch('ruleset', 'hit', scan))
+        self.assertIsNot(copy.lock, cache.lock)
+
+
+if __name__ == '__main__':
+    unittest.main()
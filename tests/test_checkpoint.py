@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import datetime
+import os
+import tempfile
+import unittest
+
+from ellis.checkpoint import Checkpoint
+
+
+class CheckpointTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.path = os.path.join(directory.name, 'state', 'cursor')
+
+    def test_round_trip(self):
+        checkpoint = Checkpoint(self.path, loop=self.loop)
+        checkpoint.update({'__CURSOR': 's=1;i=2',
+                           '__REALTIME_TIMESTAMP': 1500000000123456})
+        checkpoint.stop()
+
+        self.assertFalse(checkpoint.dirty)
+        self.assertEqual(Checkpoint(self.path, loop=self.loop).load(),
+                         ('s=1;i=2', 1500000000.123456))
+
+    def test_datetime_timestamp(self):
+        checkpoint = Checkpoint(self.path, loop=self.loop)
+        timestamp = datetime.datetime(2020, 1, 1,
+                                      tzinfo=datetime.timezone.utc)
+        checkpoint.update({'__CURSOR': 'c', '__REALTIME_TIMESTAMP': timestamp})
+        checkpoint.save()
+
+        self.assertEqual(checkpoint.load(), ('c', timestamp.timestamp()))
+
+    def test_entry_without_cursor(self):
+        checkpoint = Checkpoint(self.path, loop=self.loop)
+        checkpoint.update({'MESSAGE': 'no cursor'})
+
+        self.assertFalse(checkpoint.dirty)
+        self.assertIsNone(checkpoint.cursor)
+
+    def test_missing_and_invalid_files(self):
+        checkpoint = Checkpoint(self.path, loop=self.loop)
+
+        self.assertEqual(checkpoint.load(), (None, None))
+
+        os.makedirs(os.path.dirname(self.path))
+
+        with open(self.path, 'w') as f:
+            f.write('cursor\nnot a timestamp\n')
+
+        with self.assertWarns(UserWarning):
+            self.assertEqual(checkpoint.load(), (None, None))
+
+    def test_failed_save_stays_dirty(self):
+        checkpoint = Checkpoint(os.path.join(os.devnull, 'cursor'),
+                                loop=self.loop)
+        checkpoint.update({'__CURSOR': 'c'})
+
+        with self.assertRaises(OSError):
+            checkpoint.save()
+
+        self.assertTrue(checkpoint.dirty)
+
+        with self.assertWarns(UserWarning):
+            checkpoint.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
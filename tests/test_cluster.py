@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import types
+import unittest
+
+from ellis.cluster import Aggregator, ClusterClient, open_connection, sign
+
+
+OLD = {'r': {'limit': 5, 'findtime': 60}}
+NEW = {'r': {'limit': 3, 'findtime': 60}}
+
+
+class AggregatorTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.aggregator = Aggregator('/nonexistent', loop=self.loop)
+
+    def connect(self, path, answer):
+        """
+        Connects to the Aggregator listening on *path*, answers its
+        challenge with *answer(challenge)* and sends a count.
+
+        Returns the first line received after that.
+        """
+        async def session():
+            reader, writer = await open_connection(path)
+
+            try:
+                challenge = json.loads(await reader.readline())['challenge']
+                hello = {'node': 'n', 'rules': NEW, 'auth': answer(challenge)}
+                deltas = {'deltas': {'r': [['k', 3]]}}
+
+                for message in (hello, deltas):
+                    writer.write((json.dumps(message) + '\n').encode())
+
+                return await asyncio.wait_for(reader.readline(), 5)
+            finally:
+                writer.close()
+
+        return self.loop.run_until_complete(session())
+
+    def listen(self, secret):
+        """
+        Starts an Aggregator with the given *secret*, on a Unix socket.
+
+        Returns the path of the socket.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        path = os.path.join(directory.name, 'ellis.sock')
+        aggregator = Aggregator(path, secret=secret, loop=self.loop)
+
+        self.loop.run_until_complete(aggregator.start())
+
+        # Let the connections end before the loop is closed:
+        self.addCleanup(self.loop.run_until_complete, asyncio.sleep(0.1))
+        self.addCleanup(aggregator.stop)
+
+        return path
+
+    def test_other_settings_ignored_while_declared(self):
+        self.aggregator.declare('a', 'a', OLD)
+        self.aggregator.declare('b', 'b', NEW)
+
+        self.aggregator.add('a', {'r': [['k', 2]]})
+
+        with self.assertWarns(UserWarning):
+            self.aggregator.add('b', {'r': [['k', 2]]})
+
+        self.assertEqual(self.aggregator.rules['r'].limit, 5)
+        self.assertEqual(self.aggregator.matches['r']['k'], 2)
+
+    def test_rule_replaced_once_undeclared(self):
+        self.aggregator.declare('a', 'a', OLD)
+        self.aggregator.declare('b', 'b', NEW)
+        self.aggregator.add('a', {'r': [['k', 2]]})
+
+        del self.aggregator.nodes['a']
+
+        with self.assertWarns(UserWarning):
+            fire = self.aggregator.add('b', {'r': [['k', 3]]})
+
+        self.assertEqual(self.aggregator.rules['r'].limit, 3)
+        self.assertEqual(fire, {'r': ['k']})
+
+    def test_invalid_counts(self):
+        self.aggregator.declare('a', 'a', OLD)
+
+        for count in ('1', 1.5, True, 0, -3):
+            with self.assertRaises(ValueError):
+                self.aggregator.add('a', {'r': [['k', count]]})
+
+        self.assertEqual(self.aggregator.matches['r']['k'], 0)
+
+    def test_stale_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ellis.sock')
+
+            with socket.socket(socket.AF_UNIX) as sock:
+                sock.bind(path)
+
+            aggregator = Aggregator(path, loop=self.loop)
+            self.loop.run_until_complete(aggregator.start())
+            aggregator.stop()
+
+            self.assertFalse(os.path.exists(path))
+
+    def test_authenticated_node(self):
+        path = self.listen(b'secret')
+        line = self.connect(path, lambda c: sign(b'secret', c))
+
+        self.assertEqual(json.loads(line), {'fire': {'r': ['k']}})
+
+    def test_unauthenticated_node(self):
+        path = self.listen(b'secret')
+
+        for answer in (lambda c: None, lambda c: sign(b'guess', c)):
+            with self.assertWarnsRegex(UserWarning, 'authentication failed'):
+                line = self.connect(path, answer)
+
+            self.assertEqual(line, b'')
+
+
+class ClusterClientTest(unittest.TestCase):
+    """
+    """
+    def test_unencodable_batch(self):
+        rule = types.SimpleNamespace(name='r')
+        client = ClusterClient('/nonexistent', None, [rule], None,
+                               loop=asyncio.new_event_loop())
+        client.loop.close()
+        client.max_batch = 1
+
+        with self.assertWarns(UserWarning):
+            lines = list(client.batches({'r': {'k': 1, object(): 1}}))
+
+        self.assertEqual(lines, ['{"deltas": {"r": [["k", 1]]}}\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
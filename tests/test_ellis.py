@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+from ellis.ellis import Ellis
+
+
+CONFIG = """
+[ellis]
+matching = {0}
+cursor_file =
+state_file =
+
+[sshd]
+filter = Failed password for (?P<user>\\S+) from (?P<ip><IP>)
+    Invalid user (?P<user>\\S+) from (?P<ip><IP>)
+limit = 100
+action = dummy.wait(sec=0)
+systemd_unit = sshd
+"""
+
+ENTRIES = [
+    {'MESSAGE': 'Failed password for root from 1.2.3.4 port 22',
+     '_SYSTEMD_UNIT': 'sshd.service'},
+    {'MESSAGE': 'Invalid user admin from 1.2.3.4',
+     '_SYSTEMD_UNIT': 'sshd.service'},
+    {'MESSAGE': 'Failed password for root from 1.2.3.4 port 22',
+     '_SYSTEMD_UNIT': 'cron.service'},
+    {'MESSAGE': 'Failed password for root from 5.6.7.8 port 22',
+     '_SYSTEMD_UNIT': 'sshd.service'},
+    {'MESSAGE': 'Failed password for root from 1.2.3.999 port 22',
+     '_SYSTEMD_UNIT': 'sshd.service'},
+]
+
+
+class EllisTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+
+    def ellis(self, matching, extra=''):
+        """
+        Returns an Ellis instance using the given matching mode, and the
+        given *extra* config.
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.conf',
+                                         delete=False) as f:
+            f.write(CONFIG.format(matching) + extra)
+
+        self.addCleanup(os.unlink, f.name)
+
+        return Ellis(f.name, sources=[])
+
+    def test_settings_section_is_not_a_rule(self):
+        ellis = self.ellis('inline')
+
+        self.assertEqual([rule.name for rule in ellis.rules], ['sshd'])
+
+    def test_matching_modes(self):
+        counts = []
+
+        for matching in ('inline', 'executor'):
+            ellis = self.ellis(matching)
+            self.assertEqual(ellis.matching, matching)
+
+            self.loop.run_until_complete(ellis.process_entries(ENTRIES))
+            unpack = ellis.rules[0].filter.unpack
+            counts.append({(unpack(key)['user'], str(unpack(key)['ip'])): n
+                           for key, n in ellis.matches['sshd'].items()})
+
+        # The cron entry is out of the Rule's scope, 1.2.3.999 is invalid:
+        self.assertEqual(counts[0], {('root', '1.2.3.4'): 1,
+                                     ('admin', '1.2.3.4'): 1,
+                                     ('root', '5.6.7.8'): 1})
+        self.assertEqual(counts[0], counts[1])
+
+    def test_scopes(self):
+        ellis = self.ellis('inline', """
+[cron]
+filter = (?P<user>\\S+) failed
+limit = 5
+action = dummy.wait(sec=0)
+syslog_identifier = CRON
+priority = warning
+""")
+
+        self.assertEqual(ellis.scopes, [
+            {'_SYSTEMD_UNIT': ('sshd.service',)},
+            {'SYSLOG_IDENTIFIER': ('CRON',),
+             'PRIORITY': ('0', '1', '2', '3', '4')},
+        ])
+
+    def test_unscoped_rule_disables_journald_filtering(self):
+        with self.assertWarnsRegex(UserWarning, 'any scope option'):
+            ellis = self.ellis('inline', """
+[any]
+filter = (?P<user>\\S+) failed
+limit = 5
+action = dummy.wait(sec=0)
+""")
+
+        self.assertEqual(ellis.scopes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
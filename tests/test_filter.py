@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import ipaddress
+import unittest
+
+from ellis.filter import Filter
+from ellis.snapshot import encode_key
+
+
+def search(filter, message):
+    """
+    Returns the converted captures of the first pattern of *filter* that
+    matches *message*, or None.
+    """
+    for index, regex in enumerate(filter):
+        match = regex.search(message)
+
+        if match is not None:
+            return filter.convert(index, match.groupdict())
+
+    return None
+
+
+class ConvertTest(unittest.TestCase):
+    """
+    """
+    def test_typed_groups(self):
+        filter = Filter.from_string(
+            'from (?P<ip><IP>) port (?P<port><PORT>) user (?P<user>\\S+)', 1)
+
+        self.assertEqual(filter.types, [{'ip': '<IP>', 'port': '<PORT>'}])
+        self.assertEqual(search(filter, 'from ::1 port 22 user bob'),
+                         {'ip': ipaddress.ip_address('::1'), 'port': 22,
+                          'user': 'bob'})
+
+    def test_invalid_captures_are_rejected(self):
+        filter = Filter.from_string('from (?P<ip><IPv4>)', 1)
+
+        self.assertIsNone(filter.convert(0, {'ip': '1.2.3.999'}))
+        self.assertEqual(filter.convert(0, {'ip': '1.2.3.4'}),
+                         {'ip': ipaddress.IPv4Address('1.2.3.4')})
+
+    def test_missing_groups_are_skipped(self):
+        filter = Filter.from_string('from (?P<ip><IP>)?x', 1)
+
+        self.assertEqual(filter.convert(0, {'ip': None}), {'ip': None})
+
+    def test_tag_inside_a_group_is_untyped(self):
+        filter = Filter.from_string('(?P<ip>at <IP>)', 1)
+
+        self.assertEqual(filter.types, [{}])
+        self.assertEqual(search(filter, 'at 1.2.3.4'), {'ip': 'at 1.2.3.4'})
+
+    def test_port_tag(self):
+        filter = Filter.from_string('port (?P<port><PORT>)', 1)
+
+        self.assertEqual(search(filter, 'port 22'), {'port': 22})
+        self.assertEqual(search(filter, 'port 65534'), {'port': 65534})
+        self.assertIsNone(search(filter, 'port 65535'))
+
+
+class PackTest(unittest.TestCase):
+    """
+    """
+    def test_typed_keys(self):
+        filter = Filter.from_string(
+            'from (?P<ip><IP>) port (?P<port><PORT>)', 1)
+
+        key = filter.pack(search(filter, 'from 1.2.3.4 port 22'))
+
+        self.assertEqual(filter.layout, (('ip', '<IP>'), ('port', '<PORT>')))
+        self.assertEqual(key, (int(ipaddress.ip_address('1.2.3.4')), 22))
+        self.assertEqual(filter.unpack(key),
+                         {'ip': ipaddress.ip_address('1.2.3.4'), 'port': 22})
+
+    def test_ipv4_and_ipv6_keys_do_not_collide(self):
+        filter = Filter.from_string('from (?P<ip><IP>)', 1)
+
+        ipv4 = filter.pack(search(filter, 'from 0.0.0.1'))
+        ipv6 = filter.pack(search(filter, 'from ::1'))
+
+        self.assertNotEqual(ipv4, ipv6)
+        self.assertEqual(filter.unpack(ipv6),
+                         {'ip': ipaddress.ip_address('::1')})
+
+    def test_partly_typed_group(self):
+        filter = Filter.from_string(
+            'from (?P<ip><IPv4>) port\nbad (?P<ip>\\S+) x', 1)
+
+        typed = filter.pack(search(filter, 'from 1.2.3.4 port'))
+        untyped = filter.pack(search(filter, 'bad 1.2.3.4 x'))
+
+        self.assertEqual(filter.layout, (('ip', None),))
+        self.assertEqual(typed, '1.2.3.4')
+        self.assertEqual(typed, untyped)
+        self.assertEqual(encode_key(typed), '"1.2.3.4"')
+
+    def test_no_group(self):
+        filter = Filter.from_string('Connection closed', 1)
+
+        self.assertIsNone(filter.pack(search(filter, 'Connection closed')))
+        self.assertEqual(filter.unpack(None), {})
+
+
+class LiteralTest(unittest.TestCase):
+    """
+    """
+    def literal(self, pattern):
+        return Filter.extract_literal(Filter.build_regex_list(pattern, 1)[0])
+
+    def test_longest_required_run(self):
+        self.assertEqual(self.literal(r'^Failed password for (?P<user>\S+)'),
+                         'Failed password for ')
+        self.assertEqual(self.literal(r'(?:ab)+ from (?P<ip>\S+) port'),
+                         ' from ')
+
+    def test_optional_parts_are_skipped(self):
+        self.assertEqual(self.literal(r'(?:Invalid|Illegal) user (?P<u>.+)'),
+                         ' user ')
+        self.assertEqual(self.literal(r'x(?:optional literal)? (?P<u>\w+)'),
+                         None)
+        self.assertEqual(self.literal(r'(?:abcdef)* (?P<u>\w+)'), None)
+
+    def test_repeated_literals_are_required(self):
+        self.assertEqual(self.literal(r'(?:abcdef){2,} (?P<u>\w+)'),
+                         'abcdef')
+
+    def test_short_literals_are_ignored(self):
+        self.assertIsNone(self.literal(r'ab(?P<u>\w+)'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import unittest
+from unittest import mock
+
+from ellis_actions.ipset import IpsetAlreadyInSet, IpsetBatch, IpsetError
+
+
+class IpsetBatchTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.batch = IpsetBatch()
+
+    def process(self, ips, *results):
+        """
+        Processes a batch adding *ips*, ``ipset restore`` returning the
+        given (returncode, stdout, stderr) *results*, one per process.
+
+        Returns the futures of the batch and the mocked :func:`run`.
+        """
+        run = mock.AsyncMock(side_effect=results)
+        batch = [('ellis_blacklist4', ip, 60, self.loop.create_future())
+                 for ip in ips]
+
+        with mock.patch.object(self.batch.ipset, 'run', run):
+            self.loop.run_until_complete(self.batch.process(batch))
+
+        return [item[-1] for item in batch], run
+
+    def test_single_process(self):
+        futures, run = self.process(['192.0.2.1', '192.0.2.2'], (0, b'', b''))
+
+        self.assertEqual([f.result() for f in futures], [True, True])
+        run.assert_called_once_with(
+            'ipset', ['restore', '-exist'],
+            b'add ellis_blacklist4 192.0.2.1 timeout 60\n'
+            b'add ellis_blacklist4 192.0.2.2 timeout 60\n')
+
+    def test_failing_line_is_split(self):
+        ips = ['192.0.2.1', '192.0.2.2', '192.0.2.3', '192.0.2.4']
+        error = (b"ipset v7.1: Error in line 2: Element cannot be added to"
+                 b" the set: it's already added\n")
+
+        futures, run = self.process(ips, (1, b'', error), (0, b'', b''))
+
+        self.assertIs(futures[0].result(), True)
+        self.assertIsInstance(futures[1].exception(), IpsetAlreadyInSet)
+        self.assertEqual([f.result() for f in futures[2:]], [True, True])
+
+        # The lines after the failing one are retried:
+        self.assertEqual(run.call_count, 2)
+        self.assertEqual(run.call_args[0][2],
+                         b'add ellis_blacklist4 192.0.2.3 timeout 60\n'
+                         b'add ellis_blacklist4 192.0.2.4 timeout 60\n')
+
+    def test_last_line_fails(self):
+        error = b"ipset v7.1: Error in line 2: Syntax error\n"
+
+        futures, run = self.process(['192.0.2.1', 'x'], (1, b'', error))
+
+        self.assertIs(futures[0].result(), True)
+        self.assertIsInstance(futures[1].exception(), IpsetError)
+        self.assertEqual(run.call_count, 1)
+
+    def test_whole_batch_fails(self):
+        for error in (b"ipset v7.1: Kernel error received: boom\n",
+                      b"ipset v7.1: Error in line 9: out of range\n"):
+            futures, run = self.process(['192.0.2.1', '192.0.2.2'],
+                                        (1, b'', error))
+
+            for future in futures:
+                self.assertIsInstance(future.exception(), IpsetError)
+
+
+if __name__ == '__main__':
+    unittest.main()
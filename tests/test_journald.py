@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import unittest
+
+from ellis.journald import add_matches
+
+
+class FakeReader(object):
+    """
+    Records the matches added to a journald reader.
+    """
+    def __init__(self):
+        self.terms = [[]]
+
+    def add_match(self, match):
+        self.terms[-1].append(match)
+
+    def add_disjunction(self):
+        self.terms.append([])
+
+
+class AddMatchesTest(unittest.TestCase):
+    """
+    """
+    def test_priority_cap_applies_to_every_scope(self):
+        reader = FakeReader()
+        add_matches(reader, [{'_SYSTEMD_UNIT': ('a.service',)},
+                             {'_SYSTEMD_UNIT': ('b.service',)}], 6)
+
+        for term in reader.terms[:-1]:
+            self.assertIn('PRIORITY=6', term)
+            self.assertNotIn('PRIORITY=7', term)
+
+    def test_priority_cap_restricts_scope_priorities(self):
+        reader = FakeReader()
+        add_matches(reader, [{'_SYSTEMD_UNIT': ('a.service',)},
+                             {'_SYSTEMD_UNIT': ('b.service',),
+                              'PRIORITY': ('0', '1', '2', '3')}], 6)
+
+        self.assertEqual(reader.terms[1],
+                         ['_SYSTEMD_UNIT=b.service', 'PRIORITY=0',
+                          'PRIORITY=1', 'PRIORITY=2', 'PRIORITY=3'])
+
+    def test_priority_cap_without_scope(self):
+        reader = FakeReader()
+        add_matches(reader, [], 6)
+
+        self.assertEqual(reader.terms[0],
+                         ['PRIORITY={0}'.format(i) for i in range(7)])
+
+    def test_no_scope_no_cap(self):
+        reader = FakeReader()
+        add_matches(reader, [])
+
+        self.assertEqual(reader.terms, [[]])
+
+
+if __name__ == '__main__':
+    unittest.main()
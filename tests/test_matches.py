@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import types
+import unittest
+
+from ellis.matches import Matches
+
+
+def rule(**kwargs):
+    """
+    Returns an object having the attributes of a Rule its Counter is built
+    from.
+    """
+    attrs = dict(name='rule', limit=1, findtime=None, max_keys=None,
+                 rearm='never', rearm_ttl=600, reset_on_fire=False,
+                 counting='exact')
+    attrs.update(kwargs)
+
+    return types.SimpleNamespace(**attrs)
+
+
+class MatchesTest(unittest.TestCase):
+    """
+    """
+    def test_fired_keys_count_in_global_cap(self):
+        for rearm in ('never', 'ttl'):
+            matches = Matches(max_keys=1000)
+            fired = rule(rearm=rearm)
+
+            with self.assertWarns(UserWarning):
+                for i in range(20000):
+                    matches.update(fired, i, 1000 + i / 1000)
+
+            self.assertLessEqual(matches.size(), 1000)
+            self.assertLessEqual(len(matches['rule'].actioned), 1000)
+
+    def test_rearmed_keys_are_forgotten_first(self):
+        matches = Matches(max_keys=100)
+        fired = rule(rearm='ttl', rearm_ttl=10, reset_on_fire=True)
+
+        for i in range(60):
+            matches.update(fired, i, 1000)
+
+        # The first keys are re-armed, recent ones are still suppressed:
+        for i in range(60, 120):
+            matches.update(fired, i, 1020)
+
+        self.assertEqual(matches.update(fired, 119, 1021), (None, False))
+        self.assertLessEqual(matches.size(), 100)
+
+    def test_fire_and_rearm(self):
+        matches = Matches()
+        fired = rule(limit=2, rearm='ttl', rearm_ttl=10)
+
+        self.assertEqual(matches.update(fired, 'key', 1000), (1, False))
+        self.assertEqual(matches.update(fired, 'key', 1001), (2, True))
+        self.assertEqual(matches.update(fired, 'key', 1002), (None, False))
+        self.assertEqual(matches.update(fired, 'key', 1012), (3, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
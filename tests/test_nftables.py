@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import unittest
+from unittest import mock
+
+from ellis_actions.nftables import (NFTablesBatch, NFTablesError,
+                                    NFTablesNoRights, NFTablesSetNotFound)
+
+
+class NFTablesBatchTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.batch = NFTablesBatch('inet', 'firewall')
+
+    def entries(self, *elements):
+        """
+        Returns a batch of (setname, ip, timeout, future) tuples for the
+        given (setname, ip, timeout) *elements*.
+        """
+        return [element + (self.loop.create_future(),)
+                for element in elements]
+
+    def process(self, batch, *results):
+        """
+        Processes *batch*, ``nft -f -`` returning the given (returncode,
+        stdout, stderr) *results*, one per process.
+
+        Returns the mocked :func:`run`.
+        """
+        run = mock.AsyncMock(side_effect=results)
+
+        with mock.patch.object(self.batch.nft, 'run', run):
+            self.loop.run_until_complete(self.batch.process(batch))
+
+        return run
+
+    def test_statements(self):
+        batch = self.entries(('ellis_blacklist4', '192.0.2.100', 0),
+                             ('ellis_blacklist6', '2001:db8::1', 30),
+                             ('ellis_blacklist4', '192.0.2.2', 30))
+
+        statements, positions = self.batch.statements(batch)
+        lines = statements.splitlines()
+
+        self.assertEqual(lines, [
+            'add element inet firewall ellis_blacklist4'
+            ' { 192.0.2.100, 192.0.2.2 timeout 30s }',
+            'add element inet firewall ellis_blacklist6'
+            ' { 2001:db8::1 timeout 30s }'])
+        self.assertEqual(positions[0], (1, 46, 56))
+
+        # Columns are numbered from 1 and the last one is included:
+        elements = [lines[lineno - 1][first - 1:last]
+                    for lineno, first, last in positions]
+
+        self.assertEqual(elements, ['192.0.2.100', '2001:db8::1 timeout 30s',
+                                    '192.0.2.2 timeout 30s'])
+
+    def test_located_error_is_retried(self):
+        batch = self.entries(('ellis_blacklist4', '192.0.2.100', 0),
+                             ('ellis_blacklist4', '192.0.2.2', 30))
+        error = (b'/dev/stdin:1:46-56: Error: Could not process rule:'
+                 b' File exists\n'
+                 b'add element inet firewall ellis_blacklist4'
+                 b' { 192.0.2.100, 192.0.2.2 timeout 30s }\n'
+                 b'                                             ^^^^^^^^^^^\n')
+
+        run = self.process(batch, (1, b'', error), (0, b'', b''))
+
+        self.assertIsInstance(batch[0][-1].exception(), NFTablesError)
+        self.assertIn('File exists', str(batch[0][-1].exception()))
+        self.assertIs(batch[1][-1].result(), True)
+
+        # Nothing was added by the first process, the other one is retried:
+        self.assertEqual(run.call_count, 2)
+        self.assertEqual(run.call_args[0][2],
+                         b'add element inet firewall ellis_blacklist4'
+                         b' { 192.0.2.2 timeout 30s }\n')
+
+    def test_error_on_the_set_fails_its_statement(self):
+        batch = self.entries(('ellis_blacklist4', '192.0.2.1', 0),
+                             ('missing', '192.0.2.2', 0),
+                             ('missing', '192.0.2.3', 0))
+        error = (b'/dev/stdin:2:27-33: Error: Could not process rule:'
+                 b' No such file or directory\n')
+
+        run = self.process(batch, (1, b'', error), (0, b'', b''))
+
+        self.assertIs(batch[0][-1].result(), True)
+
+        for entry in batch[1:]:
+            self.assertIsInstance(entry[-1].exception(), NFTablesSetNotFound)
+
+        self.assertEqual(run.call_count, 2)
+
+    def test_unlocated_error_fails_the_batch(self):
+        batch = self.entries(('ellis_blacklist4', '192.0.2.1', 0),
+                             ('ellis_blacklist4', '192.0.2.2', 0))
+
+        error = b'Error: Operation not permitted\n'
+
+        run = self.process(batch, (1, b'', error))
+
+        for entry in batch:
+            self.assertIsInstance(entry[-1].exception(), NFTablesNoRights)
+
+        self.assertEqual(run.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
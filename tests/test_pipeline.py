@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import unittest
+
+from ellis.pipeline import Pipeline
+
+
+class PipelineTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.source = list(range(100))
+        self.processed = []
+        self.done = []
+
+    def read(self, count):
+        """
+        Reads at most *count* entries from the fake source.
+        """
+        entries, self.source[:count] = self.source[:count], []
+
+        return entries
+
+    async def process(self, batch):
+        """
+        Records the entries of the given *batch*.
+        """
+        # Later batches are processed faster, so that they complete first:
+        await asyncio.sleep(0.01 if batch[0] % 20 == 0 else 0)
+        self.processed.extend(batch)
+
+    def pipeline(self, **kwargs):
+        """
+        Returns a Pipeline reading the fake source, by batches of 10.
+        """
+        return Pipeline(self.read, self.process, batch_size=10,
+                        done=self.done.append, loop=self.loop, **kwargs)
+
+    def feed(self, pipeline):
+        """
+        Runs the given *pipeline* until the fake source is exhausted.
+        """
+        async def run():
+            pipeline.start()
+
+            while self.source or pipeline.pending or pipeline.blocked:
+                pipeline.drain()
+                await asyncio.sleep(0)
+
+            await pipeline.join()
+            await pipeline.stop()
+
+        self.loop.run_until_complete(run())
+
+    def test_done_in_order(self):
+        pipeline = Pipeline(self.read, self.process, done=self.done.append,
+                            loop=self.loop)
+
+        for sequence in (1, 2, 0, 4, 3):
+            pipeline.complete(sequence, [sequence])
+
+        self.assertEqual(self.done, [[2], [4]])
+
+    def test_block(self):
+        pipeline = self.pipeline(queue_size=1, workers=2, policy='block')
+        self.feed(pipeline)
+
+        self.assertEqual(sorted(self.processed), list(range(100)))
+        self.assertEqual(pipeline.dropped, 0)
+        self.assertEqual(self.done[-1], list(range(90, 100)))
+
+    def test_drop(self):
+        pipeline = self.pipeline(queue_size=1, workers=1, policy='drop')
+
+        with self.assertWarns(UserWarning):
+            self.feed(pipeline)
+
+        self.assertGreater(pipeline.dropped, 0)
+        self.assertEqual(len(self.processed) + pipeline.dropped, 100)
+
+        # Dropped batches count as processed, in order:
+        firsts = [batch[0] for batch in self.done]
+        self.assertEqual(firsts, sorted(firsts))
+        self.assertEqual(self.done[-1], list(range(90, 100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import unittest
+
+from ellis.rule import Rule
+from ellis.ruleset import RuleSet
+
+
+FILTERS = [
+    # Same group names in several patterns and several Rules:
+    r'Failed password for (?P<user>\S+) from (?P<ip>[\d.]+)' '\n'
+    r'Invalid user (?P<user>\S+) from (?P<ip>[\d.]+)',
+    r'from (?P<ip>[\d.]+)',
+    # Unnamed groups shift the indexes of the following patterns:
+    r'(?:Accepted|Failed) (password|publickey) for (?P<user>\w+)',
+    # Numbered back-reference and inline flag, kept standalone:
+    r'(?P<word>\w+) \1',
+    r'(?i)DISCONNECTED from (?P<ip>[\d.]+)',
+    # No required literal:
+    r'^(?P<first>\w)\w*$',
+]
+
+MESSAGES = [
+    'Failed password for root from 1.2.3.4 port 22',
+    'Invalid user admin from 5.6.7.8',
+    'Accepted publickey for bob',
+    'hello hello world',
+    'Disconnected from 9.9.9.9',
+    'nothing',
+    'nothing to see here',
+    '',
+]
+
+
+def reference(rules, message):
+    """
+    Searches *message* with every pattern of every Rule, one by one.
+    """
+    results = []
+
+    for rule in rules:
+        for index, regex in enumerate(rule.filter):
+            match = regex.search(message)
+
+            if match is None:
+                continue
+
+            groupdict = rule.filter.convert(index, match.groupdict())
+
+            if groupdict is not None:
+                results.append((rule, regex, groupdict))
+
+    return results
+
+
+class RuleSetTest(unittest.TestCase):
+    """
+    """
+    def check(self, rules, messages):
+        ruleset = RuleSet(rules)
+
+        for message in messages:
+            self.assertEqual(ruleset.search(message),
+                             reference(rules, message), message)
+
+    def test_same_results_as_every_regex(self):
+        rules = [Rule('r{0}'.format(i), f, 5, 'dummy.wait()')
+                 for i, f in enumerate(FILTERS)]
+
+        self.check(rules, MESSAGES)
+
+    def test_several_alternations(self):
+        # More patterns than fit in a single alternation:
+        filter = '\n'.join(r'event{0} (?P<value>\d+)'.format(i)
+                           for i in range(RuleSet.chunk_size * 2 + 5))
+        rules = [Rule('r', filter, 5, 'dummy.wait()')]
+
+        self.check(rules, ['event{0} 12'.format(i)
+                           for i in range(RuleSet.chunk_size * 2 + 5)])
+
+        self.assertGreater(len(RuleSet(rules).view(False)[1]), 2)
+
+    def test_unsafe_patterns_are_standalone(self):
+        rules = [Rule('r', r'(?P<word>\w+) \1', 5, 'dummy.wait()')]
+        prefilter, combined, standalone, unguarded = \
+            RuleSet(rules).view(False)
+
+        self.assertEqual(combined, [])
+        self.assertEqual(len(standalone), 1)
+
+    def test_prefilter(self):
+        rules = [Rule('r', r'Failed password for (?P<user>\S+)', 5,
+                      'dummy.wait()')]
+        ruleset = RuleSet(rules)
+
+        self.assertEqual(ruleset._scan('Accepted publickey for bob'),
+                         ([], True))
+        self.assertEqual(ruleset._scan('FAILED PASSWORD FOR bob'),
+                         ([(0, 0, {'user': 'bob'})], False))
+
+        # A pattern without a required literal is always scanned:
+        rules.append(Rule('s', r'(?P<x>\d+)', 5, 'dummy.wait()'))
+
+        self.assertEqual(RuleSet(rules)._scan('port 22'),
+                         ([(1, 0, {'x': '22'})], False))
+
+    def test_rename_groups(self):
+        renamed = RuleSet.rename_groups(r'(?P<ip>\S+) \\(?P<x>y) (?P=ip)',
+                                        '_p1_')
+
+        self.assertEqual(renamed,
+                         r'(?P<_p1_ip>\S+) \\(?P<_p1_x>y) (?P=_p1_ip)')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import unittest
+
+from ellis.scheduler import ActionScheduler
+
+
+class FakeAction(object):
+    """
+    Stands for an :class:`action.Action` of the given module, recording
+    when it starts and running until its *gate* is set.
+    """
+    def __init__(self, mod_name, started, gate):
+        self.mod_name = mod_name
+        self.started = started
+        self.gate = gate
+
+    async def func(self):
+        pass
+
+    async def run(self, kwargs, executor):
+        self.started.append((self.mod_name, kwargs))
+        await self.gate.wait()
+
+        return kwargs
+
+
+class ActionSchedulerTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.started = []
+        self.gate = asyncio.Event()
+
+        # Let the Actions still waiting end before the loop is closed:
+        self.addCleanup(self.settle)
+
+    def scheduler(self, **kwargs):
+        """
+        Returns an ActionScheduler running on the test loop.
+        """
+        scheduler = ActionScheduler(loop=self.loop, **kwargs)
+        self.addCleanup(scheduler.stop)
+
+        return scheduler
+
+    def submit(self, scheduler, *mod_names):
+        """
+        Submits a FakeAction per given module, with its index as kwargs,
+        and lets the started ones run until their gate.
+
+        Returns their futures.
+        """
+        async def submit():
+            futures = [scheduler.submit(
+                FakeAction(name, self.started, self.gate), i)
+                for i, name in enumerate(mod_names)]
+            await asyncio.sleep(0)
+
+            return futures
+
+        return self.loop.run_until_complete(submit())
+
+    def settle(self, futures=()):
+        """
+        Opens the gate and waits for the given *futures*, and for every
+        running Action.
+        """
+        async def settle():
+            self.gate.set()
+            results = await asyncio.gather(*futures, return_exceptions=True)
+
+            await asyncio.gather(
+                *(asyncio.all_tasks() - {asyncio.current_task()}))
+
+            return results
+
+        return self.loop.run_until_complete(settle())
+
+    def test_lowest_priority_value_first(self):
+        scheduler = self.scheduler(workers=1)
+        futures = self.submit(scheduler, 'mail', 'other', 'ipset', 'ipset')
+
+        self.assertEqual(self.settle(futures), [0, 1, 2, 3])
+
+        # The first Action got the only worker, then the bans came first:
+        self.assertEqual(self.started, [('mail', 0), ('ipset', 2),
+                                        ('ipset', 3), ('other', 1)])
+
+    def test_lane_limit(self):
+        scheduler = self.scheduler(workers=4, limit=1, limits={'ipset': 2})
+        self.submit(scheduler, 'mail', 'mail', 'ipset', 'ipset', 'ipset')
+
+        self.assertEqual(self.started, [('mail', 0), ('ipset', 2),
+                                        ('ipset', 3)])
+        self.assertEqual(scheduler.running, 3)
+        self.assertEqual(scheduler.queued, 2)
+
+    def test_drop_policy(self):
+        scheduler = self.scheduler(workers=1, queue_size=1, policy='drop')
+        running, queued = self.submit(scheduler, 'mail', 'mail')
+
+        with self.assertWarns(UserWarning):
+            dropped, = self.submit(scheduler, 'ipset')
+
+        self.assertTrue(dropped.cancelled())
+        self.assertFalse(queued.done())
+        self.assertEqual(scheduler.dropped, 1)
+        self.assertEqual(scheduler.lane('ipset').dropped, 1)
+
+    def test_lowest_policy(self):
+        scheduler = self.scheduler(workers=1, queue_size=2)
+        running, mail, other = self.submit(scheduler, 'ipset', 'mail', 'other')
+
+        # Room is made by dropping the newest Action of the lowest lane:
+        with self.assertWarns(UserWarning):
+            ban, = self.submit(scheduler, 'ipset')
+
+        self.assertTrue(mail.cancelled())
+        self.assertFalse(other.done())
+        self.assertEqual(scheduler.lane('mail').dropped, 1)
+
+        # Unless the new Action comes from it or a lower lane:
+        late, = self.submit(scheduler, 'mail')
+
+        self.assertTrue(late.cancelled())
+        self.assertEqual(scheduler.dropped, 2)
+
+        self.settle([running, other, ban])
+        self.assertEqual(self.started, [('ipset', 0), ('ipset', 0),
+                                        ('other', 2)])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            ActionScheduler(policy='random', loop=self.loop)
+
+    def test_stats(self):
+        scheduler = self.scheduler(workers=1)
+        futures = self.submit(scheduler, 'mail', 'ipset')
+
+        self.assertEqual([s[:6] for s in scheduler.stats()],
+                         [('ipset', 1, 0, 8, 0, 0), ('mail', 0, 1, 8, 0, 0)])
+
+        self.settle(futures)
+
+        self.assertEqual([s[:6] for s in scheduler.stats()],
+                         [('ipset', 0, 0, 8, 1, 0), ('mail', 0, 0, 8, 1, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
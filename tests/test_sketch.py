@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import unittest
+import warnings
+
+from ellis.matches import ApproximateCounter
+from ellis.rule import Rule
+from ellis.sketch import CountMinSketch
+
+
+class CountMinSketchTest(unittest.TestCase):
+    """
+    """
+    def test_estimates_are_never_too_low(self):
+        sketch = CountMinSketch(error=0.01, confidence=0.99)
+
+        for i in range(5000):
+            sketch.add(i % 500)
+
+        for key in range(500):
+            self.assertGreaterEqual(sketch.estimate(key), 10)
+
+    def test_estimates_are_within_the_error_bound(self):
+        sketch = CountMinSketch(error=0.001, confidence=0.99)
+
+        for i in range(20000):
+            sketch.add(i)
+
+        self.assertEqual(sketch.count, 20000)
+        self.assertEqual(sketch.error_bound(), 20)
+
+        within = sum(sketch.estimate(key) <= 1 + sketch.error_bound()
+                     for key in range(1000))
+        self.assertGreaterEqual(within, 990)
+
+    def test_window_expires(self):
+        sketch = CountMinSketch(error=0.01, findtime=60)
+
+        sketch.add('key', timestamp=1000, amount=3)
+        sketch.add('key', timestamp=1030)
+        self.assertEqual(sketch.estimate('key'), 4)
+        self.assertEqual(sketch.count, 4)
+
+        # The first generation falls out of the window:
+        sketch.add('other', timestamp=1065)
+        self.assertEqual(sketch.estimate('key'), 1)
+        self.assertEqual(sketch.count, 2)
+
+        sketch.add('other', timestamp=10000)
+        self.assertEqual(sketch.estimate('key'), 0)
+        self.assertEqual(sketch.count, 1)
+
+    def test_old_matches_are_ignored(self):
+        sketch = CountMinSketch(error=0.01, findtime=60)
+
+        sketch.add('key', timestamp=1000)
+        sketch.add('key', timestamp=900)
+        self.assertEqual(sketch.estimate('key'), 1)
+
+    def test_invalid_bounds(self):
+        with self.assertRaises(ValueError):
+            CountMinSketch(error=0)
+
+        with self.assertRaises(ValueError):
+            CountMinSketch(confidence=1)
+
+
+class ApproximateCounterTest(unittest.TestCase):
+    """
+    """
+    def hit(self, counter, key, timestamp=1000):
+        """
+        Counts a match of *key*, returns its exact count.
+        """
+        return counter.get(counter.increment(key, timestamp), 0)
+
+    def test_requires_findtime(self):
+        with self.assertRaises(ValueError):
+            ApproximateCounter(threshold=5)
+
+        with self.assertRaises(ValueError):
+            Rule('rule', '(?P<ip><IP>)', 5, 'dummy.wait',
+                 counting='approximate')
+
+    def test_fires_like_exact_counting_without_flood(self):
+        counter = ApproximateCounter(findtime=600, threshold=5)
+
+        counts = [self.hit(counter, 'offender') for i in range(6)]
+
+        self.assertEqual(counts, [0, 0, 0, 0, 5, 6])
+        self.assertEqual(counter.promoted, 1)
+
+    def test_flood_does_not_promote_innocent_keys(self):
+        counter = ApproximateCounter(findtime=600, threshold=5, error=0.0001)
+
+        with self.assertWarns(UserWarning):
+            for i in range(100000):
+                self.hit(counter, ('flood', i))
+
+        self.assertGreaterEqual(counter.sketch.error_bound(), 5)
+
+        innocent = [self.hit(counter, ('fresh', i)) for i in range(1000)]
+
+        self.assertEqual(sum(count >= 5 for count in innocent), 0)
+        self.assertLess(counter.promoted, 100)
+
+    def test_offender_fires_during_flood(self):
+        counter = ApproximateCounter(findtime=600, threshold=5, error=0.0001)
+
+        with self.assertWarns(UserWarning):
+            for i in range(100000):
+                self.hit(counter, ('flood', i))
+
+        bound = counter.sketch.error_bound()
+
+        for hit in range(1, 5 + 2 * bound):
+            for i in range(100):
+                self.hit(counter, ('noise', hit, i))
+
+            if self.hit(counter, 'offender') >= 5:
+                break
+
+        self.assertLess(hit, 5 + 2 * bound - 1)
+
+    def test_warns_when_saturated(self):
+        counter = ApproximateCounter(findtime=600, threshold=2, error=0.01)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+
+            for i in range(1000):
+                self.hit(counter, i % 300)
+
+        self.assertEqual(len(caught), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import asyncio
+import json
+import os
+import struct
+import tempfile
+import unittest
+
+from ellis.sources import FileSource, ReplaySource, SyslogSource
+
+
+class ReplaySourceTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def replay(self, data, **kwargs):
+        """
+        Replays the given *data* (bytes) from a file.
+
+        Returns the list of the replayed entries.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        path = os.path.join(directory.name, 'journal')
+
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        source = ReplaySource(path, **kwargs)
+        finished = self.loop.create_future()
+        entries = []
+
+        def notify():
+            entries.extend(source.read(2))
+
+            if source.entries is not None:
+                self.loop.call_soon(notify)
+
+        source.start(self.loop, notify, lambda: finished.set_result(True))
+        self.loop.run_until_complete(asyncio.wait_for(finished, 5))
+
+        return entries
+
+    def test_guess_format(self):
+        self.assertEqual(ReplaySource.guess_format(b'  {"MESSAGE": "x"}'),
+                         'json')
+        self.assertEqual(ReplaySource.guess_format(b'__CURSOR=s\nMESSAGE=x'),
+                         'export')
+        self.assertEqual(ReplaySource.guess_format(b'Failed password=x'),
+                         'text')
+
+    def test_json(self):
+        lines = [
+            {'MESSAGE': 'hello', '_SYSTEMD_UNIT': 'sshd.service',
+             '__CURSOR': 's=1', '__REALTIME_TIMESTAMP': '1500000000000000',
+             '_PID': '42'},
+            {'MESSAGE': list(b'binary \xc3\xa9'), 'PRIORITY': ['6', '4']},
+        ]
+        data = b''.join(json.dumps(line).encode() + b'\n' for line in lines)
+
+        with self.assertWarns(UserWarning):
+            entries = self.replay(data + b'not json\n')
+
+        # Cursors and unneeded fields are dropped:
+        self.assertEqual(entries, [
+            {'MESSAGE': 'hello', '_SYSTEMD_UNIT': 'sshd.service',
+             '__REALTIME_TIMESTAMP': 1500000000000000},
+            {'MESSAGE': 'binary \xe9', 'PRIORITY': '4'},
+        ])
+
+    def test_export(self):
+        binary = b'multi\nline'
+        data = b'__CURSOR=s=1\nMESSAGE=first\nSYSLOG_IDENTIFIER=sshd\n\n' \
+               + b'MESSAGE\n' + struct.pack('<Q', len(binary)) + binary \
+               + b'\n__REALTIME_TIMESTAMP=12\n\n'
+
+        self.assertEqual(self.replay(data, format='export'), [
+            {'MESSAGE': 'first', 'SYSLOG_IDENTIFIER': 'sshd'},
+            {'MESSAGE': 'multi\nline', '__REALTIME_TIMESTAMP': 12},
+        ])
+
+    def test_text(self):
+        entries = self.replay(b'one\r\ntwo\nthree', unit='sshd.service',
+                              raw_messages=True)
+
+        self.assertEqual(entries, [
+            {'MESSAGE': message, '_SYSTEMD_UNIT': 'sshd.service'}
+            for message in (b'one', b'two', b'three')])
+
+    def test_speed(self):
+        data = b''.join(json.dumps({
+            'MESSAGE': str(i),
+            '__REALTIME_TIMESTAMP': str(i * 100000)}).encode() + b'\n'
+            for i in range(3))
+
+        start = self.loop.time()
+        entries = self.replay(data, speed=2)
+
+        # 0.2s of entries, replayed twice as fast:
+        self.assertGreaterEqual(self.loop.time() - start, 0.09)
+        self.assertEqual([entry['MESSAGE'] for entry in entries],
+                         ['0', '1', '2'])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            ReplaySource('-', format='xml')
+
+        with self.assertRaises(ValueError):
+            ReplaySource('-', speed=-1)
+
+
+
+class FileSourceTest(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.path = os.path.join(directory.name, 'auth.log')
+        self.write(b'old line\n')
+
+        self.source = FileSource(self.path, unit='sshd.service')
+        self.source.open(os.SEEK_END)
+        self.addCleanup(self.source.stop)
+
+    def write(self, data, path=None, mode='ab'):
+        """
+        Writes *data* to the log file (or to the file at *path*).
+        """
+        with open(path or self.path, mode) as f:
+            f.write(data)
+
+    def messages(self):
+        """
+        Returns the messages of the lines read from the log file.
+        """
+        return [entry['MESSAGE'] for entry in self.source.read(100)]
+
+    def test_tail(self):
+        self.write(b'first\nsecond\r\nthi')
+
+        self.assertEqual(self.messages(), ['first', 'second'])
+
+        self.write(b'rd\n')
+        entries = self.source.read(100)
+
+        self.assertEqual(entries[0]['MESSAGE'], 'third')
+        self.assertEqual(entries[0]['_SYSTEMD_UNIT'], 'sshd.service')
+
+    def test_rotation(self):
+        self.write(b'before\n')
+        os.rename(self.path, self.path + '.1')
+
+        # Written to the rotated file before it is closed:
+        self.write(b'late\nunterminated', self.path + '.1')
+        self.write(b'new\n')
+
+        self.assertEqual(self.messages(),
+                         ['before', 'late', 'unterminated', 'new'])
+
+    def test_missing_file(self):
+        os.unlink(self.path)
+
+        self.assertEqual(self.messages(), [])
+
+        self.write(b'created\n')
+
+        self.assertEqual(self.messages(), ['created'])
+
+    def test_truncation(self):
+        self.write(b'a much longer line than the next one\n')
+        self.assertEqual(len(self.messages()), 1)
+
+        # copytruncate:
+        self.write(b'short\n', mode='wb')
+
+        self.assertEqual(self.messages(), ['short'])
+
+    def test_inotify(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        source = FileSource(self.path)
+        notified = loop.create_future()
+        source.start(loop, lambda: notified.done()
+                     or notified.set_result(True))
+        self.addCleanup(source.stop)
+
+        self.write(b'written\n')
+        loop.run_until_complete(asyncio.wait_for(notified, 5))
+
+        self.assertEqual([entry['MESSAGE'] for entry in source.read(10)],
+                         ['written'])
+
+
+class SyslogSourceTest(unittest.TestCase):
+    """
+    """
+    def parse(self, datagram, **kwargs):
+        """
+        Parses the given *datagram*, received at 12.
+        """
+        return SyslogSource('/nonexistent', **kwargs).parse(datagram, 12)
+
+    def test_rfc5424(self):
+        self.assertEqual(self.parse(
+            b'<34>1 2003-10-11T22:14:15.003Z host sshd 1234 ID47 - '
+            b'\xef\xbb\xbfFailed password\n'), {
+                'MESSAGE': 'Failed password',
+                'SYSLOG_IDENTIFIER': 'sshd',
+                '_SYSTEMD_UNIT': 'sshd.service',
+                'PRIORITY': '2',
+                '__REALTIME_TIMESTAMP': 12})
+
+    def test_rfc5424_structured_data(self):
+        entry = self.parse(b'<165>1 2003-10-11T22:14:15Z host app - - '
+                           b'[id@1 a="1" b="\\]"][id@2] message')
+
+        self.assertEqual(entry['MESSAGE'], 'message')
+        self.assertEqual(entry['SYSLOG_IDENTIFIER'], 'app')
+
+        entry = self.parse(b'<165>1 - - - - - -')
+
+        self.assertEqual(entry['MESSAGE'], '')
+        self.assertNotIn('SYSLOG_IDENTIFIER', entry)
+
+    def test_rfc3164(self):
+        for datagram in (b'<13>Oct  1 22:14:15 host sshd[42]: Failed',
+                         b'<13>Oct 11 22:14:15 sshd[42]: Failed',
+                         b'<13>sshd: Failed'):
+            entry = self.parse(datagram)
+
+            self.assertEqual(entry['MESSAGE'], 'Failed', datagram)
+            self.assertEqual(entry['SYSLOG_IDENTIFIER'], 'sshd', datagram)
+            self.assertEqual(entry['PRIORITY'], '5', datagram)
+
+    def test_unknown_format(self):
+        entry = self.parse(b'just a message\0', raw_messages=True,
+                           fields=('MESSAGE',))
+
+        self.assertEqual(entry, {'MESSAGE': b'just a message',
+                                 '__REALTIME_TIMESTAMP': 12})
+
+
+if __name__ == '__main__':
+    unittest.main()